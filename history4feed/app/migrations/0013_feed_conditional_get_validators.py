@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history4feed', '0012_post_h4f_feed_pk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='content_hash',
+            field=models.CharField(default=None, help_text='sha256 of the body returned by the last fetch of the live feed', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='etag',
+            field=models.CharField(default=None, help_text='ETag returned by the last fetch of the live feed', max_length=1000, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='last_modified',
+            field=models.CharField(default=None, help_text='Last-Modified returned by the last fetch of the live feed', max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history4feed', '0013_feed_conditional_get_validators'),
+    ]
+
+    operations = [
+        # existing feeds keep fetching every post, only new feeds default to `auto`
+        migrations.AddField(
+            model_name='feed',
+            name='feed_content_policy',
+            field=models.CharField(choices=[('never', 'Never'), ('auto', 'Auto'), ('always', 'Always')], default='never', help_text='when the full text embedded in the feed (`content:encoded` or ATOM `content`) is used instead of fetching the post. `never` always fetches, `auto` uses embedded content that looks complete, `always` uses any embedded content', max_length=12),
+        ),
+        migrations.AlterField(
+            model_name='feed',
+            name='feed_content_policy',
+            field=models.CharField(choices=[('never', 'Never'), ('auto', 'Auto'), ('always', 'Always')], default='auto', help_text='when the full text embedded in the feed (`content:encoded` or ATOM `content`) is used instead of fetching the post. `never` always fetches, `auto` uses embedded content that looks complete, `always` uses any embedded content', max_length=12),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history4feed', '0014_feed_feed_content_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='cdx_digests',
+            field=models.JSONField(blank=True, default=list, help_text='digests of the Wayback Machine captures already processed for this feed'),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='cdx_watermark',
+            field=models.CharField(default=None, help_text='timestamp of the latest Wayback Machine capture processed for this feed, later jobs only list newer captures', max_length=14, null=True),
+        ),
+    ]
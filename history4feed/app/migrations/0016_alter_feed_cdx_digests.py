@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+def digests_with_timestamps(apps, schema_editor):
+    # the captures were processed at the latest at the watermark, they are forgotten once it moves on
+    Feed = apps.get_model('history4feed', 'Feed')
+    for feed in Feed.objects.exclude(cdx_digests={}).iterator():
+        if isinstance(feed.cdx_digests, list):
+            feed.cdx_digests = dict.fromkeys(feed.cdx_digests, (feed.cdx_watermark or '').ljust(14, '0'))
+            feed.save(update_fields=['cdx_digests'])
+
+
+def digests_without_timestamps(apps, schema_editor):
+    Feed = apps.get_model('history4feed', 'Feed')
+    for feed in Feed.objects.exclude(cdx_digests=[]).iterator():
+        if isinstance(feed.cdx_digests, dict):
+            feed.cdx_digests = sorted(feed.cdx_digests)
+            feed.save(update_fields=['cdx_digests'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('history4feed', '0015_feed_cdx_watermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feed',
+            name='cdx_digests',
+            field=models.JSONField(blank=True, default=dict, help_text='digests of the Wayback Machine captures already processed for this feed, with the timestamp of their latest capture. only the ones captured shortly before the watermark or later are kept'),
+        ),
+        migrations.RunPython(digests_with_timestamps, digests_without_timestamps),
+    ]
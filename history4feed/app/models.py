@@ -64,6 +64,12 @@ def title_as_string(value: str):
     return value
 
 
+class FeedContentPolicy(models.TextChoices):
+    NEVER = "never"
+    AUTO = "auto"
+    ALWAYS = "always"
+
+
 class SourceCategory(models.TextChoices):
     UNCATEGORIZED = "uncategorized"
     VENDOR = "vendor"
@@ -91,6 +97,12 @@ class Feed(models.Model):
     pretty_url = models.URLField(max_length=1000, null=True, default=None)
     freshness = models.DateTimeField(null=True, default=None)
     use_scrapfly_asp = models.BooleanField(default=False)
+    etag = models.CharField(max_length=1000, null=True, default=None, help_text="ETag returned by the last fetch of the live feed")
+    last_modified = models.CharField(max_length=100, null=True, default=None, help_text="Last-Modified returned by the last fetch of the live feed")
+    content_hash = models.CharField(max_length=64, null=True, default=None, help_text="sha256 of the body returned by the last fetch of the live feed")
+    cdx_watermark = models.CharField(max_length=14, null=True, default=None, help_text="timestamp of the latest Wayback Machine capture processed for this feed, later jobs only list newer captures")
+    cdx_digests = models.JSONField(default=dict, blank=True, help_text="digests of the Wayback Machine captures already processed for this feed, with the timestamp of their latest capture. only the ones captured shortly before the watermark or later are kept")
+    feed_content_policy = models.CharField(max_length=12, choices=FeedContentPolicy.choices, default=FeedContentPolicy.AUTO, help_text="when the full text embedded in the feed (`content:encoded` or ATOM `content`) is used instead of fetching the post. `never` always fetches, `auto` uses embedded content that looks complete, `always` uses any embedded content")
 
     def get_post_count(self):
         return self.posts.filter(deleted_manually=False).count()
@@ -167,7 +179,7 @@ class Job(models.Model):
     @property
     def feed_url_fails(self):
         for process in self.extra_data.get('feed_urls', []):
-            if process['state'] == 'failed':
+            if process['state'] in ('failed', 'partial'):
                 return True
         return False
     
@@ -29,7 +29,7 @@ class FeedSerializer(serializers.ModelSerializer):
     class Meta:
         model = Feed
         # fields = '__all__'
-        exclude = ['freshness']
+        exclude = ['freshness', 'etag', 'last_modified', 'content_hash', 'cdx_watermark', 'cdx_digests']
         read_only_fields = ['id', 'earliest_item_pubdate', 'latest_item_pubdate', 'datetime_added', "datetime_modified"]
 
     def create(self, validated_data: dict):
@@ -128,7 +128,7 @@ class FeedPatchSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Feed
-        fields = ['title', 'description', 'pretty_url', 'source_category', 'use_scrapfly_asp']
+        fields = ['title', 'description', 'pretty_url', 'source_category', 'use_scrapfly_asp', 'feed_content_policy']
 
 class FeedFetchSerializer(serializers.Serializer):
     force_full_fetch = serializers.BooleanField(write_only=True, default=False, help_text="If true, will re-fetch all items from the earliest search date instead of from the latest known item date.")
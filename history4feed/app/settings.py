@@ -16,6 +16,47 @@ H4F_DEFAULTS: dict[str, any] = {
     "BRAVE_SEARCH_API_KEY": None,
     "FULLTEXT_FETCH_TIMEOUT_SECONDS": 100, # time limit for fulltext fetch tasks
     "CREATE_POSTS_MAX_LENGTH": 100, # maximum number of posts that can be created in a single request
+    "HTTP_POOL_CONNECTIONS": 32, # number of per-host connection pools kept by each worker process
+    "HTTP_POOL_MAXSIZE": 10, # maximum number of keep-alive connections kept per host
+    "HTTP_POOL_IDLE_TIMEOUT_SECONDS": 300, # pooled sessions unused for this long are closed and recreated
+    "FULLTEXT_ENGINE": "asyncio", # `asyncio` fetches the posts of a job concurrently, `chain` fetches them one after another
+    "FULLTEXT_CONCURRENCY": 16, # maximum number of fulltext fetches running at once in a job
+    "FULLTEXT_PER_HOST_CONCURRENCY": 4, # maximum number of fulltext fetches running at once against a single host
+    "FULLTEXT_BATCH_SIZE": 20, # number of fulltext results written to the database at once
+    "HOST_RATE_LIMITS": { # requests per second (and burst size) allowed per host, shared by all workers
+        "web.archive.org": dict(rate=1, burst=3),
+        "api.scrapfly.io": dict(rate=5, burst=10),
+        "google.serper.dev": dict(rate=5, burst=5),
+        "default": dict(rate=2, burst=4),
+    },
+    "RATE_LIMIT_REDIS_URL": None, # redis used to share rate limits between workers, defaults to CELERY_BROKER_URL
+    "SNAPSHOT_STORE_DIR": None, # directory wayback snapshots are archived in, archiving is disabled when not set
+    "SNAPSHOT_STORE_MAX_BYTES": 5 * 1024 * 1024 * 1024, # least recently used snapshots are evicted above this size
+    "SNAPSHOT_STORE_DICT_SAMPLES": 8, # number of snapshots of a feed used to train its compression dictionary
+    "MAX_DECODED_BODY_BYTES": 32 * 1024 * 1024, # fetches whose decoded body grows over this size are aborted
+    "MAX_DOWNLOAD_BYTES": 16 * 1024 * 1024, # fetches that download more than this many bytes are aborted
+    "WAYBACK_URL": "https://web.archive.org", # where the CDX server and wayback snapshots are requested from, e.g. a local stand-in for load tests
+    "SCRAPFLY_URL": "https://api.scrapfly.io/scrape", # scrapfly scrape API endpoint
+    "SCRAPFLY_ROUTING": "adaptive", # `adaptive` fetches directly and only uses scrapfly for hosts that block us, `always` sends every fetch through scrapfly
+    "SCRAPFLY_ROUTE_TTL_SECONDS": 24 * 60 * 60, # how long the route chosen for a host is remembered
+    "SCRAPFLY_AUTO_ASP": True, # retry with scrapfly ASP when a host blocks scrapfly without it
+    "RETRY_MODE": "sleep", # `sleep` retries failed fetches inside the task, `countdown` re-enqueues the task with a countdown so the worker is free in the meantime
+    "CIRCUIT_BREAKER_FAILURE_THRESHOLD": 5, # consecutive connection errors or 5xx responses before requests to a host are skipped, 0 disables the breaker
+    "CIRCUIT_BREAKER_COOLDOWN_SECONDS": 300, # how long requests to a failing host are skipped before it is probed again
+    "SNAPSHOT_GROUP_SIZE": 20, # feed urls of a job read at the same time, each one in its own task so they spread over all workers
+    "PLAN_WAYBACK_SNAPSHOTS": True, # only read the wayback captures needed to see every post, instead of all of them
+    "CDX_PAGE_SIZE": 5000, # captures listed per CDX request, larger listings are read page by page with a resume key
+    "CDX_CACHE_BUCKET_DAYS": 7, # CDX listings are cached in redis in buckets of this many days, 0 disables the cache
+    "CDX_CACHE_SECONDS": 30 * 24 * 60 * 60, # how long past buckets of a CDX listing stay cached
+    "CDX_CACHE_OPEN_SECONDS": 10 * 60, # how long the latest bucket of a CDX listing, still getting new captures, stays cached
+    "SERPER_CONCURRENCY": 4, # search index date windows queried at once
+    "SERPER_CREDIT_BUDGET": 1000, # serper credits a search index job can use, 0 for no limit
+    "EXTRACTION_PROCESSES": os.cpu_count(), # number of processes per worker running readability on fetched pages, 0 runs it in the fetching thread. only used by workers not running celery's prefork pool
+    "FULLTEXT_QUEUE": None, # celery queue the fulltext tasks are sent to, consumed by a `--pool threads` worker that can run the extraction processes. the default queue when not set
+    "FEED_CONTENT_MIN_LENGTH": 1000, # characters of text content embedded in a feed needs before `auto` feeds use it as the full text
+    "FEED_PARSER_ENGINE": "lxml", # `lxml` parses feed items one at a time as the document is read, `minidom` loads the whole document first
+    "HTTP_CONNECT_TIMEOUT_SECONDS": 10,
+    "HTTP_READ_TIMEOUT_SECONDS": 30, # maximum time to wait between two bytes of a response
 }
 
 IMPORT_STRINGS = [
@@ -30,6 +71,42 @@ class History4FeedServerSettings(APISettings):
     BRAVE_SEARCH_API_KEY: str
     FULLTEXT_FETCH_TIMEOUT_SECONDS: int
     CREATE_POSTS_MAX_LENGTH: int
+    HTTP_POOL_CONNECTIONS: int
+    HTTP_POOL_MAXSIZE: int
+    HTTP_POOL_IDLE_TIMEOUT_SECONDS: int
+    FULLTEXT_ENGINE: str
+    FULLTEXT_CONCURRENCY: int
+    FULLTEXT_PER_HOST_CONCURRENCY: int
+    FULLTEXT_BATCH_SIZE: int
+    HOST_RATE_LIMITS: dict[str, dict[str, float]]
+    RATE_LIMIT_REDIS_URL: str
+    SNAPSHOT_STORE_DIR: str
+    SNAPSHOT_STORE_MAX_BYTES: int
+    SNAPSHOT_STORE_DICT_SAMPLES: int
+    MAX_DECODED_BODY_BYTES: int
+    MAX_DOWNLOAD_BYTES: int
+    WAYBACK_URL: str
+    SCRAPFLY_URL: str
+    SCRAPFLY_ROUTING: str
+    SCRAPFLY_ROUTE_TTL_SECONDS: int
+    SCRAPFLY_AUTO_ASP: bool
+    RETRY_MODE: str
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS: int
+    SNAPSHOT_GROUP_SIZE: int
+    PLAN_WAYBACK_SNAPSHOTS: bool
+    CDX_PAGE_SIZE: int
+    CDX_CACHE_BUCKET_DAYS: int
+    CDX_CACHE_SECONDS: int
+    CDX_CACHE_OPEN_SECONDS: int
+    SERPER_CONCURRENCY: int
+    SERPER_CREDIT_BUDGET: int
+    EXTRACTION_PROCESSES: int
+    FULLTEXT_QUEUE: str
+    FEED_CONTENT_MIN_LENGTH: int
+    FEED_PARSER_ENGINE: str
+    HTTP_CONNECT_TIMEOUT_SECONDS: float
+    HTTP_READ_TIMEOUT_SECONDS: float
     @property
     def user_settings(self):
         if not hasattr(self, '_user_settings'):
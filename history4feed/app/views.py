@@ -337,6 +337,7 @@ class FeedView(viewsets.ModelViewSet):
             * `use_search_index` (optional, default is `false`): If the `url` is not a valid RSS or ATOM feed you must set this mode to `true`. Set to `true` this mode uses search results that contain the base `url` passed vs. the RSS/ATOM feed entries (when this mode is set to `false`). This mode is only be able to index results in Google Search, so can miss some sites entirely where they are not indexed by Google. You must also pass a `title` and `description` when setting this mode to `true`. Note, you can use the skeleton endpoint to create a feed manually from a non RSS/ATOM URL or where search results do not satisfy your use case.
             * `source_category` (optional, default is `uncategorized`, list): can be used to categories the feed. Options available are: `analyst`, `community`, `government`, `media`, or `vendor`.
             * `use_scrapfly_asp` (optional, boolean, default `false`): set this to true to [enable Scrapfly ASP](https://scrapfly.io/docs/scrape-api/anti-scraping-protection). This is useful when the website is identifying and blocking bots. Only applies when Scrapfly proxy is enabled. Setting to `true` will enable ASP on all Scrapfly requests for this blog (be warned, this is chargeable).
+            * `feed_content_policy` (optional, default `auto` for new feeds, existing feeds were migrated to `never`): whether the full text some feeds embed in each item (`content:encoded` in RSS, `content` in ATOM) is used instead of fetching the post. `never` always fetches the post, `auto` uses embedded content that looks like the complete post (long enough and not ending with `...`, `Read more` and the like), `always` uses any embedded content.
 
             The `id` of a Feed is generated using a UUIDv5. The namespace used is `6c6e6448-04d4-42a3-9214-4f0f7d02694e` and the value used is `<FEED_URL>` (e.g. `https://muchdogesec.github.io/fakeblog123/feeds/rss-feed-encoded.xml` would have the id `d1d96b71-c687-50db-9d2b-d0092d1d163a`). Therefore, you cannot add a URL that already exists, you must first delete it to add it with new settings.
 
@@ -444,6 +445,7 @@ class FeedView(viewsets.ModelViewSet):
             * `pretty_url` (optional): update the `pretty_url of the Feed
             * `source_category` (optional, default is `uncategorized`, list): can be used to categories the feed. Options available are: `analyst`, `community`, `government`, `media`, or `vendor`.
             * `use_scrapfly_asp` (optional, boolean, default `false`): set this to true to [enable Scrapfly ASP](https://scrapfly.io/docs/scrape-api/anti-scraping-protection). This is useful when the website is identifying and blocking bots. Only applies when Scrapfly proxy is enabled. Setting to `true` will enable ASP on all Scrapfly requests for this blog (be warned, this is chargeable).
+            * `feed_content_policy` (optional, default `auto` for new feeds, existing feeds were migrated to `never`): whether the full text some feeds embed in each item (`content:encoded` in RSS, `content` in ATOM) is used instead of fetching the post. `never` always fetches the post, `auto` uses embedded content that looks like the complete post (long enough and not ending with `...`, `Read more` and the like), `always` uses any embedded content.
 
             Only one/key value is required in the request. For those not passed, the current value will remain unchanged.
 
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from urllib.parse import urlparse
+
+import redis
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+from .rate_limiter import get_redis_url
+
+
+KEY_PREFIX = "h4f-cdx"
+# resume keys of listings built from the cache, followed by the timestamp of the last capture listed
+RESUME_PREFIX = "cache:"
+# buckets are counted from the first wayback captures
+EPOCH = datetime(1996, 1, 1, tzinfo=UTC)
+# captures show up in the CDX index a while after they are taken, a bucket is only complete after this
+CLOSE_DELAY = timedelta(days=1)
+
+
+def cdx_urlkey(url: str) -> str:
+    """
+    roughly the SURT form the CDX server files captures under, `https://www.Example.com/Feed?b=1&a=2` -> `com,example)/feed?a=2&b=1`.
+
+    urls with the same urlkey have the same captures
+    """
+    parsed = urlparse(url.strip())
+    host = re.sub(r"^www\d*\.", "", (parsed.hostname or "").rstrip("."))
+    surt_host = ",".join(reversed(host.split(".")))
+    if parsed.port and parsed.port not in (80, 443):
+        surt_host += f":{parsed.port}"
+    query = "&".join(sorted(parsed.query.split("&"))) if parsed.query else ""
+    return f"{surt_host}){parsed.path or '/'}{'?' + query if query else ''}".lower()
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """
+    `CDX_CACHE_BUCKET_DAYS` days of captures, from `start` up to (not including) `end`
+    """
+
+    start: datetime
+    end: datetime
+
+    @classmethod
+    def containing(cls, date: datetime) -> "Bucket":
+        days = settings.CDX_CACHE_BUCKET_DAYS
+        index = (date - EPOCH).days // days
+        start = EPOCH + timedelta(days=index * days)
+        return cls(start, start + timedelta(days=days))
+
+    @classmethod
+    def between(cls, start: datetime, end: datetime) -> list["Bucket"]:
+        buckets = [cls.containing(start)]
+        while buckets[-1].end <= end:
+            buckets.append(cls(buckets[-1].end, buckets[-1].end + timedelta(days=settings.CDX_CACHE_BUCKET_DAYS)))
+        return buckets
+
+    def holds(self, timestamp: str) -> bool:
+        return self.start_timestamp <= timestamp.ljust(14, "0") < self.end_timestamp
+
+    def is_closed(self, now: datetime) -> bool:
+        return self.end <= now - CLOSE_DELAY
+
+    @property
+    def start_timestamp(self) -> str:
+        return self.start.strftime("%Y%m%d%H%M%S")
+
+    @property
+    def end_timestamp(self) -> str:
+        return self.end.strftime("%Y%m%d%H%M%S")
+
+
+class CDXCache:
+    """
+    CDX captures stored in redis per urlkey and date bucket, shared by every feed, job and worker.
+
+    past buckets never change, so they are kept for `CDX_CACHE_SECONDS`. the bucket still open is kept for
+    `CDX_CACHE_OPEN_SECONDS` only, so that a job retried straight after a failure does not list it again
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+
+    @staticmethod
+    def key(urlkey, bucket: Bucket) -> str:
+        return f"{KEY_PREFIX}:{urlkey}:{bucket.start_timestamp}"
+
+    def get_many(self, urlkey, buckets: list[Bucket]) -> list[list[list] | None]:
+        """
+        the rows cached for each bucket, None for the buckets that are not cached
+        """
+        if not buckets:
+            return []
+        try:
+            values = self.redis.mget([self.key(urlkey, bucket) for bucket in buckets])
+        except redis.RedisError as e:
+            logger.warning(f"CDX cache unavailable, listing `{urlkey}` from the CDX server: {e}")
+            return [None] * len(buckets)
+        return [None if value is None else json.loads(value) for value in values]
+
+    def put(self, urlkey, bucket: Bucket, rows: list[list], now: datetime):
+        ttl = settings.CDX_CACHE_SECONDS if bucket.is_closed(now) else settings.CDX_CACHE_OPEN_SECONDS
+        try:
+            self.redis.set(self.key(urlkey, bucket), json.dumps(rows), ex=ttl)
+        except redis.RedisError as e:
+            logger.warning(f"CDX cache unavailable, `{urlkey}` is not cached: {e}")
+
+
+def is_cache_resume_key(resume_key: str) -> bool:
+    return resume_key.startswith(RESUME_PREFIX)
+
+
+_caches: dict[int, CDXCache] = {}
+
+
+def get_cache() -> CDXCache | None:
+    """
+    None when `CDX_CACHE_BUCKET_DAYS` is 0 or there is no redis to share the cache in
+    """
+    if not settings.CDX_CACHE_BUCKET_DAYS:
+        return None
+    url = get_redis_url()
+    if not url:
+        return None
+    pid = os.getpid()
+    if pid not in _caches:
+        _caches.clear()
+        _caches[pid] = CDXCache(redis.Redis.from_url(url))
+    return _caches[pid]
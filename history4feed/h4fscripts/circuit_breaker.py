@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import redis
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+from .exceptions import HostCircuitOpen
+from .rate_limiter import get_redis_url
+
+
+KEY_PREFIX = "h4f-circuit"
+
+
+class LocalStore:
+    """
+    in-process stand-in for the few redis commands the breaker uses, used when redis is not available
+    """
+
+    def __init__(self):
+        self.values: dict[str, tuple[int, float]] = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        value, expires_at = self.values.get(key, (None, 0))
+        if expires_at < time.monotonic():
+            self.values.pop(key, None)
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value, ex, nx=False):
+        with self.lock:
+            if nx and self._get(key) is not None:
+                return None
+            self.values[key] = (value, time.monotonic() + ex)
+            return True
+
+    def incr(self, key, ex):
+        with self.lock:
+            value = int(self._get(key) or 0) + 1
+            self.values[key] = (value, time.monotonic() + ex)
+            return value
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+
+class RedisStore:
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ex, nx=False):
+        return self.client.set(key, value, ex=ex, nx=nx)
+
+    def incr(self, key, ex):
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, ex)
+        return pipe.execute()[0]
+
+    def delete(self, *keys):
+        self.client.delete(*keys)
+
+
+class HostCircuitBreaker:
+    """
+    stops fetching from a host after `CIRCUIT_BREAKER_FAILURE_THRESHOLD` consecutive connection errors or 5xx responses.
+
+    closed     requests go through, failures are counted
+    open       requests fail immediately with `HostCircuitOpen` for `CIRCUIT_BREAKER_COOLDOWN_SECONDS`
+    half-open  once the cooldown is over a single request is let through as a probe,
+               success closes the circuit, failure opens it again. a probe that ends without telling either way
+               is released, so the next request probes instead
+    """
+
+    def __init__(self, redis_client: redis.Redis = None):
+        self.store = RedisStore(redis_client) if redis_client else None
+        self.local_store = LocalStore()
+
+    def _call(self, method, *args, **kwargs):
+        if self.store:
+            try:
+                return getattr(self.store, method)(*args, **kwargs)
+            except redis.RedisError as e:
+                logger.warning(f"shared circuit breaker unavailable, using local state: {e}")
+        return getattr(self.local_store, method)(*args, **kwargs)
+
+    @staticmethod
+    def keys(host):
+        prefix = f"{KEY_PREFIX}:{host}"
+        return f"{prefix}:failures", f"{prefix}:open", f"{prefix}:probe"
+
+    def check(self, host, claim_probe=True):
+        """
+        raises `HostCircuitOpen` when requests to `host` should not be attempted.
+
+        with `claim_probe`, a half-open circuit lets the caller through as the probe, which it then has to resolve
+        with `record_success`, `record_failure` or `release`
+        """
+        failures_key, open_key, probe_key = self.keys(host)
+        cooldown = settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS
+        if self._call("get", open_key):
+            raise HostCircuitOpen(
+                f"`{host}` is down, skipping requests for up to {cooldown}s after {settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD} consecutive failures"
+            )
+        failures = int(self._call("get", failures_key) or 0)
+        if failures >= settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+            # half-open, only one worker gets to probe the host
+            if not claim_probe:
+                if self._call("get", probe_key):
+                    raise HostCircuitOpen(f"`{host}` is down, waiting for a probe request to finish")
+                return
+            if not self._call("set", probe_key, 1, ex=settings.HTTP_READ_TIMEOUT_SECONDS * 2, nx=True):
+                raise HostCircuitOpen(f"`{host}` is down, waiting for a probe request to finish")
+            logger.info(f"probing `{host}` after circuit breaker cooldown")
+
+    def record_success(self, host):
+        self._call("delete", *self.keys(host))
+
+    def release(self, host):
+        """
+        ends a probe that did not show whether the host is up
+        """
+        self._call("delete", self.keys(host)[2])
+
+    def record_failure(self, host):
+        failures_key, open_key, probe_key = self.keys(host)
+        cooldown = settings.CIRCUIT_BREAKER_COOLDOWN_SECONDS
+        failures = self._call("incr", failures_key, ex=cooldown * 4)
+        if failures >= settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+            logger.warning(f"circuit breaker opened for `{host}` after {failures} consecutive failures")
+            self._call("set", open_key, 1, ex=cooldown)
+            self._call("delete", probe_key)
+
+
+_breakers: dict[int, HostCircuitBreaker] = {}
+
+
+def get_breaker() -> HostCircuitBreaker:
+    pid = os.getpid()
+    if pid not in _breakers:
+        _breakers.clear()
+        url = get_redis_url()
+        _breakers[pid] = HostCircuitBreaker(url and redis.Redis.from_url(url))
+    return _breakers[pid]
+
+
+def get_host(url) -> str:
+    return urlparse(url).hostname or ""
+
+
+def check(url, claim_probe=True):
+    if settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+        get_breaker().check(get_host(url), claim_probe)
+
+
+def record_success(url):
+    if settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+        get_breaker().record_success(get_host(url))
+
+
+def record_failure(url):
+    if settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+        get_breaker().record_failure(get_host(url))
+
+
+def release(url):
+    if settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+        get_breaker().release(get_host(url))
@@ -0,0 +1,48 @@
+import time
+
+from .exceptions import DeadlineExceeded
+
+
+# below this, another request is not worth starting
+MIN_REQUEST_SECONDS = 5
+# time kept back from a task's soft time limit to save results before celery interrupts it
+TASK_MARGIN_SECONDS = 5
+
+
+class Deadline:
+    """
+    point in time by which a unit of work (usually a celery task) has to finish.
+
+    passed down the fetch stack so that request timeouts never outlast the task
+    and retries that cannot finish in time are not attempted
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_task(cls, soft_time_limit: float) -> "Deadline":
+        return cls(max(soft_time_limit - TASK_MARGIN_SECONDS, 0))
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def allows(self, seconds: float) -> bool:
+        """
+        whether there is time to wait `seconds` and still make a request afterwards
+        """
+        return self.remaining() >= seconds + MIN_REQUEST_SECONDS
+
+    def max_wait(self) -> float:
+        """
+        longest wait that still leaves time for a request afterwards
+        """
+        return max(self.remaining() - MIN_REQUEST_SECONDS, 0)
+
+    def check(self, action: str):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"deadline of {self.seconds}s reached before {action}")
+
+    def timeout(self, seconds: float) -> float:
+        return min(seconds, self.remaining())
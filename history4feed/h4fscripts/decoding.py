@@ -0,0 +1,262 @@
+import zlib
+
+import zstandard
+
+from . import logger
+from .exceptions import history4feedException
+
+try:
+    import brotli
+except ImportError:
+    # only `br` bodies are affected, they fail with `UnsupportedEncoding`
+    brotli = None
+
+
+IDENTITY_ENCODINGS = {"", "identity", "none"}
+# output limit of a single brotli call, at most about twice this much is decoded past `max_length`
+BROTLI_BUFFER_SIZE = 64 * 1024
+# most bytes a zstd frame decodes to per compressed byte, a 128KB RLE block only takes 4 bytes
+ZSTD_MAX_RATIO = 32 * 1024
+
+
+class UnsupportedEncoding(history4feedException):
+    pass
+
+
+class DecodedSizeExceeded(history4feedException):
+    pass
+
+
+class ZlibDecoder:
+    def __init__(self, wbits):
+        self.wbits = wbits
+        self.decoder = zlib.decompressobj(wbits)
+        self.first_chunk = True
+
+    def decompress(self, chunk: bytes, max_length=0) -> bytes:
+        try:
+            data = self.decoder.decompress(chunk, max_length)
+        except zlib.error:
+            if not (self.first_chunk and self.wbits == zlib.MAX_WBITS):
+                raise
+            # some servers send raw deflate without the zlib header
+            self.wbits = -zlib.MAX_WBITS
+            self.decoder = zlib.decompressobj(self.wbits)
+            data = self.decoder.decompress(chunk, max_length)
+        self.first_chunk = False
+        return data
+
+    @property
+    def unconsumed_tail(self):
+        return self.decoder.unconsumed_tail
+
+    @property
+    def has_unconsumed_tail(self) -> bool:
+        return bool(self.unconsumed_tail)
+
+    def flush(self) -> bytes:
+        return self.decoder.flush()
+
+
+class BrotliDecoder:
+    """
+    with Google's `Brotli` (1.2+), `Decompressor.process` stops after `output_buffer_limit` bytes and keeps the rest
+    of the input itself, it is then called with empty input until `can_accept_more_data()`.
+
+    other `brotli` modules (brotlipy, brotlicffi) have no output limit, each chunk is decoded whole
+    and `StreamDecoder` only checks the decoded size afterwards
+    """
+
+    unconsumed_tail = b""
+    warned_unbounded = False
+
+    def __init__(self):
+        self.decoder = brotli.Decompressor()
+        self.bounded = hasattr(self.decoder, "process") and hasattr(self.decoder, "can_accept_more_data")
+        if not self.bounded and not BrotliDecoder.warned_unbounded:
+            BrotliDecoder.warned_unbounded = True
+            logger.warning("the installed brotli module cannot limit its output, install `Brotli>=1.2.0`")
+
+    def decompress(self, chunk: bytes, max_length=0) -> bytes:
+        if not self.bounded:
+            return self.decoder.decompress(chunk)
+        if not max_length:
+            return self.decoder.process(chunk)
+        # the output buffer grows by doubling up to the limit, small limits keep it close to `max_length`
+        out = bytearray()
+        while len(out) < max_length:
+            out += self.decoder.process(chunk, output_buffer_limit=min(max_length - len(out), BROTLI_BUFFER_SIZE))
+            chunk = b""
+            if self.decoder.can_accept_more_data():
+                break
+        return bytes(out)
+
+    @property
+    def has_unconsumed_tail(self) -> bool:
+        return self.bounded and not self.decoder.can_accept_more_data()
+
+    def flush(self) -> bytes:
+        if finish := getattr(self.decoder, "finish", None):
+            return finish()
+        return b""
+
+
+class ZstdDecoder:
+    """
+    zstandard's decompressobj has no output limit, chunks are fed to it in slices that cannot decode to much more than `max_length`
+    """
+
+    def __init__(self):
+        self.decoder = zstandard.ZstdDecompressor().decompressobj()
+        self.unconsumed_tail = b""
+
+    def decompress(self, chunk: bytes, max_length=0) -> bytes:
+        if not max_length:
+            self.unconsumed_tail = b""
+            return self.decoder.decompress(chunk)
+        out = bytearray()
+        view = memoryview(chunk)
+        while view and len(out) < max_length:
+            size = max((max_length - len(out)) // ZSTD_MAX_RATIO, 1)
+            out += self.decoder.decompress(view[:size].tobytes())
+            view = view[size:]
+        self.unconsumed_tail = view.tobytes()
+        return bytes(out)
+
+    @property
+    def has_unconsumed_tail(self) -> bool:
+        return bool(self.unconsumed_tail)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def new_decoder(encoding: str):
+    match encoding:
+        case "gzip" | "x-gzip":
+            return ZlibDecoder(16 + zlib.MAX_WBITS)
+        case "deflate":
+            return ZlibDecoder(zlib.MAX_WBITS)
+        case "br" if brotli:
+            return BrotliDecoder()
+        case "zstd":
+            return ZstdDecoder()
+    raise UnsupportedEncoding(f"unsupported content encoding `{encoding}`")
+
+
+def parse_encodings(value: str) -> list[str]:
+    encodings = [e.strip().lower() for e in (value or "").split(",")]
+    return [e for e in encodings if e not in IDENTITY_ENCODINGS]
+
+
+def get_encodings(headers) -> list[str]:
+    """
+    returns the encodings applied to a body, in the order they were applied.
+
+    wayback `id_` snapshots are served as the original bytes, with the original
+    `Content-Encoding` moved to `x-archive-orig-content-encoding`
+    """
+    encodings = parse_encodings(headers.get("content-encoding"))
+    if not encodings:
+        encodings = get_archived_encodings(headers)
+    return encodings
+
+
+def get_archived_encodings(headers) -> list[str]:
+    """
+    encodings only known from `x-archive-orig-content-encoding`. wayback sometimes serves those bodies already decoded
+    """
+    if parse_encodings(headers.get("content-encoding")):
+        return []
+    return parse_encodings(headers.get("x-archive-orig-content-encoding"))
+
+
+def decode_errors() -> tuple[type[Exception], ...]:
+    errors = (zlib.error, zstandard.ZstdError)
+    if brotli:
+        errors += (getattr(brotli, "error", None) or brotli.Error,)
+    return errors
+
+
+class StreamDecoder:
+    """
+    decodes a body chunk by chunk as it is downloaded, failing as soon as the decoded body grows over `max_size`.
+
+    with `raw_fallback`, the body is returned as it was downloaded when it cannot be decoded, or when one of its
+    encodings is not supported, for encodings read from wayback's `x-archive-orig-content-encoding`
+    """
+
+    def __init__(self, encodings: list[str], max_size: int, raw_fallback=False):
+        try:
+            self.decoders = [new_decoder(encoding) for encoding in reversed(encodings)]
+        except UnsupportedEncoding as e:
+            if not raw_fallback:
+                raise
+            logger.warning(f"cannot decode the archived content-encoding, using the body as is: {e}")
+            self.decoders = []
+        self.max_size = max_size
+        self.buffer = bytearray()
+        # the body as downloaded, kept until it is known whether it decodes
+        self.raw = bytearray() if raw_fallback and self.decoders else None
+
+    @classmethod
+    def from_headers(cls, headers, max_size: int) -> "StreamDecoder":
+        return cls(get_encodings(headers), max_size, raw_fallback=bool(get_archived_encodings(headers)))
+
+    def write(self, chunk: bytes):
+        if self.raw is None:
+            return self._write(chunk)
+        self.raw += chunk
+        try:
+            self._write(chunk)
+        except decode_errors() as e:
+            self._use_raw(e)
+
+    def _write(self, chunk: bytes):
+        for decoder in self.decoders:
+            chunk = self._decompress(decoder, chunk)
+        self._append(chunk)
+
+    def _decompress(self, decoder, chunk: bytes) -> bytes:
+        out = bytearray()
+        while True:
+            out += decoder.decompress(chunk, max(self.remaining - len(out), 0) + 1)
+            self._check_size(len(out))
+            if not decoder.has_unconsumed_tail:
+                return bytes(out)
+            chunk = decoder.unconsumed_tail
+
+    def _use_raw(self, error: Exception):
+        logger.warning(f"body does not decode as its archived content-encoding, using it as is: {error}")
+        self.decoders = []
+        self.buffer = bytearray()
+        self._append(bytes(self.raw))
+        self.raw = None
+
+    def close(self) -> bytes:
+        try:
+            self._close()
+        except decode_errors() as e:
+            if self.raw is None:
+                raise
+            self._use_raw(e)
+        return bytes(self.buffer)
+
+    def _close(self):
+        for i, decoder in enumerate(self.decoders):
+            chunk = decoder.flush()
+            for next_decoder in self.decoders[i + 1 :]:
+                chunk = self._decompress(next_decoder, chunk)
+            self._append(chunk)
+
+    @property
+    def remaining(self):
+        return max(self.max_size - len(self.buffer), 0)
+
+    def _check_size(self, pending=0):
+        if len(self.buffer) + pending > self.max_size:
+            raise DecodedSizeExceeded(f"decoded body is larger than {self.max_size} bytes")
+
+    def _append(self, chunk: bytes):
+        self._check_size(len(chunk))
+        self.buffer += chunk
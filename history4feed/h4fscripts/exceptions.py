@@ -14,6 +14,40 @@ class FetchRedirect(history4feedException):
     pass
 
 
+class NotModified(history4feedException):
+    pass
+
+
+class Blocked(history4feedException):
+    pass
+
+
+class RateLimited(history4feedException):
+    def __init__(self, message, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ServerError(history4feedException):
+    pass
+
+
+class HostCircuitOpen(history4feedException):
+    pass
+
+
+class DeadlineExceeded(history4feedException):
+    pass
+
+
+class DownloadSizeExceeded(history4feedException):
+    pass
+
+
+class UnsupportedContentType(history4feedException):
+    pass
+
+
 class ScrapflyError(Exception):
     def __str__(self):
         return f"ScrapflyError({super().__str__()})"
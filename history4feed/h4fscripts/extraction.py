@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from readability import Document as ReadabilityDocument
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+from .deadline import Deadline
+from .exceptions import DeadlineExceeded
+
+
+# extraction processes are replaced after this many pages, readability/lxml do not give all their memory back
+MAX_TASKS_PER_PROCESS = 200
+
+
+def extract_summary(html: str, url: str) -> str:
+    return ReadabilityDocument(html, url=url).summary()
+
+
+_pools: dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+_warned_daemonic = False
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    process pool of the current worker process, shared by all its threads
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools.clear()
+            _pools[pid] = ProcessPoolExecutor(
+                settings.EXTRACTION_PROCESSES,
+                # workers have fetch threads running, forking them is not safe
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=MAX_TASKS_PER_PROCESS,
+            )
+        return _pools[pid]
+
+
+def can_start_processes() -> bool:
+    """
+    processes of celery's default prefork pool are daemonic, and daemonic processes are not allowed to have children.
+    fulltext tasks are sent to `FULLTEXT_QUEUE` so that they run on a worker that can
+    """
+    if not multiprocessing.current_process().daemon:
+        return True
+    global _warned_daemonic
+    if not _warned_daemonic:
+        _warned_daemonic = True
+        logger.warning(
+            "extracting in the fetching thread, prefork pool processes cannot start the extraction processes. "
+            "set FULLTEXT_QUEUE and run its worker with `--pool threads` to use them"
+        )
+    return False
+
+
+def reset_pool(pool: ProcessPoolExecutor):
+    with _pools_lock:
+        if _pools.get(os.getpid()) is pool:
+            del _pools[os.getpid()]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize(html: str, url: str, deadline: Deadline = None) -> str:
+    """
+    runs readability on a fetched page.
+
+    the work is pure CPU, so it is sent to a pool of `EXTRACTION_PROCESSES` processes and the calling thread only waits for it,
+    letting fetches keep running at high concurrency. with `EXTRACTION_PROCESSES` set to 0, or in a process that cannot start
+    processes of its own, it runs in the calling thread
+    """
+    if not settings.EXTRACTION_PROCESSES or not can_start_processes():
+        return extract_summary(html, url)
+    pool = get_pool()
+    try:
+        future = pool.submit(extract_summary, html, url)
+    except BrokenProcessPool:
+        reset_pool(pool)
+        pool = get_pool()
+        future = pool.submit(extract_summary, html, url)
+    try:
+        return future.result(deadline and deadline.remaining())
+    except FutureTimeoutError as e:
+        raise DeadlineExceeded(f"deadline of {deadline.seconds}s reached before extracting `{url}`") from e
+    except BrokenProcessPool:
+        # a crashed extraction process takes the pool down with it
+        logger.warning(f"extraction process died while extracting `{url}`, starting a new pool")
+        reset_pool(pool)
+        raise
+    finally:
+        future.cancel()
@@ -0,0 +1,115 @@
+import asyncio
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+from urllib.parse import urlparse
+
+from history4feed.app.models import FullTextState
+from . import logger
+from .exceptions import HostCircuitOpen, DeadlineExceeded
+
+_DONE = object()
+
+
+@dataclass
+class FulltextResult:
+    ftjob_pk: int
+    status: FullTextState
+    error_str: str = ""
+    description: str = None
+    content_type: str = None
+    host_down: bool = False
+    exception: Exception = field(default=None, compare=False, repr=False)
+
+
+class FulltextEngine:
+    """
+    Retrieves the full text of many posts at once.
+
+    Fetches run in a thread pool driven by an asyncio loop in a background thread,
+    at most `concurrency` at a time and at most `per_host_concurrency` per host.
+    Results are yielded to the caller (in the calling thread) as soon as each fetch finishes,
+    so the caller can keep using the django ORM as usual.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], tuple[str, str]],
+        concurrency: int,
+        per_host_concurrency: int,
+        timeout: float,
+    ):
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, items: list[tuple[int, str]]) -> Iterator[FulltextResult]:
+        """
+        `items` is a list of (FulltextJob.pk, link), one result is yielded for each item
+        """
+        results = queue.Queue()
+        thread = threading.Thread(
+            target=asyncio.run,
+            args=(self._run(items, results),),
+            name="h4f-fulltext-engine",
+            daemon=True,
+        )
+        thread.start()
+        while (result := results.get()) is not _DONE:
+            yield result
+
+    async def _run(self, items, results: queue.Queue):
+        executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="h4f-fulltext")
+        global_limit = asyncio.Semaphore(self.concurrency)
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host_concurrency))
+        try:
+            await asyncio.gather(
+                *[
+                    self._retrieve(executor, global_limit, host_limits, ftjob_pk, link, results)
+                    for ftjob_pk, link in items
+                ]
+            )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            results.put(_DONE)
+
+    async def _retrieve(self, executor, global_limit, host_limits, ftjob_pk, link, results: queue.Queue):
+        async with host_limits[urlparse(link).hostname], global_limit:
+            results.put(await self._fetch(executor, ftjob_pk, link))
+
+    async def _fetch(self, executor, ftjob_pk, link):
+        if self.cancelled.is_set():
+            return FulltextResult(
+                ftjob_pk,
+                FullTextState.CANCELLED,
+                "job cancelled while retrieving fulltext",
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            description, content_type = await asyncio.wait_for(
+                loop.run_in_executor(executor, self.fetch, link), self.timeout
+            )
+            return FulltextResult(
+                ftjob_pk, FullTextState.RETRIEVED, "", description, content_type
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"fulltext fetch for `{link}` timed out")
+            return FulltextResult(
+                ftjob_pk,
+                FullTextState.TIMED_OUT,
+                f"task timed out: fetch took longer than {self.timeout} seconds",
+            )
+        except DeadlineExceeded as e:
+            return FulltextResult(ftjob_pk, FullTextState.TIMED_OUT, f"task timed out: {e}")
+        except HostCircuitOpen as e:
+            return FulltextResult(ftjob_pk, FullTextState.FAILED, str(e), host_down=True)
+        except Exception as e:
+            return FulltextResult(ftjob_pk, FullTextState.FAILED, str(e), exception=e)
@@ -1,58 +1,93 @@
 from dataclasses import dataclass
-from datetime import UTC
+import json
+import re
 import time
-from io import BytesIO, StringIO
-from xml.dom.minidom import Element, parse
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from xml.dom.minidom import Document, parse
+from collections import deque
+from typing import Iterator
 import os
 from history4feed.app.settings import history4feed_server_settings as settings
 import requests
-from dateutil.parser import parse as parse_date
-from readability import Document as ReadabilityDocument
-import brotli
 from types import SimpleNamespace
-from . import logger
-from .xml_utils import getAtomLink, getFirstChildByTag, getFirstElementByTag, getText
+from . import logger, http_client, rate_limiter, decoding, routing, circuit_breaker, extraction
+from .deadline import Deadline
+from .pubdate import PUBDATE_TAGS, PublishDateResolver
+from .xml_utils import (
+    getFirstElementByTag,
+    getText,
+    ItemView,
+    LxmlItemView,
+    MinidomItemView,
+    iterparseFeed,
+)
+from lxml import etree
+import lxml.html
 from .exceptions import (
     history4feedException,
     UnknownFeedtypeException,
     FetchRedirect,
+    NotModified,
+    Blocked,
+    RateLimited,
+    ServerError,
+    HostCircuitOpen,
+    DeadlineExceeded,
+    DownloadSizeExceeded,
+    UnsupportedContentType,
     ScrapflyError,
 )
-import fake_useragent
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 from celery.exceptions import SoftTimeLimitExceeded
 
-
-PUBDATE_TAGS =  [
-    # --- Publication / Creation Variants (Highest Priority) ---
-    "pubDate",          # Core RSS 2.0 item publication date
-    "published",        # Core Atom item publication date
-    "dcterms:issued",   # Dublin Core formal publication date
-    "dcterms:created",  # Dublin Core explicit resource creation date
-    "creation_date",    # Common custom CMS/database export tag
-    "date",             # Common un-namespaced fallback tag
-
-    # --- Modification / Update Variants (Lowest Priority) ---
-    "updated",          # Core Atom item modification date
-    "dc:date",          # Dublin Core general/modification date
-    "lastBuildDate",    # Core RSS feed/item refresh date
-    "dcterms:modified", # Dublin Core explicit resource modification date
-    "modified_date",    # Common custom database-to-XML export tag
-    "update_date",      # Custom e-commerce and API feed modification tag
-    "a10:updated"       # Microsoft .NET SyndicationFeed framework variant
+STREAM_CHUNK_SIZE = 64 * 1024
+# scrapfly keeps the connection open while it scrapes, up to 150s with asp
+SCRAPFLY_READ_TIMEOUT_SECONDS = 160
+BLOCKED_MAIN_TYPES = {"image", "audio", "video", "font"}
+BLOCKED_CONTENT_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-tar",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/octet-stream",
+    "application/msword",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+BLOCKED_STATUS_CODES = {403}
+# a host asking us to come back later than this is treated as asking for this long
+MAX_RETRY_AFTER_SECONDS = 10 * 60
+# markers of the bot challenge pages served by the common anti-bot services
+CHALLENGE_MARKERS = [
+    b"<title>Just a moment...</title>",
+    b"/cdn-cgi/challenge-platform/",
+    b"_Incapsula_Resource",
+    b"px-captcha",
+    b"captcha-delivery.com",
 ]
+CHALLENGE_SNIFF_BYTES = 16 * 1024
+ATOM_CONTENT_TYPES = {"html": "text/html", "xhtml": "application/xhtml+xml"}
+# endings of excerpts, e.g. `[…]`, `...` or `Continue reading`
+TRUNCATION_MARKERS = re.compile(
+    r"(\[?(…|\.\.\.|&hellip;)\]?|read more|continue reading|read the full (post|article|story))\W*$",
+    re.IGNORECASE,
+)
 
 
 def fetch_page_with_retries(
-    url, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, **kwargs
+    url, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, deadline: Deadline=None, **kwargs
 ):
-    ua = fake_useragent.UserAgent()
-    session = requests.Session()
-    session.max_redirects = 3
+    session = http_client.get_session()
     headers = kwargs.get("headers", {})
     headers.update(
         {
-            "User-Agent": ua.random,
+            "User-Agent": http_client.random_user_agent(),
         }
     )
     kwargs.update(headers=headers)
@@ -60,14 +95,22 @@ def fetch_page_with_retries(
     for i in range(retry_count + 1):
         try:
             if i > 0:
+                # no point waiting to retry a host that is down, the probe itself is only claimed by `fetch_page`
+                circuit_breaker.check(url, claim_probe=False)
                 backoff_time = sleep_seconds * 1.5 ** (i - 1)
+                if isinstance(error, RateLimited) and error.retry_after:
+                    backoff_time = max(backoff_time, error.retry_after)
+                if deadline and not deadline.allows(backoff_time):
+                    raise DeadlineExceeded(
+                        f"not enough time left to retry `{url}` in {backoff_time}s, last error: {error}"
+                    ) from error
                 logger.warning(
                     f"failed to fetch {url}, retrying in {backoff_time}...",
                     exc_info=error,
                 )
                 time.sleep(backoff_time)
-            return fetch_page(session, url, **kwargs)
-        except (FatalError, SoftTimeLimitExceeded):
+            return fetch_page(session, url, deadline=deadline, **kwargs)
+        except (FatalError, NotModified, HostCircuitOpen, DeadlineExceeded, DownloadSizeExceeded, UnsupportedContentType, decoding.DecodedSizeExceeded, SoftTimeLimitExceeded):
             raise
         except BaseException as e:
             error = e
@@ -80,6 +123,17 @@ class FatalError(Exception):
     pass
 
 
+def is_transient_error(e: BaseException) -> bool:
+    """
+    failures worth retrying later, `fetch_page_with_retries` raises `ConnectionError` once it runs out of retries
+    """
+    return isinstance(e, ConnectionError) or isinstance(e.__cause__, ConnectionError)
+
+
+# failures that count towards opening the circuit breaker of a host
+HOST_FAILURES = (requests.ConnectionError, requests.Timeout, ServerError, FatalError)
+
+
 def as_bytes(data):
     if isinstance(data, bytes):
         return data
@@ -88,35 +142,244 @@ def as_bytes(data):
     else:
         raise TypeError(f"data must be bytes or str, got {type(data)}")
 
+@dataclass
+class CacheValidators:
+    """
+    validators returned with a response, sent back with the next request so that an unchanged resource returns 304
+    """
+
+    etag: str = None
+    last_modified: str = None
+
+    def as_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update_from_headers(self, headers):
+        headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self.etag = headers.get("etag") or None
+        self.last_modified = headers.get("last-modified") or None
+
+
 def fetch_page(
-    session, url, headers=None, use_scrapfly_asp=False, **kwargs
+    session, url, headers=None, use_scrapfly_asp=False, validators: CacheValidators=None, deadline: Deadline=None, **kwargs
+) -> tuple[bytes, str, str]:
+    circuit_breaker.check(url)
+    # deadlines, time limits and anything unexpected say nothing about the host
+    outcome = circuit_breaker.release
+    try:
+        result = fetch_routed_page(session, url, headers, use_scrapfly_asp, validators, deadline)
+        outcome = circuit_breaker.record_success
+        return result
+    except HOST_FAILURES:
+        outcome = circuit_breaker.record_failure
+        raise
+    except DeadlineExceeded:
+        raise
+    except history4feedException:
+        # the host answered (4xx, blocked, not modified...), it is up
+        outcome = circuit_breaker.record_success
+        raise
+    finally:
+        outcome(url)
+
+
+def fetch_routed_page(
+    session, url, headers=None, use_scrapfly_asp=False, validators: CacheValidators=None, deadline: Deadline=None
 ) -> tuple[bytes, str, str]:
     proxy_apikey = settings.SCRAPFLY_APIKEY
     headers = headers or {}
+    if validators:
+        headers.update(validators.as_headers())
+    if not proxy_apikey:
+        return fetch_direct(session, url, headers, validators, deadline)
+
+    host = urlparse(url).hostname
+    route = routing.get_route(host)
+    if route in (None, routing.DIRECT):
+        try:
+            result = fetch_direct(session, url, headers, validators, deadline)
+            if not route:
+                routing.remember(host, routing.DIRECT)
+            return result
+        except Blocked as e:
+            if not can_reroute(host):
+                raise
+            logger.info(f"direct fetch blocked, retrying via scrapfly: {e}")
+            route = routing.SCRAPFLY
+            routing.remember(host, route)
+
+    use_asp = use_scrapfly_asp or route == routing.SCRAPFLY_ASP
+    try:
+        return fetch_page_via_scrapfly(session, url, headers, proxy_apikey, use_asp, validators, deadline)
+    except Blocked as e:
+        if use_asp or not settings.SCRAPFLY_AUTO_ASP:
+            raise
+        logger.info(f"scrapfly fetch blocked, retrying with ASP: {e}")
+        routing.remember(host, routing.SCRAPFLY_ASP)
+        return fetch_page_via_scrapfly(session, url, headers, proxy_apikey, True, validators, deadline)
 
-    if proxy_apikey:
-        headers, result = fetch_with_scapfly(
-            session, url, headers, proxy_apikey, use_scrapfly_asp
-        )
-        return as_bytes(result.content), result.content_type, result.url
 
+def fetch_direct(
+    session, url, headers, validators: CacheValidators=None, deadline: Deadline=None
+) -> tuple[bytes, str, str]:
     logger.info(f"Fetching `{url}`")
-    resp: requests.Response = session.get(url, headers=headers)
-    content = resp.content
-    if not resp.ok:
-        raise history4feedException(
-            f"GET Request failed for `{url}`, status: {resp.status_code}, reason: {resp.reason}"
+    rate_limiter.wait(url, deadline)
+    resp: requests.Response = session.get(
+        url, headers=headers, stream=True, timeout=get_timeout(deadline=deadline)
+    )
+    with resp:
+        if validators:
+            if resp.status_code == 304:
+                raise NotModified(f"`{url}` not modified since last fetch")
+            validators.update_from_headers(resp.headers)
+        if not resp.ok:
+            message = f"GET Request failed for `{url}`, status: {resp.status_code}, reason: {resp.reason}"
+            if resp.status_code == 429:
+                raise rate_limited(url, message, resp.headers)
+            exc_class = history4feedException
+            if is_blocked(resp):
+                exc_class = Blocked
+            elif resp.status_code > 499:
+                exc_class = ServerError
+            raise exc_class(message)
+        content = read_body(resp, deadline)
+    content_type = resp.headers.get("content-type")
+    if is_challenge_page(content, content_type):
+        raise Blocked(f"GET Request for `{url}` returned a bot challenge page")
+    return content, content_type, resp.url
+
+
+def fetch_page_via_scrapfly(
+    session, url, headers, proxy_apikey, use_scrapfly_asp, validators: CacheValidators=None, deadline: Deadline=None
+) -> tuple[bytes, str, str]:
+    headers, result = fetch_with_scapfly(
+        session, url, headers, proxy_apikey, use_scrapfly_asp, deadline=deadline
+    )
+    if validators:
+        validators.update_from_headers(getattr(result, "response_headers", None))
+    content = as_bytes(result.content)
+    if len(content) > settings.MAX_DECODED_BODY_BYTES:
+        raise decoding.DecodedSizeExceeded(
+            f"decoded body is larger than {settings.MAX_DECODED_BODY_BYTES} bytes"
+        )
+    return content, result.content_type, result.url
+
+
+def can_reroute(host) -> bool:
+    """
+    the wayback machine is never worth paying scrapfly for, a block there is not host specific
+    """
+    return host != urlparse(settings.WAYBACK_URL).hostname
+
+
+def get_retry_after(headers) -> float | None:
+    """
+    seconds asked for by a `Retry-After` header, given either as a number of seconds or as a date
+    """
+    value = requests.structures.CaseInsensitiveDict(headers or {}).get("retry-after")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER_SECONDS)
+
+
+def rate_limited(url, message, headers) -> RateLimited:
+    """
+    a 429 is not a block, every worker backs off the host for as long as it asked for
+    """
+    retry_after = get_retry_after(headers)
+    if retry_after:
+        rate_limiter.hold(url, retry_after)
+    return RateLimited(message, retry_after)
+
+
+def is_blocked(resp: requests.Response) -> bool:
+    headers = requests.structures.CaseInsensitiveDict(resp.headers or {})
+    return (
+        resp.status_code in BLOCKED_STATUS_CODES
+        or headers.get("cf-mitigated") == "challenge"
+    )
+
+
+def is_challenge_page(content: bytes, content_type: str) -> bool:
+    if "html" not in (content_type or ""):
+        return False
+    head = content[:CHALLENGE_SNIFF_BYTES]
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+def get_timeout(read_timeout=None, deadline: Deadline=None) -> tuple[float, float]:
+    connect_timeout = settings.HTTP_CONNECT_TIMEOUT_SECONDS
+    read_timeout = read_timeout or settings.HTTP_READ_TIMEOUT_SECONDS
+    if deadline:
+        deadline.check("sending a request")
+        return deadline.timeout(connect_timeout), deadline.timeout(read_timeout)
+    return connect_timeout, read_timeout
+
+
+def check_content_type(content_type: str, url):
+    """
+    aborts before the body is downloaded when it is clearly not html/xml (pdfs, images, archives...)
+    """
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype.split("/")[0] in BLOCKED_MAIN_TYPES or mimetype in BLOCKED_CONTENT_TYPES:
+        raise UnsupportedContentType(
+            f"`{url}` returned content-type `{mimetype}`, expected html or xml"
         )
 
-    # some times, wayback returns br encoding, try decompressing
+
+def read_body(resp: requests.Response, deadline: Deadline=None) -> bytes:
+    """
+    decodes the body as it streams in, based on `Content-Encoding` (or wayback's
+    `x-archive-orig-content-encoding`, ignored when the body turns out to be decoded already),
+    instead of letting requests buffer it all first.
+
+    stops as soon as more than `MAX_DOWNLOAD_BYTES` have been downloaded
+    """
+    check_content_type(resp.headers.get("content-type"), resp.url)
+    budget = settings.MAX_DOWNLOAD_BYTES
     try:
-        content = brotli.decompress(content)
-    except Exception as err:
-        logger.print(f"brotli decompress fail: {err}")
-    return content, resp.headers.get("content-type"), resp.url
+        content_length = int(resp.headers.get("content-length") or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > budget:
+        raise DownloadSizeExceeded(
+            f"`{resp.url}` is {content_length} bytes, larger than the {budget} bytes allowed"
+        )
+    decoder = decoding.StreamDecoder.from_headers(resp.headers, settings.MAX_DECODED_BODY_BYTES)
+    downloaded = 0
+    for chunk in resp.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+        downloaded += len(chunk)
+        if downloaded > budget:
+            raise DownloadSizeExceeded(
+                f"`{resp.url}` is larger than the {budget} bytes allowed"
+            )
+        if deadline:
+            deadline.check(f"`{resp.url}` finished downloading")
+        decoder.write(chunk)
+    return decoder.close()
+
+
+def get_charset(content_type: str):
+    for param in (content_type or "").split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset" and value.strip():
+            return value.strip().strip('"')
+    return "utf-8"
 
 
-def fetch_with_scapfly(session, url, headers, proxy_apikey, use_scrapfly_asp=False):
+def fetch_with_scapfly(session, url, headers, proxy_apikey, use_scrapfly_asp=False, deadline: Deadline=None):
     logger.info(f"Fetching `{url}` via scrapfly.io")
     headers = dict((f"headers[{k}]", v) for k, v in headers.items())
     params = dict(
@@ -127,8 +390,13 @@ def fetch_with_scapfly(session, url, headers, proxy_apikey, use_scrapfly_asp=Fal
     )
     if use_scrapfly_asp:
         params["asp"] = "true"
-    resp = session.get("https://api.scrapfly.io/scrape", params=params)
-    json_data = resp.json()
+    rate_limiter.wait(settings.SCRAPFLY_URL, deadline)
+    resp = session.get(
+        settings.SCRAPFLY_URL, params=params, stream=True, timeout=get_timeout(SCRAPFLY_READ_TIMEOUT_SECONDS, deadline)
+    )
+    with resp:
+        # the page is inside the json, so the response gets the same download limits as a direct fetch
+        json_data = json.loads(read_body(resp, deadline))
     if resp.status_code != 200:
         raise ScrapflyError(json_data)
     result = SimpleNamespace(**json_data["result"])
@@ -136,33 +404,51 @@ def fetch_with_scapfly(session, url, headers, proxy_apikey, use_scrapfly_asp=Fal
         raise FatalError(
             f"Got server error {result.status_code} from `{url}`, stopping"
         )
+    if result.status_code == 304:
+        raise NotModified(f"`{url}` not modified since last fetch")
+    if result.status_code == 429:
+        raise rate_limited(
+            url,
+            f"PROXY_GET Request failed for `{url}`, status: {result.status_code}, reason: {result.status}",
+            getattr(result, "response_headers", None),
+        )
     if result.status_code > 399:
-        raise history4feedException(
+        exc_class = Blocked if result.status_code in BLOCKED_STATUS_CODES else history4feedException
+        raise exc_class(
             f"PROXY_GET Request failed for `{url}`, status: {result.status_code}, reason: {result.status}"
         )
     elif result.status_code > 299:
         raise FetchRedirect(
             f"PROXY_GET for `{url}` redirected, status: {result.status_code}, reason: {result.status}"
         )
+    check_content_type(getattr(result, "content_type", None), url)
     if getattr(result, 'format', None) in ["blob", "clob"]:
-        blob_resp = session.get(result.content, params=dict(key=proxy_apikey))
-        result.content = blob_resp.content
+        rate_limiter.wait(result.content, deadline)
+        blob_resp = session.get(
+            result.content, params=dict(key=proxy_apikey), stream=True, timeout=get_timeout(deadline=deadline)
+        )
+        with blob_resp:
+            result.content = read_body(blob_resp, deadline)
     return headers, result
 
 
 def parse_feed_from_url(url):
     data, content_type, url = fetch_page_with_retries(url, retry_count=0)
-    return parse_feed_from_content(data, url)
+    # only reads the document as far as the metadata
+    return parse_feed(data, url).metadata
 
 
-def get_full_text(link, use_scrapfly_asp):
+def get_full_text(link, use_scrapfly_asp, **kwargs):
     try:
         page, content_type, url = fetch_page_with_retries(
-            link, use_scrapfly_asp=use_scrapfly_asp
+            link, use_scrapfly_asp=use_scrapfly_asp, **kwargs
         )
-        doc = ReadabilityDocument(page.decode(), url=url)
-        return doc.summary(), content_type
-    except SoftTimeLimitExceeded:
+        try:
+            html = str(page, get_charset(content_type), errors="replace")
+        except LookupError:
+            html = str(page, "utf-8", errors="replace")
+        return extraction.summarize(html, url, deadline=kwargs.get("deadline")), content_type
+    except (SoftTimeLimitExceeded, HostCircuitOpen, DeadlineExceeded):
         raise
     except BaseException as e:
         raise history4feedException(f"Error processing fulltext: {e}") from e
@@ -177,75 +463,132 @@ class PostDict:
     categories: list[str] = None
     description: str = "EMPTY BODY"
     content_type: str = "text/html"
+    # the description is the full post, embedded in the feed
+    is_full_text: bool = False
 
 
-def parse_feed_from_content(data: bytes, url: str):
-    feed_data = {}
-    try:
-        if isinstance(data, str):
-            document = parse(StringIO(data))
-        else:
-            document = parse(BytesIO(data))
-        # check if it's atom or rss
-        if rss := getFirstElementByTag(document, "rss"):
-            channel = getFirstElementByTag(rss, "channel")
-            feed_data["description"] = getText(
-                getFirstElementByTag(channel, "description")
-            )
-            feed_data["title"] = getText(getFirstElementByTag(channel, "title"))
-            # feed_data['rel'] = getText(getFirstElementByTag(channel, "link"))
+@dataclass
+class ParsedFeed:
+    metadata: dict
+    posts: Iterator[PostDict]
 
-            feed_data["feed_type"] = "rss"
-        elif feed := getFirstElementByTag(document, "feed"):
-            feed_data["description"] = getText(getFirstElementByTag(feed, "subtitle"))
-            feed_data["title"] = getText(getFirstElementByTag(feed, "title"))
-            # feed_data['rel'] = getAtomLink(feed)
 
-            feed_data["feed_type"] = "atom"
-        else:
-            raise UnknownFeedtypeException("feed is neither RSS or ATOM")
-        feed_data["url"] = url
-        return feed_data
+def parse_feed(data: bytes, url: str) -> ParsedFeed:
+    """
+    parses a feed once, returning its metadata and an iterator over its posts.
+
+    with the `lxml` engine posts are parsed as they are iterated, the document is only read as far as needed for the metadata until then
+    """
+    try:
+        if settings.FEED_PARSER_ENGINE == "minidom":
+            return parse_feed_minidom(data, url)
+        try:
+            reader = FeedReader(data, url)
+            metadata = reader.read_metadata()
+        except etree.XMLSyntaxError as e:
+            logger.warning(f"lxml could not parse feed from `{url}`, falling back to minidom: {e}")
+            return parse_feed_minidom(data, url)
+        return ParsedFeed(metadata, iter_posts_with_fallback(reader, data, url))
     except Exception as e:
         logger.error(f"Failed to parse feed from `{url}`: {e}", exc_info=True)
         raise UnknownFeedtypeException(f"Failed to parse feed from `{url}`: {e}") from e
 
 
-def get_publish_date(item):
-    for k in PUBDATE_TAGS:
-        published = getFirstElementByTag(item, k)
-        if published:
-            break
-    date = parse_date(getText(published))
-    if not date.tzinfo:
-        date = date.replace(tzinfo=UTC)
-    return date.astimezone(UTC)
+def parse_feed_from_content(data: bytes, url: str):
+    return parse_feed(data, url).metadata
+
+
+def parse_posts_from_rss_feed(base_url, data) -> dict[str, PostDict]:
+    return parse_posts_of_type(base_url, data, "rss")
+
+
+def parse_posts_from_atom_feed(base_url, data) -> dict[str, PostDict]:
+    return parse_posts_of_type(base_url, data, "atom")
+
+
+def parse_posts_of_type(base_url, data, feed_type) -> dict[str, PostDict]:
+    """
+    posts of a feed that has to be of `feed_type`, use `parse_feed` for feeds of either type
+    """
+    parsed = parse_feed(data, base_url)
+    if parsed.metadata["feed_type"] != feed_type:
+        raise UnknownFeedtypeException(f"expected a {feed_type} feed from `{base_url}`, got {parsed.metadata['feed_type']}")
+    return {post.link: post for post in parsed.posts}
 
 
-def get_categories(entry: Element) -> list[str]:
+def iter_posts_with_fallback(reader: "FeedReader", data, url):
+    """
+    posts of a document lxml turns out to refuse are parsed again with minidom, unless some have already been yielded
+    """
+    yielded = False
+    try:
+        for post in reader:
+            yielded = True
+            yield post
+    except etree.XMLSyntaxError as e:
+        if yielded:
+            raise
+        logger.warning(f"lxml could not parse feed from `{url}`, falling back to minidom: {e}")
+        yield from parse_feed_minidom(data, url).posts
+
+
+def parse_feed_minidom(data, url) -> ParsedFeed:
+    document = parse(BytesIO(as_bytes(data)))
+    feed_data = {}
+    # check if it's atom or rss
+    if rss := getFirstElementByTag(document, "rss"):
+        channel = getFirstElementByTag(rss, "channel")
+        feed_data["description"] = getText(
+            getFirstElementByTag(channel, "description")
+        )
+        feed_data["title"] = getText(getFirstElementByTag(channel, "title"))
+        # feed_data['rel'] = getText(getFirstElementByTag(channel, "link"))
+
+        feed_data["feed_type"] = "rss"
+        posts = iter_rss_posts_minidom(url, document)
+    elif feed := getFirstElementByTag(document, "feed"):
+        feed_data["description"] = getText(getFirstElementByTag(feed, "subtitle"))
+        feed_data["title"] = getText(getFirstElementByTag(feed, "title"))
+        # feed_data['rel'] = getAtomLink(feed)
+
+        feed_data["feed_type"] = "atom"
+        posts = iter_atom_posts_minidom(url, document)
+    else:
+        raise UnknownFeedtypeException("feed is neither RSS or ATOM")
+    feed_data["url"] = url
+    return ParsedFeed(feed_data, posts)
+
+
+def get_publish_date(item: ItemView, resolver: PublishDateResolver=None):
+    candidates = {tag: item.text(tag) for tag in PUBDATE_TAGS if tag in item}
+    return (resolver or PublishDateResolver()).resolve(candidates)
+
+
+def get_categories(entry: ItemView) -> list[str]:
     categories = []
-    for category in entry.getElementsByTagName("category"):
-        cat = category.getAttribute("term") or getText(category)
+    for category in entry.all("category"):
+        cat = entry.attribute(category, "term") or entry.element_text(category)
         if not cat:
             cat = category
         categories.append(cat)
     return categories
 
 
-def get_author(item):
-    author = getFirstElementByTag(item, "dc:creator")
-    if not author:
-        author = getFirstElementByTag(item, "author")
-        author = getFirstElementByTag(author, "name") or author
-    return getText(author)
+def get_author(item: ItemView):
+    if "dc:creator" in item:
+        return item.text("dc:creator")
+    author = item.first("author")
+    if author is None:
+        return ""
+    return item.view(author).text("name") or item.element_text(author)
 
 
-def parse_items(elem, link):
+def parse_items(elem: ItemView, link, resolver: PublishDateResolver=None):
     return PostDict(
         # element = elem,
         link=link,
-        title=getText(getFirstElementByTag(elem, "title")),
-        pubdate=get_publish_date(elem),
+        title=elem.text("title"),
+        pubdate=get_publish_date(elem, resolver),
         author=get_author(elem),
         categories=get_categories(elem),
         description="",
@@ -253,39 +596,126 @@ def parse_items(elem, link):
     )
 
 
-def parse_posts_from_rss_feed(base_url, data) -> dict[str, PostDict]:
-    entries = {}
-    document = parse(BytesIO(data))
-    channel = getFirstElementByTag(document, "channel")
+def parse_rss_item(base_url, item: ItemView, resolver: PublishDateResolver=None):
+    link = urljoin(base_url, item.text("link").strip())
+    post = parse_items(item, link, resolver)
+    post.description, content_type, post.is_full_text = parse_rss_description(item)
+    if content_type:
+        post.content_type = content_type
+    return post
 
-    for item in channel.getElementsByTagName("item"):
-        link = urljoin(base_url, getText(getFirstElementByTag(item, "link")).strip())
-        entries[link] = parse_items(item, link)
-        entries[link].description = parse_rss_description(item)
-    return entries
 
+def parse_atom_item(base_url, item: ItemView, resolver: PublishDateResolver=None):
+    link = urljoin(base_url, item.atom_link(rel="alternate"))
+    post = parse_items(item, link, resolver)
+    post.description, content_type, post.is_full_text = parse_atom_description(item)
+    if content_type:
+        post.content_type = content_type
+    return post
 
-def parse_posts_from_atom_feed(base_url, data):
-    entries = {}
-    document = parse(BytesIO(data))
 
-    for item in document.getElementsByTagName("entry"):
-        link = urljoin(base_url, getAtomLink(item, rel="alternate"))
-        entries[link] = parse_items(item, link)
-        entries[link].description, content_type = parse_atom_description(item)
-        if content_type:
-            entries[link].content_type = content_type
-    return entries
+def parse_atom_description(item: ItemView):
+    description = ""
+    if "summary" in item:
+        description = item.text("summary")
+    content = item.first("content")
+    # content with a `src` only links to the post
+    if content is None or item.attribute(content, "src"):
+        return description, None, False
+    content_type = ATOM_CONTENT_TYPES.get(item.attribute(content, "type"))
+    if content_type == ATOM_CONTENT_TYPES["xhtml"]:
+        # the post is markup, not text
+        return item.xhtml(content), content_type, True
+    return item.element_text(content), content_type, True
+
+
+def parse_rss_description(item: ItemView):
+    if "content:encoded" in item:
+        return item.text("content:encoded"), "text/html", True
+    return item.text("description"), None, False
+
+
+def looks_complete(description: str) -> bool:
+    """
+    whether content embedded in a feed looks like the whole post rather than an excerpt
+    """
+    if not description or not description.strip():
+        return False
+    try:
+        text = lxml.html.fragment_fromstring(description, create_parent=True).text_content()
+    except etree.ParserError:
+        text = description
+    text = " ".join(text.split())
+    if len(text) < settings.FEED_CONTENT_MIN_LENGTH:
+        return False
+    return not TRUNCATION_MARKERS.search(text[-200:])
 
 
-def parse_atom_description(item: Element):
-    description = ""
-    if summary := getFirstChildByTag(item, "summary"):
-        description = getText(summary)
-    if content := getFirstChildByTag(item, "content"):
-        description = getText(content)
-    return description, None
+def iter_rss_posts_minidom(base_url, document: Document):
+    channel = getFirstElementByTag(document, "channel")
+    resolver = PublishDateResolver()
+
+    for item in channel.getElementsByTagName("item"):
+        yield parse_rss_item(base_url, MinidomItemView(item), resolver)
 
 
-def parse_rss_description(item: Element):
-    return getText(getFirstChildByTag(item, "description"))
+def iter_atom_posts_minidom(base_url, document: Document):
+    resolver = PublishDateResolver()
+    for item in document.getElementsByTagName("entry"):
+        yield parse_atom_item(base_url, MinidomItemView(item), resolver)
+
+
+class FeedReader:
+    """
+    reads the metadata and posts of a feed in a single lxml pass.
+
+    posts parsed while looking for the metadata are kept until the reader is iterated
+    """
+
+    def __init__(self, data, url):
+        self.url = url
+        self.events = iterparseFeed(BytesIO(as_bytes(data)))
+        self.feed_type = None
+        self.metadata = {}
+        self.pending: deque[PostDict] = deque()
+        self.done = False
+        self.dates = PublishDateResolver()
+
+    def read_metadata(self) -> dict:
+        """
+        metadata comes before the items, reading stops at the first item even when some of it is missing
+        """
+        while not self.done and (self.feed_type is None or (len(self.metadata) < 2 and not self.pending)):
+            self.next_event()
+        if not self.feed_type:
+            raise UnknownFeedtypeException("feed is neither RSS or ATOM")
+        return dict(
+            description=self.metadata.get("description", ""),
+            title=self.metadata.get("title", ""),
+            feed_type=self.feed_type,
+            url=self.url,
+        )
+
+    def next_event(self):
+        try:
+            event = next(self.events)
+        except StopIteration:
+            self.done = True
+            return
+        match event:
+            case ("root", name):
+                self.feed_type = "rss" if name == "rss" else "atom"
+            case ("metadata", key, text):
+                self.metadata[key] = text
+            case ("item", item):
+                if self.feed_type == "rss":
+                    self.pending.append(parse_rss_item(self.url, LxmlItemView(item), self.dates))
+                else:
+                    self.pending.append(parse_atom_item(self.url, LxmlItemView(item), self.dates))
+
+    def __iter__(self) -> Iterator[PostDict]:
+        while self.pending or not self.done:
+            if self.pending:
+                yield self.pending.popleft()
+            else:
+                self.next_event()
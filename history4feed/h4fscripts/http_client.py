@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import weakref
+
+import fake_useragent
+import requests
+from requests.adapters import HTTPAdapter
+
+from history4feed.app.settings import history4feed_server_settings as settings
+
+
+MAX_REDIRECTS = 3
+
+_lock = threading.Lock()
+# `requests.Session` is not thread-safe, every thread gets its own sessions
+_local = threading.local()
+# the sessions of every thread, for `close_sessions`. sessions of finished threads drop out with them
+_open_sessions: weakref.WeakSet["PooledSession"] = weakref.WeakSet()
+_user_agents: dict[int, fake_useragent.UserAgent] = {}
+
+
+class PooledSession:
+    """
+    keep-alive `requests.Session` with one connection pool per host, recreated once it has been idle for too long
+    """
+
+    def __init__(self, now):
+        self.session = new_session()
+        self.last_used = now
+        self.closed = False
+
+    def is_idle(self, now):
+        return now - self.last_used > settings.HTTP_POOL_IDLE_TIMEOUT_SECONDS
+
+    def close(self):
+        self.closed = True
+        self.session.close()
+
+
+def new_session() -> requests.Session:
+    session = requests.Session()
+    session.max_redirects = MAX_REDIRECTS
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(name="default") -> requests.Session:
+    """
+    returns the long-lived session `name` for the current thread of the worker process.
+
+    sessions are per thread because the fulltext and serper thread pools would otherwise share them,
+    and keyed by pid so that a forked celery worker never reuses sockets opened by its parent.
+    """
+    pid = os.getpid()
+    now = time.monotonic()
+    sessions = thread_sessions()
+    pooled = sessions.get((pid, name))
+    if pooled and (pooled.closed or pooled.is_idle(now)):
+        pooled.close()
+        pooled = None
+    if not pooled:
+        for key in [key for key in sessions if key[0] != pid]:
+            del sessions[key]
+        pooled = sessions[(pid, name)] = PooledSession(now)
+        with _lock:
+            _open_sessions.add(pooled)
+    pooled.last_used = now
+    return pooled.session
+
+
+def thread_sessions() -> dict[tuple[int, str], PooledSession]:
+    if not hasattr(_local, "sessions"):
+        _local.sessions = {}
+    return _local.sessions
+
+
+def get_user_agent() -> fake_useragent.UserAgent:
+    pid = os.getpid()
+    with _lock:
+        if pid not in _user_agents:
+            _user_agents.clear()
+            _user_agents[pid] = fake_useragent.UserAgent()
+        return _user_agents[pid]
+
+
+def random_user_agent() -> str:
+    return get_user_agent().random
+
+
+def close_sessions():
+    """
+    closes the sessions of every thread, each thread opens a new one on its next request
+    """
+    with _lock:
+        for pooled in list(_open_sessions):
+            pooled.close()
+        _open_sessions.clear()
+    thread_sessions().clear()
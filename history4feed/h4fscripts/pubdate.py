@@ -0,0 +1,117 @@
+import re
+from datetime import UTC, datetime, timedelta, timezone
+
+from dateutil.parser import parse as parse_date
+
+
+PUBDATE_TAGS =  [
+    # --- Publication / Creation Variants (Highest Priority) ---
+    "pubDate",          # Core RSS 2.0 item publication date
+    "published",        # Core Atom item publication date
+    "dcterms:issued",   # Dublin Core formal publication date
+    "dcterms:created",  # Dublin Core explicit resource creation date
+    "creation_date",    # Common custom CMS/database export tag
+    "date",             # Common un-namespaced fallback tag
+
+    # --- Modification / Update Variants (Lowest Priority) ---
+    "updated",          # Core Atom item modification date
+    "dc:date",          # Dublin Core general/modification date
+    "lastBuildDate",    # Core RSS feed/item refresh date
+    "dcterms:modified", # Dublin Core explicit resource modification date
+    "modified_date",    # Common custom database-to-XML export tag
+    "update_date",      # Custom e-commerce and API feed modification tag
+    "a10:updated"       # Microsoft .NET SyndicationFeed framework variant
+]
+PUBDATE_PRIORITY = {tag: i for i, tag in enumerate(PUBDATE_TAGS)}
+
+MONTHS = {
+    month: i + 1
+    for i, month in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+    )
+}
+# e.g. `Sun, 01 Sep 2024 08:00:00 +0000`, other zone names are left to dateutil
+RFC822_RE = re.compile(
+    r"(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?"
+    r"(?:\s*(?:([+-])(\d{2})(\d{2})|GMT|UTC|UT|Z))?"
+)
+# e.g. `2024-09-01`, `2024-09-01T08:00:00Z`, `2024-09-01 08:00:00.123+05:30`
+ISO8601_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d{1,6})?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?)?"
+)
+
+
+def parse_rfc822(text: str) -> datetime | None:
+    match = RFC822_RE.fullmatch(text)
+    if not match:
+        return None
+    day, month, year, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+    if (month := MONTHS.get(month.lower())) is None:
+        return None
+    tzinfo = UTC
+    if sign:
+        offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        tzinfo = timezone(-offset if sign == "-" else offset)
+    try:
+        return datetime(int(year), month, int(day), int(hour), int(minute), int(second or 0), tzinfo=tzinfo)
+    except ValueError:
+        return None
+
+
+def parse_iso8601(text: str) -> datetime | None:
+    if not ISO8601_RE.fullmatch(text):
+        return None
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+FAST_PARSERS = {
+    "rfc822": parse_rfc822,
+    "iso8601": parse_iso8601,
+}
+
+
+def to_utc(date: datetime) -> datetime:
+    if not date.tzinfo:
+        date = date.replace(tzinfo=UTC)
+    return date.astimezone(UTC)
+
+
+class PublishDateResolver:
+    """
+    turns the date elements of an item into its publish date.
+
+    one resolver is used per feed, it remembers which format the dates of each tag came in
+    so the next item tries that parser first. dateutil is only used when no fast parser understands a date
+    """
+
+    def __init__(self):
+        self.formats: dict[str, str] = {}
+
+    @staticmethod
+    def pick(candidates: dict[str, str]) -> tuple[str | None, str]:
+        """
+        `candidates` maps the date tags found in an item to the text of the first element of each
+        """
+        if not candidates:
+            return None, ""
+        tag = min(candidates, key=PUBDATE_PRIORITY.__getitem__)
+        return tag, candidates[tag]
+
+    def resolve(self, candidates: dict[str, str]) -> datetime:
+        tag, text = self.pick(candidates)
+        return to_utc(self.parse(text, tag))
+
+    def parse(self, text: str, tag=None) -> datetime:
+        stripped = text.strip()
+        learned = self.formats.get(tag)
+        if learned:
+            if date := FAST_PARSERS[learned](stripped):
+                return date
+        for name, parser in FAST_PARSERS.items():
+            if name != learned and (date := parser(stripped)):
+                self.formats[tag] = name
+                return date
+        return parse_date(text)
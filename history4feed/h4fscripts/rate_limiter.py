@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import redis
+from django.conf import settings as django_settings
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+from .deadline import Deadline
+from .exceptions import DeadlineExceeded
+
+
+KEY_PREFIX = "h4f-ratelimit"
+
+# reserves one token and returns how long the caller has to wait for it.
+# the bucket is allowed to go negative so that waiting callers queue up in order.
+# when the wait is longer than the optional ARGV[3], no token is taken and `skip` is returned
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) - 1
+if max_wait and -tokens / rate > max_wait then
+    return 'skip'
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# empties the bucket so that the next token is only available in ARGV[3] seconds, e.g. after a 429 with `Retry-After`
+HOLD_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local seconds = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate, 1 - seconds * rate)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return 'ok'
+"""
+
+
+class LocalTokenBucket:
+    """
+    in-process fallback used when redis is not available
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait: float = None) -> float | None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait_seconds = max(1 - self.tokens, 0) / self.rate
+            if max_wait is not None and wait_seconds > max_wait:
+                return None
+            self.tokens -= 1
+            return wait_seconds
+
+    def hold(self, seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate, 1 - seconds * self.rate)
+            self.updated = now
+
+
+class HostRateLimiter:
+    def __init__(self, redis_client: redis.Redis = None):
+        self.redis = redis_client
+        self.script = redis_client and redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.hold_script = redis_client and redis_client.register_script(HOLD_SCRIPT)
+        self.local_buckets: dict[str, LocalTokenBucket] = {}
+
+    @staticmethod
+    def get_limit(host) -> tuple[float, float]:
+        limits = settings.HOST_RATE_LIMITS
+        limit = limits.get(host) or limits["default"]
+        return limit["rate"], limit["burst"]
+
+    def reserve(self, host, max_wait: float = None) -> float | None:
+        """
+        reserves a token for `host` and returns how long to wait for it,
+        None without taking the token when that is longer than `max_wait`
+        """
+        rate, burst = self.get_limit(host)
+        if self.script:
+            args = [rate, burst] if max_wait is None else [rate, burst, max_wait]
+            try:
+                result = self.script(keys=[f"{KEY_PREFIX}:{host}"], args=args)
+                return None if result in (b"skip", "skip") else float(result)
+            except redis.RedisError as e:
+                logger.warning(f"shared rate limiter unavailable, using local bucket for {host}: {e}")
+        if host not in self.local_buckets:
+            self.local_buckets[host] = LocalTokenBucket(rate, burst)
+        return self.local_buckets[host].reserve(max_wait)
+
+    def hold(self, host, seconds: float):
+        """
+        makes every worker wait at least `seconds` before the next request to `host`
+        """
+        rate, burst = self.get_limit(host)
+        logger.info(f"{host} is rate limiting us, holding its requests for {seconds:.2f}s")
+        if self.hold_script:
+            try:
+                self.hold_script(keys=[f"{KEY_PREFIX}:{host}"], args=[rate, burst, seconds])
+                return
+            except redis.RedisError as e:
+                logger.warning(f"shared rate limiter unavailable, using local bucket for {host}: {e}")
+        if host not in self.local_buckets:
+            self.local_buckets[host] = LocalTokenBucket(rate, burst)
+        self.local_buckets[host].hold(seconds)
+
+    def wait(self, url, deadline: Deadline = None):
+        host = urlparse(url).hostname or ""
+        wait_seconds = self.reserve(host, deadline and deadline.max_wait())
+        if wait_seconds is None:
+            raise DeadlineExceeded(
+                f"deadline of {deadline.seconds}s does not leave time to wait for the rate limit of {host}"
+            )
+        if wait_seconds:
+            logger.debug(f"rate limiting {host}, waiting {wait_seconds:.2f}s")
+            time.sleep(wait_seconds)
+
+
+_limiters: dict[int, HostRateLimiter] = {}
+
+
+def get_redis_url():
+    url = settings.RATE_LIMIT_REDIS_URL or getattr(django_settings, "CELERY_BROKER_URL", None)
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return url
+    return None
+
+
+def get_limiter() -> HostRateLimiter:
+    pid = os.getpid()
+    if pid not in _limiters:
+        _limiters.clear()
+        url = get_redis_url()
+        _limiters[pid] = HostRateLimiter(url and redis.Redis.from_url(url))
+    return _limiters[pid]
+
+
+def wait(url, deadline: Deadline = None):
+    """
+    blocks until a request to `url` is allowed by the rate limit of its host.
+
+    raises `DeadlineExceeded`, without using up the host's rate, when that would not leave time for the request before `deadline`
+    """
+    get_limiter().wait(url, deadline)
+
+
+def hold(url, seconds: float):
+    """
+    backs off the host of `url` for `seconds`, for all workers sharing the rate limiter
+    """
+    get_limiter().hold(urlparse(url).hostname or "", seconds)
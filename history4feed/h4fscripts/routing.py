@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+import redis
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+from .rate_limiter import get_redis_url
+
+
+KEY_PREFIX = "h4f-route"
+
+DIRECT = "direct"
+SCRAPFLY = "scrapfly"
+SCRAPFLY_ASP = "scrapfly_asp"
+ROUTES = (DIRECT, SCRAPFLY, SCRAPFLY_ASP)
+
+
+class HostRouter:
+    """
+    remembers, per host, whether a direct fetch works or whether the host blocks us and has to go through scrapfly.
+
+    decisions expire after `SCRAPFLY_ROUTE_TTL_SECONDS` so that hosts that stop blocking us are tried directly again
+    """
+
+    def __init__(self, redis_client: redis.Redis = None):
+        self.redis = redis_client
+        self.local_routes: dict[str, tuple[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, host) -> str | None:
+        if self.redis:
+            try:
+                route = self.redis.get(f"{KEY_PREFIX}:{host}")
+                route = route.decode() if isinstance(route, bytes) else route
+                return route if route in ROUTES else None
+            except redis.RedisError as e:
+                logger.warning(f"shared route memory unavailable, using local memory for {host}: {e}")
+        with self.lock:
+            route, expires_at = self.local_routes.get(host, (None, 0))
+            if expires_at < time.monotonic():
+                self.local_routes.pop(host, None)
+                return None
+            return route
+
+    def remember(self, host, route):
+        ttl = settings.SCRAPFLY_ROUTE_TTL_SECONDS
+        logger.info(f"routing `{host}` through `{route}` for the next {ttl}s")
+        if self.redis:
+            try:
+                self.redis.set(f"{KEY_PREFIX}:{host}", route, ex=ttl)
+                return
+            except redis.RedisError as e:
+                logger.warning(f"shared route memory unavailable, using local memory for {host}: {e}")
+        with self.lock:
+            self.local_routes[host] = (route, time.monotonic() + ttl)
+
+
+_routers: dict[int, HostRouter] = {}
+
+
+def get_router() -> HostRouter:
+    pid = os.getpid()
+    if pid not in _routers:
+        _routers.clear()
+        url = get_redis_url()
+        _routers[pid] = HostRouter(url and redis.Redis.from_url(url))
+    return _routers[pid]
+
+
+def get_route(host) -> str | None:
+    if settings.SCRAPFLY_ROUTING != "adaptive":
+        return SCRAPFLY
+    return get_router().get(host)
+
+
+def remember(host, route):
+    if settings.SCRAPFLY_ROUTING == "adaptive":
+        get_router().remember(host, route)
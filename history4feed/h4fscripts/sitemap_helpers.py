@@ -2,9 +2,15 @@ import json
 import logging
 import os
 import time
+import threading
 from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from urllib.parse import urlencode
-from .h4f import FatalError, PostDict, fetch_page_with_retries
+from .h4f import FatalError, PostDict, fetch_page_with_retries, get_timeout
+from . import http_client, rate_limiter
+from .deadline import Deadline
+from .exceptions import DeadlineExceeded
 from history4feed.app.settings import history4feed_server_settings as settings
 import requests
 from datetime import UTC, datetime as dt
@@ -13,47 +19,204 @@ import requests
 from datetime import datetime as dt, date, timedelta
 from dateparser import parse as parse_date
 DEFAULT_USER_AGENT = "curl"
+SERPER_URL = "https://google.serper.dev/search"
+
+SERPER_PAGE_SIZE = 100
+# how much wider or narrower than the last window the next one can be
+WINDOW_GROWTH = 4
+
 
 class SearchIndexError(FatalError):
     pass
 
-def fetch_posts_links_with_serper(site, from_time: dt, to_time: dt = None, delta_days=100) -> dict[str, PostDict]:
-    s = requests.Session()
-    s.headers.update({
+@dataclass
+class SerperCredits:
+    """
+    serper credits of a job. queries stop being sent once `used` reaches `budget`, no budget when it is falsy.
+
+    `searched_until` is set when a search stops before the end of its range (budget or deadline reached, a window failed),
+    every day up to and including it was searched
+    """
+
+    budget: int | None
+    used: int = 0
+    exhausted: bool = False
+    # credits a query is expected to cost, updated from the last response
+    cost: int = 1
+    reserved: int = field(default=0, repr=False)
+    searched_until: date | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def reserve(self) -> int | None:
+        """
+        credits reserved for the next query, to be given back to `spend`. None once the budget is reached
+        """
+        with self.lock:
+            if self.budget and self.used + self.reserved + self.cost > self.budget:
+                self.exhausted = True
+                return None
+            self.reserved += self.cost
+            return self.cost
+
+    def spend(self, reserved: int, credits: int):
+        with self.lock:
+            self.reserved -= reserved
+            self.used += credits
+            self.cost = credits or self.cost
+
+    def to_json(self) -> dict:
+        return dict(budget=self.budget, used=self.used, exhausted=self.exhausted)
+
+    @classmethod
+    def from_json(cls, value: dict | None, budget: int | None) -> "SerperCredits":
+        return cls(budget, used=(value or {}).get("used", 0))
+
+
+SearchWindow = namedtuple("SearchWindow", ["after", "before", "page"])
+
+
+def covered_days(window: SearchWindow) -> int:
+    """
+    `after:` and `before:` both exclude their day, `after:2024-01-01 before:2024-01-04` covers the 2nd and 3rd
+    """
+    return (window.before - window.after).days - 1
+
+
+def split_window(window: SearchWindow) -> list[SearchWindow] | None:
+    """
+    two windows covering the days of `window` between them, each day in exactly one of them.
+    None when the window only covers a single day, it is paged instead
+    """
+    days = covered_days(window)
+    if days <= 1:
+        return None
+    # the last day of the left half is excluded by the right half's `after:`
+    middle = window.after + timedelta(days=days // 2)
+    return [SearchWindow(window.after, middle + timedelta(days=1), 1), SearchWindow(middle, window.before, 1)]
+
+
+def next_window_days(window: SearchWindow, results: int, days: int) -> int:
+    """
+    width of the next window, so that it is expected to return about half a page.
+
+    quiet ranges are merged into wider windows and busy ones narrowed, by at most `WINDOW_GROWTH` at a time
+    """
+    covered = (window.before - window.after).days
+    target = covered * (SERPER_PAGE_SIZE // 2) / max(results, 1)
+    return int(min(max(target, days / WINDOW_GROWTH, 2), days * WINDOW_GROWTH))
+
+
+def fetch_posts_links_with_serper(site, from_time: dt, to_time: dt = None, delta_days=100, credits: SerperCredits = None, deadline: Deadline = None) -> dict[str, PostDict]:
+    """
+    searches `site` one date window at a time, `SERPER_CONCURRENCY` windows at once.
+
+    a window returning a full page may be hiding posts, so it is split in two and both halves are searched.
+    windows of a single day are paged instead. the next windows are sized from how many results the last ones returned,
+    starting with `delta_days` days.
+
+    when the credit budget or `deadline` is reached first, or a window fails after others were searched,
+    the posts found so far are returned and `credits.searched_until` tells where the next search has to resume from
+    """
+    credits = credits or SerperCredits(None)
+    headers = {
         'X-API-KEY':  os.getenv("SERPER_API_KEY"),
         'Content-Type': 'application/json'
-    })
+    }
 
-    params = dict(num=100, page=1)
-    entries: dict[str, PostDict] = {}
     to_time = to_time or dt.now(UTC)
     if not to_time.tzinfo:
         to_time = to_time.replace(tzinfo=UTC)
 
-    frame_start = from_time - timedelta(days=1)
-    credits_used = 0
-
-    while frame_start < to_time:
-        frame_end = frame_start + timedelta(days=delta_days)
-        params.update(q=f"site:{site} after:{frame_start.date().isoformat()} before:{frame_end.date().isoformat()}", page=1)
-        while True:
-            resp = s.get("https://google.serper.dev/search", params=params)
+    def search(window: SearchWindow, reserved: int):
+        params = dict(num=SERPER_PAGE_SIZE, page=window.page, q=f"site:{site} after:{window.after.isoformat()} before:{window.before.isoformat()}")
+        try:
+            rate_limiter.wait(SERPER_URL, deadline)
+            # searches run on a thread pool, each thread has its own session
+            resp = http_client.get_session("serper").get(
+                SERPER_URL, params=params, headers=headers, timeout=get_timeout(deadline=deadline)
+            )
             if not resp.ok:
                 raise SearchIndexError(f"Serper Request GOT {resp.status_code}: {resp.text}")
             data = resp.json()
-            credits_used += data['credits']
-            for d in data['organic']:
-                date = d.get('date')
-                if date:
-                    date = parse_date(date)
+        except BaseException:
+            credits.spend(reserved, 0)
+            raise
+        credits.spend(reserved, data['credits'])
+        posts = []
+        for d in data['organic']:
+            date = d.get('date')
+            if date:
+                date = parse_date(date)
+            else:
+                date = min(dt.combine(window.before, dt.min.time(), UTC), to_time)
+            posts.append(PostDict(link=d['link'], title=d['title'], pubdate=date, categories=[]))
+        return posts
+
+    cursor = (from_time - timedelta(days=1)).date()
+    end = to_time.date() + timedelta(days=1)
+    days = delta_days
+    queue: list[SearchWindow] = []
+    found: dict[SearchWindow, list[PostDict]] = {}
+    futures = {}
+    # windows are no longer sent once one of them failed or the deadline was reached
+    stopped = False
+    error = None
+    executor = ThreadPoolExecutor(settings.SERPER_CONCURRENCY, thread_name_prefix="h4f-serper")
+    try:
+        while True:
+            while not stopped and len(futures) < settings.SERPER_CONCURRENCY and (queue or cursor < end - timedelta(days=1)):
+                if (reserved := credits.reserve()) is None:
+                    break
+                if queue:
+                    window = queue.pop(0)
                 else:
-                    date = min(frame_end, to_time)
-                post = PostDict(link=d['link'], title=d['title'], pubdate=date, categories=[])
-                entries[post.link] = post
-            params['page'] += 1
-            if len(data['organic']) < params['num']:
+                    window = SearchWindow(cursor, min(cursor + timedelta(days=days), end), 1)
+                    cursor = window.before - timedelta(days=1)
+                futures[executor.submit(search, window, reserved)] = window
+            if not futures:
                 break
-        frame_start = frame_end - timedelta(days=1)
-    logging.info(f"got {len(entries)} posts between {from_time} and {to_time}, used {credits_used} credits")
-    return entries
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                window = futures.pop(future)
+                try:
+                    found[window] = posts = future.result()
+                except DeadlineExceeded as e:
+                    # searched by the next job instead
+                    logging.warning(f"stopped searching {site}: {e}")
+                    stopped = True
+                    queue.append(window)
+                    continue
+                except Exception as e:
+                    logging.warning(f"stopped searching {site}, window {window} failed: {e}")
+                    stopped = True
+                    error = error or e
+                    queue.append(window)
+                    continue
+                if len(posts) < SERPER_PAGE_SIZE:
+                    if window.page == 1:
+                        days = next_window_days(window, len(posts), days)
+                    continue
+                if window.page == 1 and (halves := split_window(window)):
+                    queue.extend(halves)
+                    days = max(days // 2, 2)
+                else:
+                    queue.append(window._replace(page=window.page + 1))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if error and not found:
+        # nothing to resume from, the url fails instead
+        raise error
 
+    entries: dict[str, PostDict] = {}
+    for window in sorted(found):
+        for post in found[window]:
+            entries[post.link] = post
+    # days after the start of a window still queued (split halves, next pages) or not reached yet were not all searched
+    unsearched = [window.after for window in queue]
+    if cursor < end - timedelta(days=1):
+        unsearched.append(cursor)
+    if unsearched:
+        credits.searched_until = min(unsearched)
+        logging.warning(f"serper search stopped early ({credits.used} of {credits.budget} credits used), {site} was only searched up to {credits.searched_until}")
+    logging.info(f"got {len(entries)} posts between {from_time} and {to_time}, used {credits.used} credits")
+    return entries
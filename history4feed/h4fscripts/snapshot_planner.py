@@ -0,0 +1,141 @@
+import bisect
+import statistics
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from .pubdate import to_utc
+
+
+# captures read one after the other before the planner starts skipping
+PROBES = 3
+# part of the estimated item window kept as overlap between two captures that are read
+MARGIN = 0.25
+
+
+@dataclass
+class Coverage:
+    """
+    what a capture of a feed shows: how many items and the publish dates they span
+    """
+
+    items: int
+    oldest: datetime
+    newest: datetime
+
+    @classmethod
+    def from_pubdates(cls, pubdates) -> "Coverage | None":
+        pubdates = [to_utc(pubdate) for pubdate in pubdates if pubdate]
+        if not pubdates:
+            return None
+        return cls(len(pubdates), min(pubdates), max(pubdates))
+
+    def to_json(self) -> list:
+        return [self.items, self.oldest.isoformat(), self.newest.isoformat()]
+
+    @classmethod
+    def from_json(cls, value: list | None) -> "Coverage | None":
+        if not value:
+            return None
+        items, oldest, newest = value
+        return cls(items, datetime.fromisoformat(oldest), datetime.fromisoformat(newest))
+
+
+class SnapshotPlanner:
+    """
+    picks which wayback captures of a feed to read.
+
+    a feed only shows its last few items, so consecutive captures mostly show the same posts. once `PROBES` captures
+    have been read, the planner knows how far back a capture reaches (its capture time minus its oldest item)
+    and jumps to the latest capture that still reaches back to the newest item already read.
+
+    when two captures that were read do not overlap (the later one starts after the earlier one ends),
+    posts may be missing, so the captures between them are read too, halving the range each time.
+
+    the planner only depends on the coverages recorded so far, so it can be rebuilt from them by another task
+    """
+
+    def __init__(self, timestamps: list[datetime]):
+        # capture times, in order
+        self.timestamps = [to_utc(timestamp) for timestamp in timestamps]
+        self.coverages: dict[int, Coverage | None] = {}
+        self.read: list[int] = []
+        self.frontier = -1
+
+    def __iter__(self):
+        while batch := self.next_batch(1):
+            yield batch[0]
+
+    def next_batch(self, size: int) -> list[int]:
+        """
+        up to `size` captures that can be read at the same time.
+
+        gaps between captures already read come first. otherwise the jumps are chained assuming the newest item
+        of each capture jumped to is about its capture time, a wrong guess shows up as a gap in the next batch
+        """
+        if gaps := self.gaps():
+            return gaps[:size]
+        last = len(self.timestamps) - 1
+        if self.frontier >= last:
+            return []
+        coverage = self.coverages.get(self.frontier)
+        reach = self.reach()
+        if not coverage or reach is None:
+            # only as many captures in a row as are still needed to learn the reach
+            probes = max(PROBES - sum(1 for coverage in self.coverages.values() if coverage), 1)
+            return list(range(self.frontier + 1, min(self.frontier + 1 + min(size, probes), last + 1)))
+        batch = []
+        index, newest = self.frontier, coverage.newest
+        while index < last and len(batch) < size:
+            index = self.jump(index, newest, reach)
+            newest = self.timestamps[index]
+            batch.append(index)
+        return batch
+
+    def record(self, index: int, coverage: Coverage | None):
+        """
+        `coverage` is None when the capture could not be read or had no items
+        """
+        self.coverages[index] = coverage
+        bisect.insort(self.read, index)
+        self.frontier = max(self.frontier, index)
+
+    def gaps(self) -> list[int]:
+        """
+        captures halfway between two captures read with possibly missing posts between them
+        """
+        return [
+            (earlier + later) // 2
+            for earlier, later in zip(self.read, self.read[1:])
+            if later - earlier > 1 and self.has_gap(earlier, later)
+        ]
+
+    def has_gap(self, earlier: int, later: int) -> bool:
+        earlier_coverage, later_coverage = self.coverages[earlier], self.coverages[later]
+        if not (earlier_coverage and later_coverage):
+            # nothing is known about what is between them
+            return True
+        return later_coverage.oldest > earlier_coverage.newest
+
+    def reach(self) -> timedelta | None:
+        """
+        how far back from its capture time a capture shows items
+        """
+        reaches = [
+            self.timestamps[index] - coverage.oldest
+            for index, coverage in self.coverages.items()
+            if coverage
+        ]
+        if len(reaches) < PROBES:
+            return None
+        return statistics.median(reaches)
+
+    def jump(self, index: int, newest: datetime, reach: timedelta) -> int:
+        """
+        latest capture after `index` that still shows `newest`
+        """
+        latest = newest + reach * (1 - MARGIN)
+        return max(bisect.bisect(self.timestamps, latest) - 1, index + 1)
+
+    def skipped(self) -> list[int]:
+        read = set(self.read)
+        return [index for index in range(len(self.timestamps)) if index not in read]
@@ -0,0 +1,228 @@
+import base64
+import functools
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+import zstandard
+
+from history4feed.app.settings import history4feed_server_settings as settings
+from . import logger
+
+
+@functools.cache
+def wayback_snapshot_re(wayback_url: str) -> re.Pattern:
+    host = re.escape(urlparse(wayback_url).netloc)
+    return re.compile(rf"^https?://{host}/web/(\d+)id_/(.+)$")
+
+
+def match_wayback_snapshot(url: str) -> re.Match | None:
+    """
+    the capture timestamp and original url of a snapshot url served from `WAYBACK_URL`
+    """
+    return wayback_snapshot_re(settings.WAYBACK_URL).match(url)
+
+
+def is_wayback_snapshot(url: str) -> bool:
+    """
+    `id_` snapshots never change once captured, so they are safe to keep forever
+    """
+    return bool(match_wayback_snapshot(url))
+
+
+def sha256(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def content_digest(data: bytes) -> str:
+    # same shape as the `digest` column returned by the CDX server
+    return base64.b32encode(hashlib.sha1(data).digest()).decode()
+
+
+class SnapshotStore:
+    """
+    Content-addressed on-disk archive of Wayback snapshot bodies.
+
+    objects/  zstd compressed bodies keyed by their CDX digest
+    refs/     snapshot url (original url + timestamp) -> digest
+    dicts/    zstd dictionaries trained on the snapshots of each feed, since consecutive snapshots are nearly identical
+
+    The least recently used objects are evicted once the store grows over `max_bytes`.
+    Dictionaries are trained by `train_dict`, outside of `put`, once `put` reports enough samples of a feed.
+    """
+
+    def __init__(self, root, max_bytes, dict_samples=8, dict_size=64 * 1024, level=10):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.dict_samples = dict_samples
+        self.dict_size = dict_size
+        self.level = level
+        self.size = None
+        self.dicts: dict[int, zstandard.ZstdCompressionDict] = {}
+        self.lock = threading.Lock()
+
+    def ref_path(self, url) -> Path:
+        key = sha256(url)
+        return self.root / "refs" / key[:2] / key
+
+    def object_path(self, digest) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.zst"
+
+    def feed_path(self, url, suffix) -> Path:
+        match = match_wayback_snapshot(url)
+        feed_url = match.group(2) if match else url
+        return self.root / "dicts" / f"{sha256(feed_url)}.{suffix}"
+
+    def get(self, url) -> bytes | None:
+        """
+        the archived body of `url`, None when it is not archived or can no longer be read
+        """
+        digest = read_text(self.ref_path(url))
+        if not digest:
+            return None
+        path = self.object_path(digest)
+        try:
+            blob = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            return self.decompress(blob)
+        except (OSError, zstandard.ZstdError) as e:
+            # corrupt or truncated object, or its dictionary is gone. it is written again once downloaded
+            logger.warning(f"dropping unreadable archived snapshot of `{url}`: {e}")
+            path.unlink(missing_ok=True)
+            self.ref_path(url).unlink(missing_ok=True)
+            return None
+
+    def link(self, url, digest):
+        """
+        records the CDX digest of a snapshot before it is downloaded,
+        so that captures sharing a digest are only downloaded once
+        """
+        path = self.ref_path(url)
+        if not path.exists():
+            write_atomic(path, digest.encode())
+
+    def put(self, url, data: bytes) -> bool:
+        """
+        archives the body of `url`, returns whether the dictionary of its feed is due to be trained
+        """
+        digest = read_text(self.ref_path(url)) or content_digest(data)
+        path = self.object_path(digest)
+        train = False
+        if not path.exists():
+            blob = self.compress(url, data)
+            write_atomic(path, blob)
+            train = self.add_sample(url, digest)
+            self.track_size(len(blob))
+        write_atomic(self.ref_path(url), digest.encode())
+        return train
+
+    def compress(self, url, data: bytes) -> bytes:
+        dict_id = read_text(self.feed_path(url, "id"))
+        dict_data = self.load_dict(int(dict_id)) if dict_id else None
+        return zstandard.ZstdCompressor(level=self.level, dict_data=dict_data).compress(data)
+
+    def decompress(self, blob: bytes) -> bytes:
+        dict_id = zstandard.get_frame_parameters(blob).dict_id
+        dict_data = self.load_dict(dict_id) if dict_id else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(blob)
+
+    def load_dict(self, dict_id) -> zstandard.ZstdCompressionDict:
+        if dict_id not in self.dicts:
+            data = (self.root / "dicts" / f"{dict_id}.dict").read_bytes()
+            self.dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+        return self.dicts[dict_id]
+
+    def add_sample(self, url, digest) -> bool:
+        if self.feed_path(url, "id").exists():
+            return False
+        samples_path = self.feed_path(url, "samples")
+        samples_path.parent.mkdir(parents=True, exist_ok=True)
+        with samples_path.open("a") as f:
+            f.write(digest + "\n")
+        digests = samples_path.read_text().split()
+        return len(digests) % self.dict_samples == 0
+
+    def train_dict(self, url):
+        """
+        trains the dictionary of the feed of `url` on the snapshots sampled so far
+        """
+        if self.feed_path(url, "id").exists():
+            return
+        samples = []
+        for digest in (read_text(self.feed_path(url, "samples")) or "").split():
+            try:
+                samples.append(self.decompress(self.object_path(digest).read_bytes()))
+            except (OSError, zstandard.ZstdError):
+                pass
+        try:
+            dict_data = zstandard.train_dictionary(self.dict_size, samples)
+        except zstandard.ZstdError as e:
+            logger.info(f"could not train snapshot dictionary for `{url}` yet: {e}")
+            return
+        write_atomic(self.root / "dicts" / f"{dict_data.dict_id()}.dict", dict_data.as_bytes())
+        write_atomic(self.feed_path(url, "id"), str(dict_data.dict_id()).encode())
+
+    def track_size(self, added):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.iter_objects())
+            else:
+                self.size += added
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def iter_objects(self):
+        for path in (self.root / "objects").glob("*/*.zst"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        objects = sorted(self.iter_objects(), key=lambda o: o[2])
+        self.size = sum(size for _, size, _ in objects)
+        target = self.max_bytes * 0.9
+        for path, size, _ in objects:
+            if self.size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+        logger.info(f"snapshot store evicted down to {self.size} bytes")
+
+
+def read_text(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+_stores: dict[str, SnapshotStore] = {}
+
+
+def get_store() -> SnapshotStore | None:
+    root = settings.SNAPSHOT_STORE_DIR
+    if not root:
+        return None
+    root = str(root)
+    if root not in _stores:
+        _stores[root] = SnapshotStore(
+            root,
+            max_bytes=settings.SNAPSHOT_STORE_MAX_BYTES,
+            dict_samples=settings.SNAPSHOT_STORE_DICT_SAMPLES,
+        )
+    return _stores[root]
@@ -1,24 +1,35 @@
+import hashlib
 import time
+from collections import Counter
 from celery import shared_task, Task as CeleryTask
 import celery
 from celery.result import ResultSet, AsyncResult
 from celery.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
 import redis
+import zstandard
 
-from history4feed.h4fscripts.sitemap_helpers import fetch_posts_links_with_serper
+from history4feed.h4fscripts.sitemap_helpers import SerperCredits, fetch_posts_links_with_serper
 
 from ..app import models
-from . import h4f, wayback_helpers, logger, exceptions
-from datetime import UTC, datetime
+from . import h4f, http_client, wayback_helpers, logger, exceptions, fulltext_engine, snapshot_store, snapshot_planner
+from .deadline import Deadline
+from datetime import UTC, datetime, time as dt_time, timedelta
 from history4feed.app.settings import history4feed_server_settings as settings
 
 from urllib.parse import urlparse
 from contextlib import contextmanager
 from django.core.cache import cache
 from rest_framework.exceptions import APIException, Throttled
-from django.db import transaction
+from django.db import DatabaseError, transaction
 
 LOCK_EXPIRE = 60 * 60
+START_JOB_TIME_LIMIT = 600
+# CDX pages listed by one `start_job` run, a run of pages without new captures continues in a new task
+CDX_PAGES_PER_TASK = 10
+# a search index url is searched for at most this long, the next job carries on from where it stopped
+SERPER_SEARCH_SECONDS = 30 * 60
+# digests of captures this long before the watermark are still kept, in case the CDX server lists them late
+CDX_DIGEST_OVERLAP = timedelta(days=7)
 
 
 def get_lock_id(feed: models.Feed):
@@ -66,12 +77,19 @@ def new_job(
             }
         )
 
-    task = start_job.s(job_obj.pk) | retrieve_posts_from_links.s(job_obj.pk)
-    task.stamp(job_id=str(job_obj.id))
-    task.apply_async(countdown=5, link_error=error_handler.s(job_obj.pk))
+    apply_job_chain(job_obj.pk, countdown=5)
     return job_obj
 
 
+def apply_job_chain(job_id, **options):
+    """
+    lists the urls to read (wayback captures are listed one CDX page per run) and reads posts from them
+    """
+    task = start_job.s(job_id) | retrieve_posts_from_links.s(job_id)
+    task.stamp(job_id=str(job_id))
+    task.apply_async(link_error=error_handler.s(job_id), **options)
+
+
 def new_patch_posts_job(
     feed: models.Feed, posts: list[models.Post], include_remote_blogs=True
 ):
@@ -90,16 +108,8 @@ def new_patch_posts_job(
 @shared_task
 def create_celery_tasks_for_post_patch(job_id, post_ids):
     job_obj = models.Job.objects.get(pk=job_id)
-    ft_jobs = []
-    for post_id in post_ids:
-        post = models.Post.objects.get(pk=post_id)
-        ft_job = models.FulltextJob.objects.create(
-            job_id=job_obj.id,
-            post_id=post.id,
-            link=post.link,
-        )
-        ft_jobs.append(retrieve_full_text.si(ft_job.pk))
-    chain = celery.chain(ft_jobs)
+    posts = [models.Post.objects.get(pk=post_id) for post_id in post_ids]
+    chain = create_fulltexts_task_chain(job_obj.id, posts)
     chain.stamp(job_id=str(job_obj.id))
     task = (
         start_post_job.si(job_obj.id)
@@ -123,8 +133,25 @@ def start_post_job(self: CeleryTask, job_id):
     return True
 
 
-@shared_task(soft_time_limit=600, time_limit=800)
-def start_job(job_id):
+def uses_countdown_retries():
+    return settings.RETRY_MODE == "countdown"
+
+
+def retry_countdown(attempt):
+    # same backoff as `h4f.fetch_page_with_retries`
+    return settings.WAYBACK_SLEEP_SECONDS * 1.5**attempt
+
+
+def should_retry_later(e: BaseException, attempt):
+    return (
+        uses_countdown_retries()
+        and attempt < settings.REQUEST_RETRY_COUNT
+        and h4f.is_transient_error(e)
+    )
+
+
+@shared_task(bind=True, soft_time_limit=START_JOB_TIME_LIMIT, time_limit=START_JOB_TIME_LIMIT + 200)
+def start_job(self: CeleryTask, job_id):
     job = models.Job.objects.get(pk=job_id)
     feed = job.feed
     job.update_state(models.JobState.RUNNING)
@@ -134,98 +161,525 @@ def start_job(job_id):
             or job.extra_data["use_feed_url_only"]
         ):
             return [feed.url]
-        return wayback_helpers.get_wayback_urls(
-            feed.url, job.earliest_item_requested, job.latest_item_requested
-        )
+        urls = list_wayback_snapshots(job)
+        if not urls and not job.is_cancelled():
+            # only pages of captures already processed so far, the rest of the listing gets a task of its own
+            return self.replace(start_job.si(job_id))
+        return urls
+    except (SoftTimeLimitExceeded, exceptions.DeadlineExceeded) as e:
+        attempt = self.request.retries or 0
+        if attempt >= settings.REQUEST_RETRY_COUNT or job.is_cancelled():
+            return fail_start_job(job, e)
+        # every page listed so far saved its resume key, the retry continues after the last one
+        countdown = retry_countdown(attempt)
+        logger.warning(f"listing wayback snapshots for job {job_id} timed out, continuing in {countdown}s: {e}")
+        raise self.retry(countdown=countdown, max_retries=settings.REQUEST_RETRY_COUNT)
+    except ConnectionError as e:
+        attempt = self.request.retries or 0
+        if not should_retry_later(e, attempt) or job.is_cancelled():
+            return fail_start_job(job, e)
+        countdown = retry_countdown(attempt)
+        logger.warning(f"could not list wayback snapshots for job {job_id}, retrying in {countdown}s: {e}")
+        raise self.retry(countdown=countdown, max_retries=settings.REQUEST_RETRY_COUNT)
     except BaseException as e:
-        job.update_state(models.JobState.FAILED)
-        job.info = str(e)
-        job.save(update_fields=["info"])
-        return []
+        return fail_start_job(job, e)
+
+
+def list_wayback_snapshots(job: models.Job):
+    """
+    lists the next wayback captures of the job's feed, page by page until one has new captures or `CDX_PAGES_PER_TASK`
+    pages are listed, an empty list means the listing has to be continued.
+
+    the CDX resume key is saved after every page, so a listing that timed out (or a later run for the next page)
+    continues where it stopped. the feed url itself is read after the last page
+    """
+    feed = job.feed
+    listing = job.extra_data.get("cdx_listing") or {}
+    seen_digests = set(job.extra_data.get("cdx_digests", {}).values())
+    cdx_kwargs = dict(retry_count=0) if uses_countdown_retries() else {}
+    if not job.extra_data.get("force_full_fetch"):
+        # only captures the feed has not processed yet
+        cdx_kwargs.update(since=feed.cdx_watermark)
+        seen_digests.update(feed.cdx_digests)
+    pages = wayback_helpers.iter_wayback_snapshots(
+        feed.url,
+        job.earliest_item_requested,
+        job.latest_item_requested,
+        deadline=Deadline.for_task(START_JOB_TIME_LIMIT),
+        seen_digests=seen_digests,
+        resume_key=listing.get("resume_key"),
+        **cdx_kwargs,
+    )
+    urls = []
+    pages_listed = 0
+    for page in pages:
+        page_urls = [wayback_helpers.get_snapshot_url(snapshot) for snapshot in page.results]
+        job.extra_data.setdefault("cdx_digests", {}).update(
+            zip(page_urls, [snapshot.digest for snapshot in page.results])
+        )
+        save_extra_data(job, "cdx_digests")
+        listing = update_cdx_listing(job, resume_key=page.resume_key, pages=listing.get("pages", 0) + 1)
+        urls.extend(page_urls)
+        pages_listed += 1
+        if urls or pages_listed >= CDX_PAGES_PER_TASK:
+            break
+    if not listing.get("resume_key"):
+        urls.append(feed.url)
+    return urls
+
+
+def fail_start_job(job: models.Job, e: BaseException):
+    job.update_state(models.JobState.FAILED)
+    job.info = str(e)
+    job.save(update_fields=["info"])
+    if job.extra_data.get("cdx_listing"):
+        # the rest of the listing is given up on
+        update_cdx_listing(job, resume_key=None)
+    return []
+
+
+@transaction.atomic
+def save_extra_data(job: models.Job, *keys):
+    """
+    writes `keys` of `job.extra_data` back without overwriting the keys other tasks of the job update at the same time
+    """
+    locked = models.Job.objects.select_for_update().get(pk=job.pk)
+    for key in keys:
+        locked.extra_data[key] = job.extra_data[key]
+    locked.save(update_fields=["extra_data"])
+    job.extra_data = locked.extra_data
+
+
+@transaction.atomic
+def update_cdx_listing(job: models.Job, **changes) -> dict:
+    """
+    `cdx_listing` of a job paging through the CDX server
+
+    resume_key      where the next page starts, None once every page is listed
+    pages           pages listed so far
+    segments        number of (list a page -> read its captures -> fetch their fulltexts) chains started
+    segments_done   chains finished, the job is complete once all are done and the listing is over
+    """
+    locked = models.Job.objects.select_for_update().get(pk=job.pk)
+    listing = locked.extra_data.setdefault("cdx_listing", dict(resume_key=None, pages=0, segments=1, segments_done=0))
+    listing.update(changes)
+    locked.save(update_fields=["extra_data"])
+    job.extra_data = locked.extra_data
+    return listing
+
+
+def schedule_next_cdx_page(job: models.Job):
+    """
+    starts reading the next page of captures while the fulltexts of this one are fetched
+    """
+    listing = job.extra_data.get("cdx_listing")
+    if not listing or not listing["resume_key"]:
+        return
+    if job.is_cancelled():
+        update_cdx_listing(job, resume_key=None)
+        return
+    update_cdx_listing(job, segments=listing["segments"] + 1)
+    apply_job_chain(job.id)
+
+
+@transaction.atomic
+def finish_segment(job_id) -> bool:
+    """
+    whether this was the last chain of the job to finish
+    """
+    job = models.Job.objects.select_for_update().get(pk=job_id)
+    listing = job.extra_data.get("cdx_listing")
+    if not listing:
+        return True
+    listing["segments_done"] += 1
+    job.save(update_fields=["extra_data"])
+    return not listing["resume_key"] and listing["segments_done"] >= listing["segments"]
 
 
 @shared_task(bind=True)
 def retrieve_posts_from_links(self, urls, job_id):
+    """
+    reads posts from `urls`, `SNAPSHOT_GROUP_SIZE` of them at a time, each one in its own `retrieve_posts_from_snapshot` task.
+
+    after each group `merge_snapshot_results` picks the next one (wayback captures in the order the planner picks them,
+    then the other urls), once every url is read it updates the feed and starts fetching the fulltexts
+    """
     if not urls:
         return self.replace(collect_and_schedule_removal.si(job_id))
-    full_text_chain = models.Job.objects.get(pk=job_id)
-    feed = full_text_chain.feed
-    chains = []
-    parsed_feed = {}
     job = models.Job.objects.get(id=job_id)
-    job.extra_data["feed_urls"] = [
+    # later pages of a wayback listing add their urls after the earlier ones
+    offset = len(job.extra_data.get("feed_urls", []))
+    job.extra_data["feed_urls"] = job.extra_data.get("feed_urls", []) + [
         dict(link=url, state="queued", posts_added=0) for url in urls
     ]
-    job.save(update_fields=["extra_data"])
-    for index, url in enumerate(urls):
-        if job.is_cancelled():
-            break
-        job.extra_data["feed_urls"][index]["state"] = "processing"
-        job.save(update_fields=["extra_data"])
-        error = None
-        if feed.feed_type == models.FeedType.SEARCH_INDEX:
-            posts = retrieve_posts_from_serper(feed, job, url)
-        else:
-            parsed_feed, posts, error = retrieve_posts_from_url(url, feed, job)
-        feed_url_data = job.extra_data["feed_urls"][index]
-        if error:
-            logger.exception(error)
-            feed_url_data.update(state="failed", error=str(error))
-        else:
-            feed_url_data.update(
-                state="completed",
-            )
-        if not posts:
-            logger.warning("no new post in `%s`", url)
-            job.save(update_fields=["extra_data"])
-            continue
-        feed_url_data["posts_added"] = len(posts)
-        job.save(update_fields=["extra_data"])
-        full_text_chain = create_fulltexts_task_chain(job_id, posts)
-        full_text_chain.stamp(job_id=str(job_id))
-        chains.append(full_text_chain)
+    save_extra_data(job, "feed_urls")
+    save_snapshot_state(job, offset, dict(count=len(urls), next=0, coverages={}, fulltext_posts=[], metadata=None))
+    return self.replace(next_snapshot_group(job, offset))
 
-    if parsed_feed:
-        feed.set_description(parsed_feed["description"])
-        feed.set_title(parsed_feed["title"])
-    feed.freshness = job.run_datetime
 
+@transaction.atomic
+def save_snapshot_state(job: models.Job, offset, state: dict | None):
+    """
+    `extra_data.snapshot_groups` keeps what the groups of the urls starting at `offset` in `feed_urls` read so far,
+    so that only the job id and offset go through the broker. removed (`state=None`) once every url is read
+
+    count           number of urls
+    next            position of the next url not planned by the snapshot planner
+    coverages       coverage of every wayback capture read, by position
+    fulltext_posts  ids of the posts whose fulltext is still to fetch, one list per url
+    metadata        title and description of the latest url read
+    """
+    locked = models.Job.objects.select_for_update().get(pk=job.pk)
+    groups = locked.extra_data.setdefault("snapshot_groups", {})
+    if state is None:
+        groups.pop(str(offset), None)
+    else:
+        groups[str(offset)] = state
+    locked.save(update_fields=["extra_data"])
+    job.extra_data = locked.extra_data
+
+
+def get_snapshot_urls(job: models.Job, offset) -> list[str]:
+    count = job.extra_data["snapshot_groups"][str(offset)]["count"]
+    return [feed_url_data["link"] for feed_url_data in job.extra_data["feed_urls"][offset : offset + count]]
+
+
+@shared_task(bind=True)
+def merge_snapshot_results(self, results, job_id, offset):
+    """
+    adds the results of a group to the state of its urls, see `save_snapshot_state`
+    """
+    job = models.Job.objects.get(id=job_id)
+    state = job.extra_data["snapshot_groups"][str(offset)]
+    for result in results:
+        position = result["index"] - offset
+        if result.get("read"):
+            state["coverages"][str(position)] = result.get("coverage")
+        if result.get("post_ids"):
+            state["fulltext_posts"].append(result["post_ids"])
+        if result.get("title") is not None and position >= (state["metadata"] or {}).get("position", -1):
+            state["metadata"] = dict(position=position, title=result["title"], description=result["description"])
+    save_snapshot_state(job, offset, state)
+    return self.replace(next_snapshot_group(job, offset))
+
+
+def next_snapshot_group(job: models.Job, offset):
+    state = job.extra_data["snapshot_groups"][str(offset)]
+    urls = get_snapshot_urls(job, offset)
+    planner = load_planner(urls, state)
+    positions = [] if job.is_cancelled() else plan_snapshot_group(urls, planner, state)
+    if not positions:
+        return finish_snapshots(job, offset, planner, state)
+    save_snapshot_state(job, offset, state)
+    group = []
+    for position in positions:
+        task = retrieve_posts_from_snapshot.si(urls[position], job.id, offset + position)
+        task.stamp(job_id=str(job.id))
+        group.append(task)
+    callback = merge_snapshot_results.s(job.id, offset)
+    callback.stamp(job_id=str(job.id))
+    return celery.chord(group, callback)
+
+
+def plan_snapshot_group(urls, planner: snapshot_planner.SnapshotPlanner | None, state) -> list[int]:
+    """
+    positions of the next `SNAPSHOT_GROUP_SIZE` urls to read
+    """
+    size = settings.SNAPSHOT_GROUP_SIZE
+    if planner and (batch := planner.next_batch(size)):
+        return batch
+    start = max(state["next"], len(planner.timestamps) if planner else 0)
+    positions = list(range(start, min(start + size, len(urls))))
+    state["next"] = start + len(positions)
+    return positions
+
+
+def finish_snapshots(job: models.Job, offset, planner: snapshot_planner.SnapshotPlanner | None, state):
+    """
+    the merge step, run once every url of the job is read
+    """
+    feed = job.feed
+    if planner and not job.is_cancelled():
+        update_feed_urls(job, {offset + position: dict(state="skipped") for position in planner.skipped()})
+    if metadata := state["metadata"]:
+        feed.set_description(metadata["description"])
+        feed.set_title(metadata["title"])
+    feed.freshness = search_resume_time(job) or job.run_datetime
+    update_cdx_watermark(feed, job)
     feed.save()
     logger.info("====\n" * 5)
 
-    callback = collect_and_schedule_removal.si(job_id)
+    schedule_next_cdx_page(job)
+    chains = []
+    for post_ids in state["fulltext_posts"]:
+        posts = list(models.Post.objects.filter(id__in=post_ids))
+        full_text_chain = create_fulltexts_task_chain(job.id, posts)
+        full_text_chain.stamp(job_id=str(job.id))
+        chains.append(full_text_chain)
+    save_snapshot_state(job, offset, None)
+    callback = collect_and_schedule_removal.si(job.id)
     if chains:
-        return self.replace(celery.chord(chains, callback))
-    return self.replace(callback)
+        return celery.chord(chains, callback)
+    return callback
+
+
+@shared_task(bind=True)
+def retrieve_posts_from_snapshot(self: CeleryTask, url, job_id, index):
+    """
+    reads the posts of one feed url, `index` is its position in `extra_data.feed_urls`.
+
+    with `RETRY_MODE=countdown`, a transient error marks the url `retrying` and the task is retried with a countdown
+    """
+    job = models.Job.objects.get(pk=job_id)
+    feed = job.feed
+    result = dict(index=index)
+    if job.is_cancelled():
+        if job.extra_data["feed_urls"][index]["state"] == "retrying":
+            update_feed_urls(job, {index: dict(state="failed", error="job cancelled before retry")})
+        return result
+    update_feed_urls(job, {index: dict(state="processing")})
+    retry_kwargs = dict(retry=False) if uses_countdown_retries() else {}
+    attempt = self.request.retries or 0
+    error = None
+    parsed_feed = {}
+    searched_until = None
+    if feed.feed_type == models.FeedType.SEARCH_INDEX:
+        posts, searched_until = retrieve_posts_from_serper(feed, job, url)
+    else:
+        parsed_feed, posts, error = retrieve_posts_from_url(url, feed, job, **retry_kwargs)
+    if error and should_retry_later(error, attempt):
+        logger.warning(f"retrying `{url}` later: {error}")
+        update_feed_urls(job, {index: dict(state="retrying", error=str(error), attempts=attempt + 1)})
+        raise self.retry(countdown=retry_countdown(attempt), max_retries=settings.REQUEST_RETRY_COUNT)
+
+    feed_url_data = dict(state="completed")
+    if searched_until:
+        # the rest of the range is searched by the next job, see `search_resume_time`
+        feed_url_data.update(state="partial", searched_until=searched_until.isoformat())
+    if error:
+        logger.exception(error)
+        feed_url_data.update(state="failed", error=str(error))
+        if isinstance(error, exceptions.HostCircuitOpen):
+            feed_url_data.update(host_down=True)
+            record_hosts_down(job_id, {urlparse(url).hostname: 1})
+    coverage = not error and parsed_feed.get("coverage")
+    result.update(read=True, coverage=coverage and coverage.to_json() or None)
+    if parsed_feed:
+        result.update(title=parsed_feed["title"], description=parsed_feed["description"])
+    if not posts:
+        logger.warning("no new post in `%s`", url)
+    else:
+        feed_url_data["posts_added"] = len(posts)
+    if feed_posts := [post for post in posts if post.is_full_text]:
+        record_fulltexts_from_feed(job_id, feed_posts)
+        feed_url_data["full_text_from_feed"] = len(feed_posts)
+    update_feed_urls(job, {index: feed_url_data})
+    if post_ids := [str(post.id) for post in posts if not post.is_full_text]:
+        result.update(post_ids=post_ids)
+    return result
+
+
+@transaction.atomic
+def update_feed_urls(job: models.Job, changes: dict[int, dict]):
+    """
+    updates entries of `extra_data.feed_urls` by index, the snapshot tasks of a job update theirs at the same time
+    """
+    locked = models.Job.objects.select_for_update().get(pk=job.pk)
+    for index, change in changes.items():
+        locked.extra_data["feed_urls"][index].update(change)
+    locked.save(update_fields=["extra_data"])
+    job.extra_data = locked.extra_data
+
+
+def search_resume_time(job: models.Job) -> datetime | None:
+    """
+    where the next job of a search index feed has to start when a url of `job` was only partly searched
+    """
+    searched_until = [
+        datetime.fromisoformat(feed_url_data["searched_until"]).date()
+        for feed_url_data in job.extra_data.get("feed_urls", [])
+        if feed_url_data.get("searched_until")
+    ]
+    if not searched_until:
+        return None
+    return datetime.combine(min(searched_until) + timedelta(days=1), dt_time.min, UTC)
+
+
+def plan_snapshots(urls) -> snapshot_planner.SnapshotPlanner | None:
+    """
+    planner for the wayback captures at the start of `urls`
+    """
+    timestamps = []
+    for url in urls:
+        if not (match := snapshot_store.match_wayback_snapshot(url)):
+            break
+        timestamps.append(wayback_helpers.as_datetime(match.group(1)))
+    return timestamps and snapshot_planner.SnapshotPlanner(timestamps) or None
+
+
+def load_planner(urls, state) -> snapshot_planner.SnapshotPlanner | None:
+    """
+    planner with the coverages the earlier groups recorded, None when planning is off
+    """
+    planner = settings.PLAN_WAYBACK_SNAPSHOTS and plan_snapshots(urls)
+    if not planner:
+        return None
+    for position, coverage in state["coverages"].items():
+        if int(position) < len(planner.timestamps):
+            planner.record(int(position), snapshot_planner.Coverage.from_json(coverage))
+    return planner
+
+
+def update_cdx_watermark(feed: models.Feed, job: models.Job):
+    """
+    records the wayback captures processed by `job` on its feed.
+
+    the watermark only moves past captures that all completed (or were skipped by the planner), one that failed or is still retrying
+    keeps it back so the next job lists it again. captures processed after it are skipped by digest.
+
+    digests are only kept from `CDX_DIGEST_OVERLAP` before the watermark on, the CDX listing starts at the watermark anyway,
+    on the feed as well as in the job's `extra_data.cdx_digests`
+    """
+    cdx_digests = job.extra_data.get("cdx_digests")
+    if not cdx_digests:
+        return
+    seen_digests = dict(feed.cdx_digests)
+    watermark = feed.cdx_watermark
+    blocked = False
+    recorded = {}
+    for feed_url_data in job.extra_data.get("feed_urls", []):
+        digest = cdx_digests.get(feed_url_data["link"])
+        if not digest:
+            continue
+        if feed_url_data["state"] not in ("completed", "skipped"):
+            blocked = True
+            continue
+        timestamp = snapshot_store.match_wayback_snapshot(feed_url_data["link"]).group(1).ljust(14, "0")
+        seen_digests[digest] = wayback_helpers.later_timestamp(timestamp, seen_digests.get(digest))
+        recorded[feed_url_data["link"]] = timestamp
+        if not blocked:
+            watermark = wayback_helpers.later_timestamp(timestamp, watermark)
+    cutoff = cdx_digest_cutoff(watermark)
+    feed.cdx_watermark = watermark
+    feed.cdx_digests = {
+        digest: timestamp for digest, timestamp in sorted(seen_digests.items()) if timestamp >= cutoff
+    }
+    # failed or retrying captures stay, they keep holding the watermark back for the later pages of the job
+    if forgotten := [link for link, timestamp in recorded.items() if timestamp < cutoff]:
+        forget_cdx_digests(job, forgotten)
+
+
+def cdx_digest_cutoff(watermark: str | None) -> str:
+    """
+    timestamp of the oldest capture whose digest is still worth keeping
+    """
+    if not watermark:
+        return ""
+    return (wayback_helpers.as_datetime(watermark) - CDX_DIGEST_OVERLAP).strftime("%Y%m%d%H%M%S")
+
+
+@transaction.atomic
+def forget_cdx_digests(job: models.Job, links):
+    """
+    drops captures the feed no longer needs from `extra_data.cdx_digests`
+    """
+    locked = models.Job.objects.select_for_update().get(pk=job.pk)
+    cdx_digests = locked.extra_data.get("cdx_digests", {})
+    for link in links:
+        cdx_digests.pop(link, None)
+    locked.save(update_fields=["extra_data"])
+    job.extra_data = locked.extra_data
 
 
 def create_fulltexts_task_chain(job_id, posts):
-    chain_tasks = []
+    ftjob_pks = []
     for post in posts:
         ftjob_entry = models.FulltextJob.objects.create(
             job_id=job_id,
             post_id=post.id,
             link=post.link,
         )
-        task = retrieve_full_text.si(ftjob_entry.pk)
-        task.stamp(job_id=str(job_id))
-        chain_tasks.append(task)
+        ftjob_pks.append(ftjob_entry.pk)
+
+    if settings.FULLTEXT_ENGINE == "chain":
+        chain_tasks = []
+        for ftjob_pk in ftjob_pks:
+            task = retrieve_full_text.si(ftjob_pk).set(**fulltext_queue())
+            task.stamp(job_id=str(job_id))
+            chain_tasks.append(task)
+        return celery.chain(chain_tasks)
 
-    return celery.chain(chain_tasks)
+    return celery.chain([fulltexts_task(job_id, ftjob_pks)])
+
+
+def record_fulltexts_from_feed(job_id, posts: list[models.Post]):
+    """
+    posts whose full text came with the feed need no fetch, they are recorded as retrieved straight away
+    """
+    models.FulltextJob.objects.bulk_create(
+        [
+            models.FulltextJob(
+                job_id=job_id,
+                post_id=post.id,
+                link=post.link,
+                status=models.FullTextState.RETRIEVED,
+            )
+            for post in posts
+        ]
+    )
+
+
+def uses_feed_content(db_feed: models.Feed, post_dict: h4f.PostDict) -> bool:
+    if not post_dict.is_full_text:
+        return False
+    match db_feed.feed_content_policy:
+        case models.FeedContentPolicy.ALWAYS:
+            return bool(post_dict.description and post_dict.description.strip())
+        case models.FeedContentPolicy.AUTO:
+            return h4f.looks_complete(post_dict.description)
+    return False
+
+
+def fulltext_queue() -> dict:
+    """
+    fulltext tasks go to `FULLTEXT_QUEUE` when it is set, its worker does not use the prefork pool and can extract
+    in `EXTRACTION_PROCESSES` processes, see `extraction.summarize`
+    """
+    return dict(queue=settings.FULLTEXT_QUEUE) if settings.FULLTEXT_QUEUE else {}
+
+
+def fulltexts_task(job_id, ftjob_pks, attempt=0):
+    # worst case, every post is on the same host
+    rounds = -(-len(ftjob_pks) // min(settings.FULLTEXT_CONCURRENCY, settings.FULLTEXT_PER_HOST_CONCURRENCY))
+    soft_time_limit = settings.FULLTEXT_FETCH_TIMEOUT_SECONDS * (rounds + 1)
+    args = (job_id, ftjob_pks, attempt) if attempt else (job_id, ftjob_pks)
+    task = retrieve_full_texts.si(*args).set(
+        soft_time_limit=soft_time_limit, time_limit=soft_time_limit + 20, **fulltext_queue()
+    )
+    task.stamp(job_id=str(job_id))
+    return task
 
 
 def retrieve_posts_from_serper(feed: models.Feed, job: models.Job, url: str):
+    """
+    posts found for `url`, and the last day searched when the search stopped before `job.run_datetime`
+    """
     start_time = job.earliest_item_requested
     if not start_time.tzinfo:
         start_time = start_time.replace(tzinfo=UTC)
-    crawled_posts = fetch_posts_links_with_serper(
-        url, from_time=start_time, to_time=job.run_datetime
-    )
+    credits = SerperCredits.from_json(job.extra_data.get("serper_credits"), settings.SERPER_CREDIT_BUDGET)
+    try:
+        crawled_posts = fetch_posts_links_with_serper(
+            url, from_time=start_time, to_time=job.run_datetime, credits=credits, deadline=Deadline(SERPER_SEARCH_SECONDS)
+        )
+    finally:
+        job.extra_data["serper_credits"] = credits.to_json()
+        save_extra_data(job, "serper_credits")
     posts = []
     for post_dict in crawled_posts.values():
         if post := add_post_to_db(feed, job, post_dict):
             posts.append(post)
-    return posts
+    return posts, credits.searched_until
 
 
 class JobCancelled(Exception):
@@ -235,6 +689,9 @@ class JobCancelled(Exception):
 @shared_task(bind=True)
 def collect_and_schedule_removal(sender, job_id):
     logger.print(f"===> {sender=}, {job_id=} ")
+    if not finish_segment(job_id):
+        # other pages of the wayback listing are still being read
+        return
     job = models.Job.objects.get(pk=job_id)
     remove_lock(job)
     if job.state == models.JobState.RUNNING:
@@ -248,39 +705,99 @@ def remove_lock(job):
         logger.debug("Failed to remove lock")
 
 
-def retrieve_posts_from_url(url, db_feed: models.Feed, job: models.Job):
+def is_conditional_fetch(url, db_feed: models.Feed, job: models.Job):
+    """
+    live feed polls that only look at the feed url can be skipped when the feed has not changed since the last poll
+    """
+    return (
+        url == db_feed.url
+        and job.extra_data.get("use_feed_url_only", False)
+        and not job.extra_data.get("force_full_fetch", False)
+    )
+
+
+def fetch_feed_page(url, **kwargs):
+    """
+    fetches a feed, reading wayback snapshots from the snapshot store when possible
+    """
+    store = snapshot_store.is_wayback_snapshot(url) and snapshot_store.get_store()
+    if store and (data := store.get(url)) is not None:
+        logger.info(f"using archived snapshot for `{url}`")
+        return data, None, url
+    data, content_type, final_url = h4f.fetch_page_with_retries(url, **kwargs)
+    if store:
+        try:
+            if store.put(url, h4f.as_bytes(data)):
+                train_snapshot_dict.delay(url)
+        except (OSError, zstandard.ZstdError) as e:
+            logger.warning(f"could not archive snapshot `{url}`: {e}")
+    return data, content_type, final_url
+
+
+@shared_task
+def train_snapshot_dict(url):
+    """
+    trains the snapshot store dictionary of the feed of `url`, away from the task that fetched it
+    """
+    if store := snapshot_store.get_store():
+        store.train_dict(url)
+
+
+def retrieve_posts_from_url(url, db_feed: models.Feed, job: models.Job, retry=True):
+    """
+    `retry=False` makes a single attempt, leaving retries to the caller
+    """
     back_off_seconds = settings.WAYBACK_SLEEP_SECONDS
     all_posts: list[models.Post] = []
     parsed_feed = {}
-    for i in range(settings.REQUEST_RETRY_COUNT):
+    is_live_feed = url == db_feed.url
+    conditional = is_conditional_fetch(url, db_feed, job)
+    attempts = settings.REQUEST_RETRY_COUNT if retry else 1
+    for i in range(attempts):
         error = None
         if i != 0:
             time.sleep(back_off_seconds)
         try:
             if job.is_cancelled():
                 raise JobCancelled("job was terminated by user")
-            data, content_type, url = h4f.fetch_page_with_retries(url)
-            parsed_feed = h4f.parse_feed_from_content(data, url)
-            match parsed_feed["feed_type"]:
-                case models.FeedType.ATOM:
-                    posts = h4f.parse_posts_from_atom_feed(url, data)
-                case models.FeedType.RSS:
-                    posts = h4f.parse_posts_from_rss_feed(url, data)
-                case _:
-                    raise exceptions.UnknownFeedtypeException(
-                        "unknown feed type `{}` at {}".format(
-                            parsed_feed["feed_type"], url
-                        )
+            fetch_kwargs = {} if retry else dict(retry_count=0)
+            if is_live_feed:
+                validators = h4f.CacheValidators()
+                if conditional:
+                    validators = h4f.CacheValidators(db_feed.etag, db_feed.last_modified)
+                fetch_kwargs.update(validators=validators)
+            data, content_type, url = fetch_feed_page(url, **fetch_kwargs)
+            content_hash = hashlib.sha256(h4f.as_bytes(data)).hexdigest()
+            if conditional and content_hash == db_feed.content_hash:
+                raise exceptions.NotModified(f"`{url}` content unchanged since last fetch")
+            parsed = h4f.parse_feed(data, url)
+            parsed_feed = parsed.metadata
+            if parsed_feed["feed_type"] not in [models.FeedType.ATOM, models.FeedType.RSS]:
+                raise exceptions.UnknownFeedtypeException(
+                    "unknown feed type `{}` at {}".format(
+                        parsed_feed["feed_type"], url
                     )
-            for post_dict in posts.values():
+                )
+            pubdates = []
+            for post_dict in parsed.posts:
+                pubdates.append(post_dict.pubdate)
                 # make sure that post and feed share the same domain
                 post = add_post_to_db(db_feed, job, post_dict)
                 if not post:
                     continue
                 all_posts.append(post)
-            db_feed.save()
+            parsed_feed["coverage"] = snapshot_planner.Coverage.from_pubdates(pubdates)
+            if is_live_feed:
+                db_feed.etag = validators.etag
+                db_feed.last_modified = validators.last_modified
+                db_feed.content_hash = content_hash
+                # other urls of the job are read at the same time, only the fields read here are written
+                db_feed.save(update_fields=["etag", "last_modified", "content_hash"])
             logger.info(f"saved {len(all_posts)} posts for {url}")
             break
+        except exceptions.NotModified as e:
+            logger.info(f"{e}, nothing to do")
+            break
         except ConnectionError as e:
             logger.error(e, exc_info=True)
             error = e
@@ -306,6 +823,7 @@ def add_post_to_db(db_feed: models.Feed, job: models.Job, post_dict: h4f.PostDic
         return None
     categories = post_dict.categories
     del post_dict.categories
+    post_dict.is_full_text = uses_feed_content(db_feed, post_dict)
     try:
         post, created = models.Post.objects.get_or_create(
             defaults=post_dict.__dict__, feed=db_feed, link=post_dict.link
@@ -331,19 +849,25 @@ def add_post_to_db(db_feed: models.Feed, job: models.Job, post_dict: h4f.PostDic
 
 
 @shared_task(
+    bind=True,
     soft_time_limit=settings.FULLTEXT_FETCH_TIMEOUT_SECONDS,
     time_limit=settings.FULLTEXT_FETCH_TIMEOUT_SECONDS + 20,
 )
-def retrieve_full_text(ftjob_pk):
+def retrieve_full_text(self: CeleryTask, ftjob_pk):
     fulltext_job = models.FulltextJob.objects.get(pk=ftjob_pk)
     use_scrapfly_asp = fulltext_job.job.extra_data["use_scrapfly_asp"]
+    retry_kwargs = dict(retry_count=0) if uses_countdown_retries() else {}
+    attempt = self.request.retries or 0
     try:
         if fulltext_job.is_cancelled():
             raise JobCancelled()
         else:
             fulltext_job.post.description, fulltext_job.post.content_type = (
                 h4f.get_full_text(
-                    fulltext_job.post.link, use_scrapfly_asp=use_scrapfly_asp
+                    fulltext_job.post.link,
+                    use_scrapfly_asp=use_scrapfly_asp,
+                    deadline=Deadline.for_task(settings.FULLTEXT_FETCH_TIMEOUT_SECONDS),
+                    **retry_kwargs,
                 )
             )
             fulltext_job.status = models.FullTextState.RETRIEVED
@@ -352,17 +876,166 @@ def retrieve_full_text(ftjob_pk):
     except JobCancelled:
         fulltext_job.status = models.FullTextState.CANCELLED
         fulltext_job.error_str = "job cancelled while retrieving fulltext"
-    except (SoftTimeLimitExceeded, TimeLimitExceeded) as e:
+    except exceptions.HostCircuitOpen as e:
+        fulltext_job.error_str = truncate_error(str(e))
+        fulltext_job.status = models.FullTextState.FAILED
+        record_hosts_down(fulltext_job.job_id, {urlparse(fulltext_job.link).hostname: 1})
+    except (SoftTimeLimitExceeded, TimeLimitExceeded, exceptions.DeadlineExceeded) as e:
         fulltext_job.status = models.FullTextState.TIMED_OUT
-        fulltext_job.error_str = f"task timed out: {str(e)}"
+        fulltext_job.error_str = truncate_error(f"task timed out: {str(e)}")
         logger.warning(f"Task retrieve_full_text for ftjob {ftjob_pk} timed out")
     except BaseException as e:
-        fulltext_job.error_str = str(e)
+        if should_retry_later(e, attempt):
+            countdown = retry_countdown(attempt)
+            fulltext_job.status = models.FullTextState.RETRIEVING
+            fulltext_job.error_str = truncate_error(f"retrying in {countdown}s: {e}")
+            fulltext_job.save(update_fields=["status", "error_str"])
+            raise self.retry(countdown=countdown, max_retries=settings.REQUEST_RETRY_COUNT)
+        fulltext_job.error_str = truncate_error(str(e))
         fulltext_job.status = models.FullTextState.FAILED
     fulltext_job.save()
     fulltext_job.post.save()
 
 
+@shared_task(bind=True)
+def retrieve_full_texts(self: CeleryTask, job_id, ftjob_pks, attempt=0):
+    """
+    retrieves the full text of many posts at once with `fulltext_engine`, writing results back in batches.
+
+    with `RETRY_MODE=countdown`, posts that fail with a transient error stay `retrieving`
+    and are retried by a later run of this task (with `attempt` + 1)
+    """
+    job = models.Job.objects.get(pk=job_id)
+    pending: dict[int, models.FulltextJob] = models.FulltextJob.objects.select_related("post").in_bulk(ftjob_pks)
+    retry_kwargs = dict(retry_count=0) if uses_countdown_retries() else {}
+
+    def get_full_text(link):
+        # each post gets its own deadline, starting when its fetch starts
+        return h4f.get_full_text(
+            link,
+            use_scrapfly_asp=job.extra_data["use_scrapfly_asp"],
+            deadline=Deadline.for_task(settings.FULLTEXT_FETCH_TIMEOUT_SECONDS),
+            **retry_kwargs,
+        )
+
+    engine = fulltext_engine.FulltextEngine(
+        get_full_text,
+        concurrency=settings.FULLTEXT_CONCURRENCY,
+        per_host_concurrency=settings.FULLTEXT_PER_HOST_CONCURRENCY,
+        timeout=settings.FULLTEXT_FETCH_TIMEOUT_SECONDS,
+    )
+    if job.is_cancelled():
+        engine.cancel()
+    batch: list[models.FulltextJob] = []
+    hosts_down = Counter()
+    retry_pks = []
+    try:
+        for result in engine.run([(pk, ft.link) for pk, ft in pending.items()]):
+            fulltext_job = pending.pop(result.ftjob_pk)
+            apply_fulltext_result(fulltext_job, result)
+            if result.exception and should_retry_later(result.exception, attempt):
+                fulltext_job.status = models.FullTextState.RETRIEVING
+                fulltext_job.error_str = truncate_error(f"retrying in {retry_countdown(attempt)}s: {result.error_str}")
+                retry_pks.append(fulltext_job.pk)
+            batch.append(fulltext_job)
+            if result.host_down:
+                hosts_down[urlparse(fulltext_job.link).hostname] += 1
+            if len(batch) >= settings.FULLTEXT_BATCH_SIZE:
+                save_fulltext_jobs(batch)
+                batch = []
+                job.refresh_from_db(fields=["state"])
+                if job.is_cancelled():
+                    engine.cancel()
+    except (SoftTimeLimitExceeded, TimeLimitExceeded) as e:
+        engine.cancel()
+        logger.warning(f"Task retrieve_full_texts for job {job_id} timed out")
+        for fulltext_job in pending.values():
+            fulltext_job.status = models.FullTextState.TIMED_OUT
+            fulltext_job.error_str = truncate_error(f"task timed out: {str(e)}")
+            batch.append(fulltext_job)
+    finally:
+        engine.cancel()
+        save_fulltext_jobs(batch)
+        if hosts_down:
+            record_hosts_down(job_id, hosts_down)
+
+    if retry_pks:
+        task = fulltexts_task(job_id, retry_pks, attempt + 1).set(countdown=retry_countdown(attempt))
+        return self.replace(task)
+
+
+def add_hosts_down(extra_data: dict, hosts: dict[str, int]):
+    """
+    counts, per host, the fetches skipped because the host's circuit breaker was open,
+    so a job can tell "host down" failures apart from per-post failures
+    """
+    hosts_down = extra_data.setdefault("hosts_down", {})
+    for host, count in hosts.items():
+        hosts_down[host] = hosts_down.get(host, 0) + count
+
+
+@transaction.atomic
+def record_hosts_down(job_id, hosts: dict[str, int]):
+    job = models.Job.objects.select_for_update().get(pk=job_id)
+    add_hosts_down(job.extra_data, hosts)
+    job.save(update_fields=["extra_data"])
+
+
+def apply_fulltext_result(fulltext_job: models.FulltextJob, result: fulltext_engine.FulltextResult):
+    fulltext_job.status = result.status
+    fulltext_job.error_str = truncate_error(result.error_str)
+    if result.status == models.FullTextState.RETRIEVED and fulltext_job.post:
+        fulltext_job.post.description = result.description
+        fulltext_job.post.content_type = result.content_type
+        fulltext_job.post.is_full_text = True
+
+
+def truncate_error(error_str: str) -> str:
+    """
+    `error_str` cut to what `FulltextJob.error_str` can hold
+    """
+    max_length = models.FulltextJob._meta.get_field("error_str").max_length
+    if not error_str or len(error_str) <= max_length:
+        return error_str
+    return error_str[: max_length - 3] + "..."
+
+
+def save_fulltext_jobs(fulltext_jobs: list[models.FulltextJob]):
+    """
+    writes a batch of results at once, or one by one when that fails so that a bad row only fails itself
+    """
+    if not fulltext_jobs:
+        return
+    try:
+        write_fulltext_jobs(fulltext_jobs)
+        return
+    except DatabaseError as e:
+        logger.warning(f"could not save {len(fulltext_jobs)} fulltext jobs at once, saving them one by one: {e}")
+    for fulltext_job in fulltext_jobs:
+        try:
+            write_fulltext_jobs([fulltext_job])
+        except DatabaseError as e:
+            logger.error(f"could not save fulltext job {fulltext_job.pk}: {e}")
+            models.FulltextJob.objects.filter(pk=fulltext_job.pk).update(
+                status=models.FullTextState.FAILED,
+                error_str=truncate_error(f"could not save result: {e}"),
+            )
+
+
+@transaction.atomic
+def write_fulltext_jobs(fulltext_jobs: list[models.FulltextJob]):
+    models.FulltextJob.objects.bulk_update(fulltext_jobs, ["status", "error_str"])
+    now = datetime.now(UTC)
+    posts = []
+    for fulltext_job in fulltext_jobs:
+        if fulltext_job.post and fulltext_job.status == models.FullTextState.RETRIEVED:
+            fulltext_job.post.datetime_updated = now
+            posts.append(fulltext_job.post)
+    models.Post.objects.bulk_update(
+        posts, ["description", "content_type", "is_full_text", "datetime_updated"]
+    )
+
+
 from celery import signals
 
 
@@ -376,6 +1049,11 @@ def mark_old_jobs_as_failed(**kwargs):
     )
 
 
+@signals.worker_process_shutdown.connect
+def close_http_sessions(**kwargs):
+    http_client.close_sessions()
+
+
 @shared_task
 def error_handler(request, exc: Exception, traceback, job_id):
     job = models.Job.objects.get(pk=job_id)
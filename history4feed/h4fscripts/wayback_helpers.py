@@ -1,27 +1,80 @@
 import json
 import time
-from datetime import datetime as dt, UTC
+from dataclasses import dataclass
+from datetime import datetime as dt, UTC, timedelta
 from collections import namedtuple
+from typing import Iterator
 from urllib.parse import urlencode
 from .h4f import FatalError, fetch_page_with_retries
+from . import cdx_cache, snapshot_store
+from .deadline import Deadline
+from .exceptions import DeadlineExceeded
 from history4feed.app.settings import history4feed_server_settings as settings
 from celery.exceptions import SoftTimeLimitExceeded
 
 DEFAULT_USER_AGENT = "curl"
 
 
-CDXSearchResult = namedtuple("CDXSearchResult", ["urlkey", "timestamp", "original_url", "mimetype", "statuscode", "digest", "length"])
+CDXSearchResult = namedtuple("CDXSearchResult", ["urlkey", "timestamp", "original_url", "mimetype", "statuscode", "digest", "length"], defaults=(None,) * 7)
+# only the columns used are requested, CDX column name -> CDXSearchResult field
+CDX_FIELDS = {
+    "urlkey": "urlkey",
+    "timestamp": "timestamp",
+    "original": "original_url",
+    "digest": "digest",
+}
 
-def cdx_search(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, user_agent="curl") -> list[CDXSearchResult]:
+
+@dataclass
+class CDXPage:
+    results: list[CDXSearchResult]
+    # passed back to the CDX server to get the next page, None once the listing is complete
+    resume_key: str | None = None
+
+
+def cdx_search(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, user_agent="curl", deadline: Deadline=None, since: str=None) -> list[CDXSearchResult]:
+    """
+    `since` is a CDX timestamp (up to 14 digits), captures before it are not listed even if they are after `earliest`
+    """
+    out = {}
+    resume_key = None
+    while True:
+        page = cdx_search_page(url, earliest, latest, retry_count=retry_count, sleep_seconds=sleep_seconds, deadline=deadline, since=since, resume_key=resume_key)
+        for result in page.results:
+            out.setdefault(result.digest, result)
+        if not (resume_key := page.resume_key):
+            return list(out.values())
+
+
+def cdx_search_page(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, deadline: Deadline=None, since: str=None, resume_key: str=None, limit: int=None) -> CDXPage:
+    """
+    one page of at most `limit` (`CDX_PAGE_SIZE`) captures, continuing from `resume_key`
+    """
+    try:
+        return fetch_cdx_page(url, earliest, latest, retry_count, sleep_seconds, deadline, since, resume_key, limit)
+    except FatalError:
+        return CDXPage([])
+
+
+def fetch_cdx_page(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=settings.WAYBACK_SLEEP_SECONDS, deadline: Deadline=None, since: str=None, resume_key: str=None, limit: int=None) -> CDXPage:
+    """
+    same as `cdx_search_page`, but a `FatalError` is raised instead of returning an empty page
+    """
     latest = latest or dt.now(UTC)
-    query = urlencode([
-        ("from", as_wayback_date(earliest)),
+    params = [
+        ("from", later_timestamp(as_wayback_date(earliest), since)),
         ("to", as_wayback_date(latest)),
         ("url", url),
         ("filter", "statuscode:200"),
         ("output", "json"),
         ("collapse", "digest"),
-    ])
+        ("fl", ",".join(CDX_FIELDS)),
+        ("limit", limit or settings.CDX_PAGE_SIZE),
+        ("showResumeKey", "true"),
+    ]
+    if resume_key:
+        params.append(("resumeKey", resume_key))
+    query = urlencode(params)
 
     headers = {}
 
@@ -29,15 +82,19 @@ def cdx_search(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=
 
     for i in range(retry_count+1):
         if i > 0:
-            time.sleep(sleep_seconds * 1.5**(i-1))
+            backoff_time = sleep_seconds * 1.5**(i-1)
+            if deadline and not deadline.allows(backoff_time):
+                raise DeadlineExceeded(f"not enough time left to retry the CDX search for `{url}`, last error: {error}") from error
+            time.sleep(backoff_time)
         try:
-            res, content_type, _ = fetch_page_with_retries(f"http://web.archive.org/cdx/search/cdx?{query}", headers=headers)
-            res_json = json.loads(res)
+            # this loop already retries with backoff, don't retry again in the fetch
+            res, content_type, _ = fetch_page_with_retries(f"{settings.WAYBACK_URL}/cdx/search/cdx?{query}", retry_count=0, headers=headers, deadline=deadline)
+            page = parse_cdx_page(res)
             error = None
             break
         except FatalError:
-            return []
-        except SoftTimeLimitExceeded as e:
+            raise
+        except (SoftTimeLimitExceeded, DeadlineExceeded) as e:
             error = e
             break
         except BaseException as e:
@@ -45,25 +102,178 @@ def cdx_search(url, earliest: dt, latest: dt=None, retry_count=3, sleep_seconds=
             continue
     if error:
         raise error
-    out = {}
-    for v in res_json[1:]:
+    return page
+
+
+def iter_cdx_rows(body: bytes) -> Iterator[list]:
+    """
+    the CDX server writes one row per line, rows are decoded one at a time instead of loading the whole document
+    """
+    for line in body.splitlines():
+        line = line.strip().rstrip(b",")
+        if line in (b"", b"[", b"]"):
+            continue
+        if line.startswith(b"[["):
+            line = line[1:]
+        if line.endswith(b"]]"):
+            line = line[:-1]
+        yield json.loads(line)
+
+
+def parse_cdx_page(body) -> CDXPage:
+    if isinstance(body, str):
+        body = body.encode()
+    rows = iter_cdx_rows(body)
+    header = next(rows, None)
+    if not header:
+        return CDXPage([])
+    fields = [CDX_FIELDS.get(column, column) for column in header]
+    page = CDXPage([])
+    for row in rows:
+        if not row:
+            # an empty row separates the captures from the resume key
+            page.resume_key = next(rows, [None])[0]
+            break
         try:
-            v[6] = int(v[6])
-            v[4] = int(v[4])
-            v = CDXSearchResult(*v)
-            out[v.digest] = v
-        except:
+            page.results.append(CDXSearchResult(**dict(zip(fields, row))))
+        except TypeError:
             pass
-    return list(out.values())
-        
+    return page
+
+
 def as_wayback_date(date: dt) -> str:
     return date.strftime('%Y%m%d')
 
-def get_wayback_urls(url, from_date, to_date=None):
-    to_date = to_date or dt.now(UTC)
-    urls = []
-    results = cdx_search(url, from_date, to_date)
-    for result in results:
-        urls.append(f"https://web.archive.org/web/{result.timestamp}id_/{result.original_url}")
-    urls.append(url)
-    return urls
\ No newline at end of file
+def as_datetime(timestamp: str) -> dt:
+    return dt.strptime(timestamp.ljust(14, "0"), "%Y%m%d%H%M%S").replace(tzinfo=UTC)
+
+def later_timestamp(a: str, b: str=None) -> str:
+    """
+    CDX timestamps can be truncated, `20240101` is the same time as `20240101000000`
+    """
+    if not b:
+        return a
+    return max(a, b, key=lambda timestamp: timestamp.ljust(14, "0"))
+
+def get_snapshot_url(result: CDXSearchResult) -> str:
+    return f"{settings.WAYBACK_URL}/web/{result.timestamp}id_/{result.original_url}"
+
+def iter_wayback_snapshots(url, from_date, to_date=None, retry_count=3, deadline: Deadline=None, since: str=None, seen_digests=(), resume_key: str=None) -> Iterator[CDXPage]:
+    """
+    captures of `url` one CDX page at a time, in time order, leaving out digests in `seen_digests` or on earlier pages.
+
+    the `resume_key` of each page can be stored to continue the listing later
+    """
+    seen_digests = set(seen_digests)
+    store = snapshot_store.get_store()
+    for page in iter_cdx_pages(url, from_date, to_date or dt.now(UTC), retry_count=retry_count, deadline=deadline, since=since, resume_key=resume_key):
+        results = []
+        for result in sorted(page.results, key=lambda result: result.timestamp):
+            if result.digest in seen_digests:
+                continue
+            seen_digests.add(result.digest)
+            if store:
+                store.link(get_snapshot_url(result), result.digest)
+            results.append(result)
+        yield CDXPage(results, page.resume_key)
+
+
+def iter_cdx_pages(url, earliest: dt, latest: dt, retry_count=3, deadline: Deadline=None, since: str=None, resume_key: str=None) -> Iterator[CDXPage]:
+    """
+    pages of the CDX listing of `url`, built from the CDX cache when there is one
+    """
+    cache = cdx_cache.get_cache()
+    if cache and not (resume_key and not cdx_cache.is_cache_resume_key(resume_key)):
+        yield from iter_cached_cdx_pages(cache, url, earliest, latest, retry_count=retry_count, deadline=deadline, since=since, resume_key=resume_key)
+        return
+    # also continues the listings started before the cache was turned on
+    while True:
+        page = cdx_search_page(url, earliest, latest, retry_count=retry_count, deadline=deadline, since=since, resume_key=resume_key)
+        yield page
+        if not (resume_key := page.resume_key):
+            return
+
+
+def iter_cached_cdx_pages(cache: cdx_cache.CDXCache, url, earliest: dt, latest: dt, retry_count=3, deadline: Deadline=None, since: str=None, resume_key: str=None) -> Iterator[CDXPage]:
+    """
+    the listing is split in date buckets shared by every url with the same urlkey. cached buckets are read from redis
+    and the CDX server is only asked for the missing ones, in runs of consecutive buckets.
+
+    pages end on a change of timestamp, their resume key is the last timestamp listed
+    """
+    start = later_timestamp(as_wayback_date(earliest), since).ljust(14, "0")
+    after = resume_key and resume_key[len(cdx_cache.RESUME_PREFIX):]
+    end = as_wayback_date(latest).ljust(14, "9")
+    now = dt.now(UTC)
+    urlkey = cdx_cache.cdx_urlkey(url)
+    buckets = cdx_cache.Bucket.between(as_datetime(later_timestamp(start, after)), min(as_datetime(end[:8]), now))
+    cached = cache.get_many(urlkey, buckets)
+
+    def in_range(result: CDXSearchResult):
+        timestamp = result.timestamp.ljust(14, "0")
+        return start <= timestamp <= end and not (after and timestamp <= after)
+
+    def listed():
+        i = 0
+        while i < len(buckets):
+            if cached[i] is not None:
+                yield from (CDXSearchResult(*row) for row in cached[i])
+                i += 1
+                continue
+            run = [buckets[i]]
+            while i + len(run) < len(buckets) and cached[i + len(run)] is None:
+                run.append(buckets[i + len(run)])
+            yield from fetch_cdx_buckets(cache, urlkey, url, run, now, retry_count=retry_count, deadline=deadline)
+            i += len(run)
+
+    page_size = settings.CDX_PAGE_SIZE
+    results = []
+    for result in filter(in_range, listed()):
+        if len(results) >= page_size and result.timestamp != results[-1].timestamp:
+            yield CDXPage(results, cdx_cache.RESUME_PREFIX + results[-1].timestamp.ljust(14, "0"))
+            results = []
+        results.append(result)
+    yield CDXPage(results)
+
+
+def fetch_cdx_buckets(cache: cdx_cache.CDXCache, urlkey, url, run: list[cdx_cache.Bucket], now: dt, retry_count=3, deadline: Deadline=None) -> Iterator[CDXSearchResult]:
+    """
+    captures of the consecutive buckets `run`, from the CDX server. each bucket is cached as soon as all its captures are listed
+    """
+    rows: dict[cdx_cache.Bucket, list] = {bucket: [] for bucket in run}
+    cached = 0
+    resume_key = None
+    latest = min(run[-1].end - timedelta(days=1), now)
+    while True:
+        try:
+            page = fetch_cdx_page(url, run[0].start, latest, retry_count=retry_count, deadline=deadline, resume_key=resume_key)
+        except FatalError:
+            # nothing is cached, the next listing asks again
+            return
+        results = sorted(page.results, key=lambda result: result.timestamp)
+        for result in results:
+            for bucket in run[cached:]:
+                if bucket.holds(result.timestamp):
+                    rows[bucket].append(list(result))
+                    break
+        # captures are listed in time order, the buckets before the last capture listed are complete
+        complete = len(run)
+        if page.resume_key:
+            complete = next((i for i, bucket in enumerate(run) if results and bucket.holds(results[-1].timestamp)), cached)
+        for bucket in run[cached:complete]:
+            cache.put(urlkey, bucket, rows.pop(bucket), now)
+        cached = max(cached, complete)
+        yield from results
+        if not (resume_key := page.resume_key):
+            return
+
+def get_wayback_snapshots(url, from_date, to_date=None, retry_count=3, deadline: Deadline=None, since: str=None, seen_digests=()) -> list[CDXSearchResult]:
+    """
+    captures of `url` in time order, leaving out the ones whose digest is in `seen_digests`
+    """
+    pages = iter_wayback_snapshots(url, from_date, to_date, retry_count=retry_count, deadline=deadline, since=since, seen_digests=seen_digests)
+    return [result for page in pages for result in page.results]
+
+def get_wayback_urls(url, from_date, to_date=None, retry_count=3, deadline: Deadline=None, since: str=None, seen_digests=()):
+    results = get_wayback_snapshots(url, from_date, to_date, retry_count=retry_count, deadline=deadline, since=since, seen_digests=seen_digests)
+    return [get_snapshot_url(result) for result in results] + [url]
@@ -1,6 +1,11 @@
+import copy
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from xml.dom.minidom import Document, Element
 
+from lxml import etree
+
 
 def createTextElement(document: Document, tagName, text):
     el = document.createElement(tagName)
@@ -65,4 +70,255 @@ def getAtomLink(node: Element, rel='self'):
         if r and r.value == rel:
             link = l
             break
-    return link.attributes['href'].value
\ No newline at end of file
+    return link.attributes['href'].value
+
+# lxml equivalents of the minidom helpers above, matching elements by their qualified name (`prefix:local`)
+# as written in the document, the same way minidom's `tagName` does
+
+
+def qualifiedName(el: etree._Element) -> str:
+    tag = el.tag
+    if not isinstance(tag, str):
+        # comments and processing instructions
+        return ""
+    local = tag.rpartition("}")[2]
+    return f"{el.prefix}:{local}" if el.prefix else local
+
+def getElementText(el: etree._Element):
+    if el is None:
+        return ''
+    rc = [el.text or '']
+    for child in el:
+        rc.append(child.tail or '')
+    return ''.join(rc)
+
+XHTML_NAMESPACE = "http://www.w3.org/1999/xhtml"
+
+def getInnerMarkup(el: etree._Element):
+    """
+    the children of `el` serialized as markup, with xhtml elements written without their namespace
+    """
+    el = copy.deepcopy(el)
+    for child in el.iter():
+        if isinstance(child.tag, str) and child.tag.startswith(f"{{{XHTML_NAMESPACE}}}"):
+            child.tag = child.tag.rpartition("}")[2]
+    etree.cleanup_namespaces(el)
+    rc = [el.text or '']
+    for child in el:
+        rc.append(etree.tostring(child, encoding="unicode", with_tail=True))
+    return ''.join(rc)
+
+
+# canonical prefixes of the namespaces feeds commonly use, elements in them are found whatever prefix a feed binds
+NAMESPACE_PREFIXES = {
+    "http://purl.org/dc/elements/1.1/": "dc",
+    "http://purl.org/dc/terms/": "dcterms",
+    "http://www.w3.org/2005/Atom": "atom",
+    "http://purl.org/rss/1.0/modules/content/": "content",
+}
+
+
+class ItemView(ABC):
+    """
+    the direct children of a feed item indexed by name in a single pass, so that every field lookup is a dict lookup.
+
+    children are indexed under their qualified name as written (`dc:creator`) and, when they are in one of the
+    `NAMESPACE_PREFIXES` namespaces, under its canonical prefix too (`<creator xmlns="http://purl.org/dc/elements/1.1/">`
+    is found as `dc:creator`)
+    """
+
+    def __init__(self, element):
+        self.element = element
+        self.children = []
+        self.index: dict[str, list] = {}
+        for child in self.iter_children(element):
+            self.children.append(child)
+            qualified, namespace, local = self.names(child)
+            self.index.setdefault(qualified, []).append(child)
+            prefix = NAMESPACE_PREFIXES.get(namespace)
+            if prefix and f"{prefix}:{local}" != qualified:
+                self.index.setdefault(f"{prefix}:{local}", []).append(child)
+
+    def __contains__(self, tag):
+        return tag in self.index
+
+    def first(self, tag):
+        children = self.index.get(tag)
+        return children[0] if children else None
+
+    def all(self, tag) -> list:
+        return self.index.get(tag, [])
+
+    def text(self, tag) -> str:
+        child = self.first(tag)
+        return '' if child is None else self.element_text(child)
+
+    def xhtml(self, element) -> str:
+        """
+        markup of atom `type="xhtml"` content, which is wrapped in a single xhtml `div`
+        """
+        div = next(iter(self.iter_children(element)), None)
+        if div is None or self.names(div)[2] != "div":
+            div = element
+        return self.inner_markup(div)
+
+    def view(self, element) -> "ItemView":
+        return type(self)(element)
+
+    def atom_link(self, rel='self'):
+        links = [child for child in self.children if self.names(child)[0] in ['link', 'atom:link']]
+
+        link = links[0]
+        for l in links:
+            if self.attribute(l, 'rel') == rel:
+                link = l
+                break
+        return self.attribute(link, 'href')
+
+    # implemented by each engine
+
+    @staticmethod
+    @abstractmethod
+    def iter_children(element):
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def names(element) -> tuple[str, str | None, str]:
+        """
+        qualified name, namespace uri and local name of a child
+        """
+
+    @staticmethod
+    @abstractmethod
+    def element_text(element) -> str:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def inner_markup(element) -> str:
+        ...
+
+    @staticmethod
+    @abstractmethod
+    def attribute(element, name) -> str:
+        ...
+
+
+class MinidomItemView(ItemView):
+    @staticmethod
+    def iter_children(element: Element):
+        return (child for child in element.childNodes if child.nodeType == child.ELEMENT_NODE)
+
+    @staticmethod
+    def names(element: Element):
+        return element.tagName, element.namespaceURI, element.localName
+
+    @staticmethod
+    def element_text(element: Element):
+        return getText(element)
+
+    @staticmethod
+    def inner_markup(element: Element):
+        return ''.join(child.toxml() for child in element.childNodes)
+
+    @staticmethod
+    def attribute(element: Element, name):
+        return element.getAttribute(name)
+
+
+class LxmlItemView(ItemView):
+    @staticmethod
+    def iter_children(element: etree._Element):
+        return (child for child in element if isinstance(child.tag, str))
+
+    @staticmethod
+    def names(element: etree._Element):
+        namespace, _, local = element.tag.rpartition("}")
+        return qualifiedName(element), namespace[1:] or None, local
+
+    @staticmethod
+    def element_text(element: etree._Element):
+        return getElementText(element)
+
+    @staticmethod
+    def inner_markup(element: etree._Element):
+        return getInnerMarkup(element)
+
+    @staticmethod
+    def attribute(element: etree._Element, name):
+        return element.get(name) or ''
+
+
+@dataclass(frozen=True)
+class FeedLayout:
+    container: str
+    item: str
+    # metadata element -> metadata key
+    metadata: dict[str, str]
+
+
+FEED_LAYOUTS = {
+    "rss": FeedLayout("channel", "item", {"title": "title", "description": "description"}),
+    "feed": FeedLayout("feed", "entry", {"title": "title", "subtitle": "description"}),
+}
+
+
+def iterparseFeed(source):
+    """
+    reads an RSS or ATOM document in a single pass, yielding
+
+    ("root", name)              when the first `rss` or `feed` element starts
+    ("metadata", key, text)     for the first title and description that are direct children of the channel (or feed)
+    ("item", element)           for every item (or entry) inside the first channel, as soon as its end tag is parsed
+
+    each item is freed once the consumer moves on, so memory use does not grow with the number of items in the document.
+    feeds are untrusted, entities are not expanded and libxml2 keeps its limits on document size and depth
+    """
+    context = etree.iterparse(
+        source,
+        events=("start", "end"),
+        resolve_entities=False,
+        no_network=True,
+    )
+    depth = 0
+    layout: FeedLayout = None
+    container_depth = None
+    open_items = 0
+    wanted_metadata = {}
+    metadata_elements = {}
+    for event, el in context:
+        name = qualifiedName(el)
+        if event == "start":
+            depth += 1
+            if layout is None and name in FEED_LAYOUTS:
+                layout = FEED_LAYOUTS[name]
+                wanted_metadata = dict(layout.metadata)
+                yield ("root", name)
+            if layout and container_depth is None and name == layout.container:
+                container_depth = depth
+            elif container_depth is not None:
+                if name == layout.item:
+                    open_items += 1
+                if depth == container_depth + 1 and name in wanted_metadata:
+                    metadata_elements[el] = wanted_metadata.pop(name)
+            continue
+
+        if container_depth is None:
+            pass
+        elif container_depth == depth:
+            # only the first container is read
+            return
+        else:
+            if el in metadata_elements:
+                yield ("metadata", metadata_elements.pop(el), getElementText(el))
+            if name == layout.item:
+                open_items -= 1
+                yield ("item", el)
+                if not open_items:
+                    # nested items are freed along with the item they are in
+                    el.clear(keep_tail=True)
+                    parent = el.getparent()
+                    while parent is not None and el.getprevious() is not None:
+                        del parent[0]
+        depth -= 1
@@ -200,4 +200,16 @@ HISTORY4FEED_SETTINGS = {
     'WAYBACK_SLEEP_SECONDS': int(os.getenv("WAYBACK_SLEEP_SECONDS", 20)),
     'EARLIEST_SEARCH_DATE': datetime.strptime(os.environ.get("EARLIEST_SEARCH_DATE", "2024-01-01T00:00:00Z"), "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=UTC),
     'REQUEST_RETRY_COUNT': int(os.getenv("REQUEST_RETRY_COUNT", 3)),
+    'FULLTEXT_CONCURRENCY': int(os.getenv("FULLTEXT_CONCURRENCY", 16)),
+    'FULLTEXT_PER_HOST_CONCURRENCY': int(os.getenv("FULLTEXT_PER_HOST_CONCURRENCY", 4)),
+    'EXTRACTION_PROCESSES': int(os.getenv("EXTRACTION_PROCESSES") or os.cpu_count()),
+    'FULLTEXT_QUEUE': os.getenv("FULLTEXT_QUEUE") or None,
+    'SNAPSHOT_GROUP_SIZE': int(os.getenv("SNAPSHOT_GROUP_SIZE", 20)),
+    'SERPER_CREDIT_BUDGET': int(os.getenv("SERPER_CREDIT_BUDGET") or 1000),
+    'SNAPSHOT_STORE_DIR': os.getenv("SNAPSHOT_STORE_DIR"),
+    'SNAPSHOT_STORE_MAX_BYTES': int(os.getenv("SNAPSHOT_STORE_MAX_BYTES", 5 * 1024 * 1024 * 1024)),
+    'SCRAPFLY_ROUTING': os.getenv("SCRAPFLY_ROUTING") or "adaptive",
+    'WAYBACK_URL': os.getenv("WAYBACK_URL") or "https://web.archive.org",
+    'SCRAPFLY_URL': os.getenv("SCRAPFLY_URL") or "https://api.scrapfly.io/scrape",
+    'RETRY_MODE': os.getenv("RETRY_MODE") or "sleep",
 }
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Offline benchmarks for the feed parsers in `history4feed.h4fscripts.h4f`.
+
+Every document of the corpus is parsed (metadata and all posts) by each parser engine in a fresh process,
+reporting items/second and the peak memory the parse added to the process.
+
+    python -m tests.benchmarks.parser_benchmark                                # report only
+    python -m tests.benchmarks.parser_benchmark --save baseline.json           # record a baseline
+    python -m tests.benchmarks.parser_benchmark --compare baseline.json        # exit 1 on regressions
+
+Baselines are machine specific, record them on the machine they are compared on.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+ENGINES = ["lxml", "minidom"]
+SIZES = [10, 1_000, 50_000]
+# allowed slowdown / memory growth before a result counts as a regression
+DEFAULT_THRESHOLD = 0.2
+# memory growth below this is noise, whatever the ratio
+MEMORY_SLACK_MIB = 2
+BASE_URL = "https://example.blog/feed/"
+
+
+@dataclass
+class Result:
+    case: str
+    engine: str
+    items: int
+    seconds: float
+    items_per_second: float
+    peak_mib: float
+
+    @property
+    def key(self):
+        return f"{self.case}/{self.engine}"
+
+
+def setup_django():
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure(HISTORY4FEED_SETTINGS={})
+
+
+def load_h4f():
+    """
+    the parser module, imported once django settings are configured
+    """
+    setup_django()
+    from history4feed.h4fscripts import h4f
+
+    return h4f
+
+
+def generate_rss(items: int) -> bytes:
+    start = datetime(2024, 9, 1, 8, tzinfo=UTC)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:atom="http://www.w3.org/2005/Atom">'
+        "<channel><title>Generated RSS</title><description>benchmark feed</description>"
+        f"<link>{BASE_URL}</link>"
+    ]
+    for i in range(items):
+        published = (start - timedelta(hours=i)).strftime("%a, %d %b %Y %H:%M:%S +0000")
+        body = escape(f"<p>Post {i} body with <a href='https://example.com/{i}'>a link</a>.</p>" * 8)
+        parts.append(
+            f"<item><title>Post {i}</title><link>{BASE_URL}posts/{i}.html</link>"
+            f"<guid>{BASE_URL}posts/{i}.html</guid><pubDate>{published}</pubDate>"
+            f"<dc:creator>Author {i % 7}</dc:creator>"
+            f"<category>cat-{i % 5}</category><category>cat-{i % 3}</category>"
+            f"<description>{body}</description></item>"
+        )
+    parts.append("</channel></rss>")
+    return "".join(parts).encode()
+
+
+def generate_atom(items: int) -> bytes:
+    start = datetime(2024, 9, 1, 8, tzinfo=UTC)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom">'
+        "<title>Generated ATOM</title><subtitle>benchmark feed</subtitle>"
+        f'<link rel="self" href="{BASE_URL}"/><updated>{start.isoformat()}</updated>'
+    ]
+    for i in range(items):
+        published = (start - timedelta(hours=i)).isoformat()
+        body = f"<p>Post {i} body with <a href='https://example.com/{i}'>a link</a>.</p>" * 8
+        parts.append(
+            f'<entry><title>Post {i}</title><link rel="alternate" href="{BASE_URL}posts/{i}.html"/>'
+            f"<id>{BASE_URL}posts/{i}.html</id><published>{published}</published><updated>{published}</updated>"
+            f"<author><name>Author {i % 7}</name></author>"
+            f'<category term="cat-{i % 5}"/><category term="cat-{i % 3}"/>'
+            f'<summary>Post {i}</summary><content type="html"><![CDATA[{body}]]></content></entry>'
+        )
+    parts.append("</feed>")
+    return "".join(parts).encode()
+
+
+def build_corpus(sizes=SIZES) -> dict[str, bytes]:
+    from tests.src.test_h4f_scripts.rss_data import atom_example, rss_example
+
+    corpus = {
+        "fixture-rss": rss_example.encode(),
+        "fixture-atom": atom_example.encode(),
+    }
+    for size in sizes:
+        corpus[f"rss-{size}"] = generate_rss(size)
+        corpus[f"atom-{size}"] = generate_atom(size)
+    return corpus
+
+
+def parse(engine, data: bytes) -> int:
+    h4f = load_h4f()
+    if engine == "lxml":
+        reader = h4f.FeedReader(data, BASE_URL)
+        reader.read_metadata()
+        posts = reader
+    else:
+        posts = h4f.parse_feed_minidom(data, BASE_URL).posts
+    return sum(1 for _ in posts)
+
+
+def max_rss_mib() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB everywhere else
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_case(case, engine, path, repeat) -> Result:
+    """
+    runs in a fresh process, so that the peak memory of a parse is not hidden by earlier ones
+    """
+    # imported before measuring, so that only the parse is counted
+    load_h4f()
+
+    data = Path(path).read_bytes()
+    gc.collect()
+    before = max_rss_mib()
+    items = parse(engine, data)
+    peak = max_rss_mib() - before
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(engine, data)
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+    return Result(case, engine, items, seconds, items / seconds if seconds else 0, peak)
+
+
+def run(sizes=SIZES, engines=ENGINES, repeat=3) -> list[Result]:
+    corpus = build_corpus(sizes)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for case, data in corpus.items():
+            path = Path(tmpdir) / f"{case}.xml"
+            path.write_bytes(data)
+            # larger documents are timed fewer times
+            case_repeat = max(1, repeat if len(data) < 10 * 1024 * 1024 else 1)
+            for engine in engines:
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(run_case, (case, engine, str(path), case_repeat)))
+    return results
+
+
+def compare(results: list[Result], baseline: dict, threshold=DEFAULT_THRESHOLD) -> list[str]:
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if not previous:
+            continue
+        min_speed = previous["items_per_second"] * (1 - threshold)
+        if result.items_per_second < min_speed:
+            regressions.append(
+                f"{result.key}: {result.items_per_second:,.0f} items/s, baseline {previous['items_per_second']:,.0f} items/s"
+            )
+        max_memory = max(previous["peak_mib"] * (1 + threshold), previous["peak_mib"] + MEMORY_SLACK_MIB)
+        if result.peak_mib > max_memory:
+            regressions.append(
+                f"{result.key}: {result.peak_mib:.1f} MiB peak, baseline {previous['peak_mib']:.1f} MiB"
+            )
+    return regressions
+
+
+def report(results: list[Result]) -> str:
+    lines = [f"{'case':<16} {'engine':<8} {'items':>7} {'seconds':>9} {'items/s':>12} {'peak MiB':>9}"]
+    for r in results:
+        lines.append(
+            f"{r.case:<16} {r.engine:<8} {r.items:>7} {r.seconds:>9.4f} {r.items_per_second:>12,.0f} {r.peak_mib:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="number of items of the generated feeds")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES)
+    parser.add_argument("--repeat", type=int, default=3, help="the best of this many runs is reported")
+    parser.add_argument("--save", type=Path, help="write the results to this baseline file")
+    parser.add_argument("--compare", type=Path, help="fail when results regress from this baseline file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed regression, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.engines, args.repeat)
+    print(report(results))
+    if args.save:
+        args.save.write_text(json.dumps({r.key: asdict(r) for r in results}, indent=2))
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            print("\n".join(regressions))
+            return 1
+        print(f"\nno regressions over {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
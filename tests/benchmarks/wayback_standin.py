@@ -0,0 +1,473 @@
+"""
+Offline stand-in for the Wayback Machine, its CDX server and the Scrapfly scrape API.
+
+It serves CDX listings, `id_` snapshots, live feeds, article pages and Scrapfly-shaped responses
+from a synthetic corpus (feeds with a post every few hours, captured regularly) or a recorded one,
+with configurable latency, error rate and throttling. Point history4feed at it to run jobs end to end offline:
+
+    python -m tests.benchmarks.wayback_standin --port 8800 --feeds 3 --captures 2000 --latency 0.2 --error-rate 0.02
+
+    WAYBACK_URL=http://127.0.0.1:8800
+    SCRAPFLY_URL=http://127.0.0.1:8800/scrape   # with SCRAPFLY_APIKEY set to anything
+
+A recorded corpus is a directory with a `manifest.json`:
+
+    {
+        "captures": [{"url": "https://example.com/feed.xml", "timestamp": "20240101000000", "file": "captures/1.xml"}],
+        "pages": [{"url": "https://example.com/post", "file": "pages/post.html", "content_type": "text/html"}]
+    }
+
+Request counts per route and status are served at `/_stats`.
+"""
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+CDX_COLUMNS = ["urlkey", "timestamp", "original", "mimetype", "statuscode", "digest", "length"]
+SNAPSHOT_PATH_RE = re.compile(r"^/web/(\d+)id_/(.+)$")
+WORDS = "feed post archive capture reader history blog article wayback snapshot index text".split()
+
+
+@dataclass
+class Page:
+    body: bytes
+    content_type: str
+
+
+@dataclass
+class Capture:
+    timestamp: str
+    digest: str
+
+
+def as_timestamp(date: datetime) -> str:
+    return date.strftime("%Y%m%d%H%M%S")
+
+
+def pad_timestamp(timestamp: str, fill="0") -> str:
+    return timestamp.ljust(14, fill)
+
+
+def content_digest(data: bytes) -> str:
+    # same shape as the `digest` column of the CDX server
+    return base64.b32encode(hashlib.sha1(data).digest()).decode()
+
+
+def surt(url: str) -> str:
+    parsed = urlparse(url)
+    host = ",".join(reversed((parsed.hostname or "").split(".")))
+    if parsed.port:
+        host += f":{parsed.port}"
+    return f"{host}){parsed.path or '/'}"
+
+
+class SyntheticCorpus:
+    """
+    `feeds` feeds on the stand-in itself, each publishing `posts_per_day` posts over `days` days
+    and captured `captures` times at regular intervals. every capture shows the latest `items` posts
+    """
+
+    def __init__(
+        self,
+        base_url,
+        feeds=1,
+        captures=500,
+        days=365,
+        posts_per_day=2.0,
+        items=10,
+        article_bytes=8_000,
+        feed_type="rss",
+        start=datetime(2024, 1, 1, tzinfo=UTC),
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.feeds = feeds
+        self.captures_per_feed = captures
+        self.days = days
+        self.posts_per_day = posts_per_day
+        self.items = items
+        self.article_bytes = article_bytes
+        self.feed_type = feed_type
+        self.start = start
+        self.total_posts = int(days * posts_per_day)
+
+    def feed_url(self, feed: int) -> str:
+        return f"{self.base_url}/feeds/{feed}.xml"
+
+    def post_url(self, feed: int, post: int) -> str:
+        return f"{self.base_url}/posts/{feed}/{post}.html"
+
+    def feed_of(self, url) -> int | None:
+        match = re.fullmatch(re.escape(self.base_url) + r"/feeds/(\d+)\.xml", url)
+        if match and int(match.group(1)) < self.feeds:
+            return int(match.group(1))
+        return None
+
+    def pubdate(self, post: int) -> datetime:
+        return self.start + timedelta(days=post / self.posts_per_day)
+
+    def newest_post(self, date: datetime) -> int:
+        """
+        index of the latest post published by `date`, -1 before the first one
+        """
+        elapsed = (date - self.start).total_seconds() / 86400
+        return min(int(elapsed * self.posts_per_day + 1e-9), self.total_posts - 1) if elapsed >= 0 else -1
+
+    def capture_time(self, capture: int) -> datetime:
+        return self.start + timedelta(days=self.days * capture / self.captures_per_feed)
+
+    def captures(self, url) -> list[Capture]:
+        feed = self.feed_of(url)
+        if feed is None:
+            return []
+        captures = []
+        for capture in range(self.captures_per_feed):
+            date = self.capture_time(capture)
+            # captures showing the same posts have the same digest, like the real CDX server
+            digest = content_digest(f"{feed}:{self.newest_post(date)}".encode())
+            captures.append(Capture(as_timestamp(date), digest))
+        return captures
+
+    def snapshot(self, url, timestamp) -> Page | None:
+        feed = self.feed_of(url)
+        if feed is None:
+            return None
+        date = datetime.strptime(pad_timestamp(timestamp), "%Y%m%d%H%M%S").replace(tzinfo=UTC)
+        return self.render_feed(feed, self.newest_post(date))
+
+    def page(self, url) -> Page | None:
+        if (feed := self.feed_of(url)) is not None:
+            return self.render_feed(feed, self.total_posts - 1)
+        match = re.fullmatch(re.escape(self.base_url) + r"/posts/(\d+)/(\d+)\.html", url)
+        if match and int(match.group(1)) < self.feeds and int(match.group(2)) < self.total_posts:
+            return self.render_article(int(match.group(1)), int(match.group(2)))
+        return None
+
+    @lru_cache(maxsize=4096)
+    def render_feed(self, feed: int, newest: int) -> Page:
+        posts = range(newest, max(newest - self.items, -1), -1)
+        if self.feed_type == "atom":
+            parts = [
+                '<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">'
+                f"<title>Stand-in feed {feed}</title><subtitle>synthetic feed</subtitle>"
+                f'<link rel="self" href="{self.feed_url(feed)}"/>'
+            ]
+            for post in posts:
+                published = self.pubdate(post).isoformat()
+                parts.append(
+                    f'<entry><title>Post {post}</title><link rel="alternate" href="{self.post_url(feed, post)}"/>'
+                    f"<id>{self.post_url(feed, post)}</id><published>{published}</published><updated>{published}</updated>"
+                    f"<author><name>Author {post % 5}</name></author><summary>Post {post} […]</summary></entry>"
+                )
+            parts.append("</feed>")
+            return Page("".join(parts).encode(), "application/atom+xml")
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+            f"<title>Stand-in feed {feed}</title><description>synthetic feed</description>"
+            f"<link>{self.feed_url(feed)}</link>"
+        ]
+        for post in posts:
+            published = self.pubdate(post).strftime("%a, %d %b %Y %H:%M:%S +0000")
+            parts.append(
+                f"<item><title>Post {post}</title><link>{self.post_url(feed, post)}</link>"
+                f"<guid>{self.post_url(feed, post)}</guid><pubDate>{published}</pubDate>"
+                f"<category>cat-{post % 4}</category><description>{escape(f'Post {post} […]')}</description></item>"
+            )
+        parts.append("</channel></rss>")
+        return Page("".join(parts).encode(), "application/rss+xml")
+
+    def render_article(self, feed: int, post: int) -> Page:
+        words = random.Random(f"{feed}:{post}")
+        paragraphs = []
+        size = 0
+        while size < self.article_bytes:
+            paragraph = " ".join(words.choice(WORDS) for _ in range(60)).capitalize() + "."
+            paragraphs.append(f"<p>{paragraph}</p>")
+            size += len(paragraph) + 7
+        body = (
+            f"<html><head><title>Post {post}</title></head><body><nav>home | about</nav>"
+            f"<article><h1>Post {post}</h1>{''.join(paragraphs)}</article><footer>stand-in</footer></body></html>"
+        )
+        return Page(body.encode(), "text/html; charset=utf-8")
+
+
+class RecordedCorpus:
+    """
+    captures and pages read from a directory with a `manifest.json`, see the module docstring
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        manifest = json.loads((self.root / "manifest.json").read_text())
+        self.captures_by_url: dict[str, list[tuple[Capture, dict]]] = {}
+        for entry in sorted(manifest.get("captures", []), key=lambda entry: entry["timestamp"]):
+            body = (self.root / entry["file"]).read_bytes()
+            capture = Capture(pad_timestamp(entry["timestamp"]), content_digest(body))
+            self.captures_by_url.setdefault(entry["url"], []).append((capture, entry))
+        self.pages = {entry["url"]: entry for entry in manifest.get("pages", [])}
+
+    def read(self, entry, default_type) -> Page:
+        return Page((self.root / entry["file"]).read_bytes(), entry.get("content_type", default_type))
+
+    def captures(self, url) -> list[Capture]:
+        return [capture for capture, _ in self.captures_by_url.get(url, [])]
+
+    def snapshot(self, url, timestamp) -> Page | None:
+        # like the wayback machine, the closest capture at or before `timestamp`
+        found = None
+        for capture, entry in self.captures_by_url.get(url, []):
+            if capture.timestamp > pad_timestamp(timestamp, "9"):
+                break
+            found = entry
+        return found and self.read(found, "application/xml")
+
+    def page(self, url) -> Page | None:
+        entry = self.pages.get(url)
+        return entry and self.read(entry, "text/html")
+
+
+@dataclass
+class Faults:
+    latency: float = 0  # seconds added to every response
+    jitter: float = 0  # latency varies by up to this many seconds either way
+    error_rate: float = 0  # share of requests answered with a 503 (a 502 error from the scrape API)
+    rate: float = 0  # requests per second served before answering 429, 0 disables throttling
+    burst: int = 10
+    seed: int = None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, make_corpus: Callable[[str], object], faults: Faults = None, host="127.0.0.1", port=0, url=None):
+        super().__init__((host, port), StandinHandler)
+        # the url history4feed reaches the stand-in at, links in the synthetic corpus point to it
+        self.url = (url or f"http://{host}:{self.server_address[1]}").rstrip("/")
+        self.corpus = make_corpus(self.url)
+        self.faults = faults or Faults()
+        self.random = random.Random(self.faults.seed)
+        self.bucket = self.faults.rate and TokenBucket(self.faults.rate, self.faults.burst)
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    def count(self, route, status):
+        with self.stats_lock:
+            self.stats[f"{route} {status}"] += 1
+
+    def delay(self):
+        faults = self.faults
+        if faults.latency or faults.jitter:
+            time.sleep(max(faults.latency + self.random.uniform(-faults.jitter, faults.jitter), 0))
+
+    def fault(self) -> int | None:
+        """
+        status of the failure to answer with, if any
+        """
+        if self.bucket and not self.bucket.take():
+            return 429
+        if self.faults.error_rate and self.random.random() < self.faults.error_rate:
+            return 503
+        return None
+
+    def lookup(self, url) -> Page | None:
+        match = SNAPSHOT_PATH_RE.match(url[len(self.url):]) if url.startswith(self.url) else None
+        if match:
+            return self.corpus.snapshot(match.group(2), match.group(1))
+        return self.corpus.page(url)
+
+    def cdx(self, query: dict[str, str]) -> Page:
+        url = query.get("url", "")
+        start = pad_timestamp(query.get("from", ""), "0")
+        end = pad_timestamp(query.get("to", ""), "9")
+        rows = []
+        for capture in self.corpus.captures(url):
+            if not (start <= capture.timestamp <= end):
+                continue
+            if query.get("collapse") == "digest" and rows and rows[-1]["digest"] == capture.digest:
+                continue
+            rows.append(
+                dict(
+                    urlkey=surt(url),
+                    timestamp=capture.timestamp,
+                    original=url,
+                    mimetype="application/xml",
+                    statuscode="200",
+                    digest=capture.digest,
+                    length="1000",
+                )
+            )
+        if resume_key := query.get("resumeKey"):
+            rows = [row for row in rows if f"{row['urlkey']}+{row['timestamp']}" >= resume_key]
+        limit = int(query.get("limit") or len(rows) or 1)
+        page, rest = rows[:limit], rows[limit:]
+        fields = query.get("fl", "").split(",") if query.get("fl") else CDX_COLUMNS
+        lines = [json.dumps(fields)] + [json.dumps([row[field] for field in fields]) for row in page]
+        if rest and query.get("showResumeKey") == "true":
+            lines += ["[]", json.dumps([f"{rest[0]['urlkey']}+{rest[0]['timestamp']}"])]
+        return Page(("[" + ",\n".join(lines) + "]\n").encode(), "application/json")
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server: StandinServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, route, status, body: bytes, content_type, headers=None):
+        self.server.count(route, status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        if parsed.path == "/_stats":
+            return self.send("stats", 200, json.dumps(self.server.stats).encode(), "application/json")
+        route = "scrape" if parsed.path == "/scrape" else "cdx" if parsed.path == "/cdx/search/cdx" else "web"
+        self.server.delay()
+        if route == "scrape":
+            return self.scrape(query)
+        if status := self.server.fault():
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            return self.send(route, status, b"stand-in fault", "text/plain", headers)
+        if route == "cdx":
+            page = self.server.cdx(query)
+            return self.send(route, 200, page.body, page.content_type)
+        page = self.server.lookup(self.server.url + self.path)
+        if not page:
+            return self.send(route, 404, b"not found", "text/plain")
+        self.send(route, 200, page.body, page.content_type)
+
+    def scrape(self, query):
+        """
+        answers like the scrapfly scrape API, faults of the stand-in are scrapfly errors
+        """
+        status = self.server.fault()
+        if status == 429:
+            error = dict(code="ERR::THROTTLE::MAX_REQUEST_RATE_EXCEEDED", message="stand-in throttled the request")
+            return self.send("scrape", 429, json.dumps(error).encode(), "application/json")
+        if status:
+            error = dict(code="ERR::SCRAPE::UPSTREAM_TIMEOUT", message="stand-in failed the request")
+            return self.send("scrape", 502, json.dumps(error).encode(), "application/json")
+        url = query.get("url", "")
+        page = self.server.lookup(url)
+        result = dict(
+            url=url,
+            status_code=200 if page else 404,
+            status="OK" if page else "NOT_FOUND",
+            content=page.body.decode("utf-8", errors="replace") if page else "",
+            content_type=page.content_type if page else "text/plain",
+            response_headers={},
+            format="text",
+        )
+        body = json.dumps(dict(result=result, config=dict(url=url, asp=query.get("asp") == "true")))
+        self.send("scrape", 200, body.encode(), "application/json")
+
+
+@contextlib.contextmanager
+def serve(make_corpus: Callable[[str], object], faults: Faults = None, host="127.0.0.1", port=0):
+    """
+    runs a stand-in in a background thread for as long as the context is open
+    """
+    server = StandinServer(make_corpus, faults, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--url", help="url history4feed reaches the stand-in at, when it is not http://HOST:PORT (e.g. in docker)")
+    parser.add_argument("--corpus", type=Path, help="recorded corpus directory, a synthetic corpus is served otherwise")
+    parser.add_argument("--feeds", type=int, default=1, help="synthetic feeds served")
+    parser.add_argument("--captures", type=int, default=500, help="captures of each synthetic feed")
+    parser.add_argument("--days", type=int, default=365, help="days covered by each synthetic feed")
+    parser.add_argument("--posts-per-day", type=float, default=2.0)
+    parser.add_argument("--items", type=int, default=10, help="posts shown by each capture of a synthetic feed")
+    parser.add_argument("--article-bytes", type=int, default=8_000)
+    parser.add_argument("--feed-type", choices=["rss", "atom"], default="rss")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="latency varies by up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failing, 0.05 = 5%%")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second before answering 429, 0 = no limit")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    def make_corpus(base_url):
+        if args.corpus:
+            return RecordedCorpus(args.corpus)
+        return SyntheticCorpus(
+            base_url,
+            feeds=args.feeds,
+            captures=args.captures,
+            days=args.days,
+            posts_per_day=args.posts_per_day,
+            items=args.items,
+            article_bytes=args.article_bytes,
+            feed_type=args.feed_type,
+        )
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.rate, args.burst, args.seed)
+    server = StandinServer(make_corpus, faults, args.host, args.port, args.url)
+    print(f"WAYBACK_URL={server.url}\nSCRAPFLY_URL={server.url}/scrape")
+    if isinstance(server.corpus, SyntheticCorpus):
+        print("feeds:\n" + "\n".join(server.corpus.feed_url(feed) for feed in range(args.feeds)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
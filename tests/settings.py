@@ -6,4 +6,4 @@ CACHES = {
     }
 }
 
-HISTORY4FEED_SETTINGS.update(SCRAPFLY_APIKEY='')
\ No newline at end of file
+HISTORY4FEED_SETTINGS.update(SCRAPFLY_APIKEY='', EXTRACTION_PROCESSES=0)
\ No newline at end of file
@@ -0,0 +1,114 @@
+from datetime import UTC, datetime
+
+import pytest
+
+from history4feed.h4fscripts import cdx_cache, wayback_helpers
+from history4feed.h4fscripts.cdx_cache import Bucket, CDXCache, cdx_urlkey
+from tests.benchmarks.wayback_standin import serve
+
+from .test_wayback_standin import corpus, standin_settings
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.ttls[key] = ex
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CDXCache(FakeRedis())
+    monkeypatch.setattr(cdx_cache, "get_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def standin(settings):
+    with serve(corpus) as server:
+        settings.HISTORY4FEED_SETTINGS = standin_settings(server, CDX_PAGE_SIZE=7, CDX_CACHE_BUCKET_DAYS=7)
+        yield server
+
+
+def list_snapshots(url, earliest=datetime(2024, 1, 1, tzinfo=UTC), latest=datetime(2024, 2, 1, tzinfo=UTC), **kwargs):
+    pages = list(wayback_helpers.iter_wayback_snapshots(url, earliest, latest, retry_count=0, **kwargs))
+    return pages, [snapshot for page in pages for snapshot in page.results]
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        ("https://www.Example.com/Feed?b=1&a=2", "com,example)/feed?a=2&b=1"),
+        ("http://example.com", "com,example)/"),
+        ("http://blog.example.com:8080/rss/", "com,example,blog:8080)/rss/"),
+        ("https://example.com:443/rss", "com,example)/rss"),
+    ],
+)
+def test_cdx_urlkey(url, expected):
+    assert cdx_urlkey(url) == expected
+
+
+def test_buckets(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(CDX_CACHE_BUCKET_DAYS=7)
+    buckets = Bucket.between(datetime(2024, 1, 1, tzinfo=UTC), datetime(2024, 1, 20, tzinfo=UTC))
+    assert all(earlier.end == later.start for earlier, later in zip(buckets, buckets[1:]))
+    assert buckets[0].holds("20240101") and buckets[-1].holds("20240120235959")
+    assert len(buckets) == 3
+    assert buckets[0].is_closed(datetime(2024, 2, 1, tzinfo=UTC))
+    assert not buckets[-1].is_closed(buckets[-1].end)
+
+
+def test_no_cache_without_redis(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(CDX_CACHE_BUCKET_DAYS=7)
+    assert cdx_cache.get_cache() is None, "tests run without redis"
+
+
+def test_cached_listing(standin, cache):
+    feed_url = standin.corpus.feed_url(0)
+    pages, snapshots = list_snapshots(feed_url)
+    assert len(snapshots) == 20
+    assert all(page.resume_key.startswith(cdx_cache.RESUME_PREFIX) for page in pages[:-1])
+    assert pages[-1].resume_key is None
+    assert standin.stats["cdx 200"] == 3, "all the buckets are listed together, 20 captures in pages of 7"
+    _, again = list_snapshots(feed_url)
+    assert again == snapshots
+    assert standin.stats["cdx 200"] == 3, "second listing only reads the cache"
+    assert all(ttl == cdx_cache.settings.CDX_CACHE_SECONDS for ttl in cache.redis.ttls.values()), "all buckets are closed"
+
+
+def test_cache_shared_between_urls(standin, cache):
+    feed_url = standin.corpus.feed_url(0)
+    _, snapshots = list_snapshots(feed_url)
+    calls = standin.stats["cdx 200"]
+    variant = feed_url.replace("://", "://www.", 1)
+    assert cdx_urlkey(variant) == cdx_urlkey(feed_url)
+    _, again = list_snapshots(variant)
+    assert again == snapshots
+    assert standin.stats["cdx 200"] == calls
+
+
+def test_open_bucket_refreshed(standin, cache, monkeypatch):
+    feed_url = standin.corpus.feed_url(0)
+    list_snapshots(feed_url)
+    calls = standin.stats["cdx 200"]
+    urlkey = cdx_urlkey(feed_url)
+    open_bucket = Bucket.containing(datetime(2024, 1, 20, tzinfo=UTC))
+    # as if the last bucket had expired from the cache
+    del cache.redis.values[cache.key(urlkey, open_bucket)]
+    _, snapshots = list_snapshots(feed_url)
+    assert len(snapshots) == 20
+    assert standin.stats["cdx 200"] == calls + 1, "only the missing bucket is listed again"
+
+
+def test_resume_from_cache(standin, cache):
+    feed_url = standin.corpus.feed_url(0)
+    pages, snapshots = list_snapshots(feed_url)
+    resumed, rest = list_snapshots(feed_url, resume_key=pages[0].resume_key)
+    assert rest == snapshots[len(pages[0].results):]
+    assert len(resumed) == len(pages) - 1
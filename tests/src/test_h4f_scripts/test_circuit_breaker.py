@@ -0,0 +1,123 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import redis
+from history4feed.h4fscripts import circuit_breaker
+from history4feed.h4fscripts.circuit_breaker import HostCircuitBreaker, LocalStore
+from history4feed.h4fscripts.exceptions import HostCircuitOpen
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(
+        CIRCUIT_BREAKER_FAILURE_THRESHOLD=3,
+        CIRCUIT_BREAKER_COOLDOWN_SECONDS=60,
+        HTTP_READ_TIMEOUT_SECONDS=10,
+    )
+
+
+@pytest.fixture
+def clock():
+    now = [0]
+    with patch("history4feed.h4fscripts.circuit_breaker.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+def test_opens_after_threshold(clock):
+    breaker = HostCircuitBreaker()
+    for _ in range(2):
+        breaker.record_failure("example.com")
+        breaker.check("example.com")
+    breaker.record_failure("example.com")
+    with pytest.raises(HostCircuitOpen):
+        breaker.check("example.com")
+    breaker.check("example.net")
+
+
+def test_success_resets_failures(clock):
+    breaker = HostCircuitBreaker()
+    breaker.record_failure("example.com")
+    breaker.record_failure("example.com")
+    breaker.record_success("example.com")
+    breaker.record_failure("example.com")
+    breaker.check("example.com")
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = HostCircuitBreaker()
+    for _ in range(3):
+        breaker.record_failure("example.com")
+    clock[0] = 61
+    breaker.check("example.com")
+    with pytest.raises(HostCircuitOpen, match="probe"):
+        breaker.check("example.com")
+
+    # failed probe opens the circuit again
+    breaker.record_failure("example.com")
+    with pytest.raises(HostCircuitOpen):
+        breaker.check("example.com")
+
+    # successful probe closes it
+    clock[0] = 122
+    breaker.check("example.com")
+    breaker.record_success("example.com")
+    breaker.check("example.com")
+    breaker.check("example.com")
+
+
+def test_released_probe(clock):
+    breaker = HostCircuitBreaker()
+    for _ in range(3):
+        breaker.record_failure("example.com")
+    clock[0] = 61
+    breaker.check("example.com", claim_probe=False)
+    breaker.check("example.com", claim_probe=False)
+    breaker.check("example.com")
+    with pytest.raises(HostCircuitOpen, match="probe"):
+        breaker.check("example.com", claim_probe=False)
+    breaker.release("example.com")
+    # the next request probes
+    breaker.check("example.com")
+
+
+def test_local_store_expires(clock):
+    store = LocalStore()
+    store.set("key", 1, ex=10)
+    assert store.set("key", 2, ex=10, nx=True) is None
+    assert store.incr("counter", ex=5) == 1
+    assert store.incr("counter", ex=5) == 2
+    clock[0] = 11
+    assert store.get("key") is None
+    assert store.get("counter") is None
+
+
+def test_uses_redis():
+    client = MagicMock()
+    client.get.return_value = None
+    client.pipeline.return_value.execute.return_value = [3, True]
+    breaker = HostCircuitBreaker(client)
+    breaker.record_failure("example.com")
+    client.pipeline.return_value.incr.assert_called_once_with("h4f-circuit:example.com:failures")
+    client.set.assert_called_once_with("h4f-circuit:example.com:open", 1, ex=60, nx=False)
+    breaker.check("example.net")
+    client.get.assert_any_call("h4f-circuit:example.net:open")
+
+
+def test_falls_back_to_local_state(clock):
+    client = MagicMock()
+    client.get.side_effect = redis.ConnectionError("down")
+    client.pipeline.side_effect = redis.ConnectionError("down")
+    client.set.side_effect = redis.ConnectionError("down")
+    breaker = HostCircuitBreaker(client)
+    for _ in range(3):
+        breaker.record_failure("example.com")
+    with pytest.raises(HostCircuitOpen):
+        breaker.check("example.com")
+
+
+def test_disabled(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=0)
+    with patch("history4feed.h4fscripts.circuit_breaker.get_breaker") as mock_get_breaker:
+        circuit_breaker.record_failure("https://example.com/")
+        circuit_breaker.check("https://example.com/")
+    mock_get_breaker.assert_not_called()
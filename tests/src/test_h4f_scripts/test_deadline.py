@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pytest
+from history4feed.h4fscripts.deadline import Deadline
+from history4feed.h4fscripts.exceptions import DeadlineExceeded
+
+
+@pytest.fixture
+def clock():
+    now = [100]
+    with patch("history4feed.h4fscripts.deadline.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+def test_remaining(clock):
+    deadline = Deadline(30)
+    clock[0] += 10
+    assert deadline.remaining() == 20
+    clock[0] += 50
+    assert deadline.remaining() == 0
+
+
+def test_for_task_keeps_margin(clock):
+    assert Deadline.for_task(100).remaining() == 95
+    assert Deadline.for_task(2).remaining() == 0
+
+
+def test_allows(clock):
+    deadline = Deadline(30)
+    assert deadline.allows(25)
+    assert not deadline.allows(26), "no time left for the request after waiting"
+
+
+def test_timeout(clock):
+    deadline = Deadline(30)
+    assert deadline.timeout(10) == 10
+    clock[0] += 25
+    assert deadline.timeout(10) == 5
+
+
+def test_check(clock):
+    deadline = Deadline(30)
+    deadline.check("fetching")
+    clock[0] += 30
+    with pytest.raises(DeadlineExceeded, match="deadline of 30s reached before fetching"):
+        deadline.check("fetching")
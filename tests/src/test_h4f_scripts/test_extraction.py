@@ -0,0 +1,98 @@
+import multiprocessing
+import queue
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from history4feed.h4fscripts import extraction
+from history4feed.h4fscripts.deadline import Deadline
+from history4feed.h4fscripts.exceptions import DeadlineExceeded
+
+HTML = "<html><body><article><h1>Title</h1><p>" + "Some article text. " * 50 + "</p></article></body></html>"
+
+
+@pytest.fixture
+def pool_settings(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(EXTRACTION_PROCESSES=1)
+    extraction._pools.clear()
+    yield
+    for pool in extraction._pools.values():
+        pool.shutdown(cancel_futures=True)
+    extraction._pools.clear()
+
+
+def test_summarize_inline(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(EXTRACTION_PROCESSES=0)
+    with patch.object(extraction, "get_pool") as mock_get_pool:
+        summary = extraction.summarize(HTML, "https://example.com/post")
+    mock_get_pool.assert_not_called()
+    assert "Some article text." in summary
+
+
+def test_summarize_in_process_pool(pool_settings):
+    summary = extraction.summarize(HTML, "https://example.com/post", deadline=Deadline(60))
+    assert summary == extraction.extract_summary(HTML, "https://example.com/post")
+    assert extraction.get_pool() is extraction.get_pool()
+
+
+def summarize_in_child(results):
+    try:
+        results.put(extraction.summarize(HTML, "https://example.com/post", deadline=Deadline(60)))
+    except BaseException as e:
+        results.put(repr(e))
+
+
+def test_summarize_in_daemon_process(pool_settings):
+    # like a worker process of celery's prefork pool
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=summarize_in_child, args=(results,), daemon=True)
+    process.start()
+    summary = results.get(timeout=60)
+    process.join(10)
+    assert summary == extraction.extract_summary(HTML, "https://example.com/post")
+    assert not extraction._pools, "no pool is started in the parent either"
+
+
+def test_summarize_deadline(pool_settings):
+    future = Future()
+    with patch.object(extraction, "get_pool") as mock_get_pool:
+        mock_get_pool.return_value.submit.return_value = future
+        with pytest.raises(DeadlineExceeded, match="before extracting `https://example.com/post`"):
+            extraction.summarize(HTML, "https://example.com/post", deadline=Deadline(0))
+    assert future.cancelled()
+
+
+def test_summarize_replaces_broken_pool(pool_settings):
+    broken = MagicMock()
+    broken.submit.side_effect = BrokenProcessPool("dead")
+    extraction._pools[extraction.os.getpid()] = broken
+    summary = extraction.summarize(HTML, "https://example.com/post", deadline=Deadline(60))
+    assert "Some article text." in summary
+    broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+    assert extraction.get_pool() is not broken
+
+
+def test_summarize_in_fulltext_worker(pool_settings):
+    # the worker of `FULLTEXT_QUEUE` runs `--pool threads`, its tasks run in the (non daemonic) worker process
+    from celery.contrib.testing.worker import start_worker
+    from history4feed.h4fscripts.celery import app
+
+    results = queue.Queue()
+
+    @app.task(name="tests.summarize_in_worker", shared=False)
+    def summarize_task():
+        results.put(extraction.summarize(HTML, "https://example.com/post", deadline=Deadline(60)))
+
+    always_eager = app.conf.task_always_eager
+    app.conf.task_always_eager = False
+    try:
+        with start_worker(app, pool="threads", perform_ping_check=False, queues=["fulltext"]):
+            summarize_task.apply_async(queue="fulltext")
+            summary = results.get(timeout=60)
+    finally:
+        app.conf.task_always_eager = always_eager
+    assert summary == extraction.extract_summary(HTML, "https://example.com/post")
+    assert list(extraction._pools) == [extraction.os.getpid()], "extracted in the process pool"
@@ -0,0 +1,81 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from history4feed.app.models import FullTextState
+from history4feed.h4fscripts.fulltext_engine import FulltextEngine, FulltextResult
+from history4feed.h4fscripts.exceptions import DeadlineExceeded
+
+
+def test_run_returns_result_per_item():
+    def fetch(link):
+        if "fail" in link:
+            raise Exception("boom")
+        return f"<p>{link}</p>", "text/html"
+
+    engine = FulltextEngine(fetch, concurrency=4, per_host_concurrency=2, timeout=5)
+    results = {r.ftjob_pk: r for r in engine.run([(1, "https://a.com/1"), (2, "https://a.com/fail"), (3, "https://b.com/3")])}
+    assert results == {
+        1: FulltextResult(1, FullTextState.RETRIEVED, "", "<p>https://a.com/1</p>", "text/html"),
+        2: FulltextResult(2, FullTextState.FAILED, "boom"),
+        3: FulltextResult(3, FullTextState.RETRIEVED, "", "<p>https://b.com/3</p>", "text/html"),
+    }
+
+
+def test_run_deadline_exceeded_is_timed_out():
+    def fetch(link):
+        raise DeadlineExceeded("not enough time left to retry")
+
+    engine = FulltextEngine(fetch, concurrency=1, per_host_concurrency=1, timeout=5)
+    [result] = engine.run([(1, "https://a.com/1")])
+    assert result == FulltextResult(
+        1, FullTextState.TIMED_OUT, "task timed out: not enough time left to retry"
+    )
+
+
+def test_run_respects_concurrency_limits():
+    lock = threading.Lock()
+    running = dict(total=0, max_total=0)
+    per_host = {}
+
+    def fetch(link):
+        host = link.split("/")[2]
+        with lock:
+            running["total"] += 1
+            per_host.setdefault(host, [0, 0])
+            per_host[host][0] += 1
+            running["max_total"] = max(running["max_total"], running["total"])
+            per_host[host][1] = max(per_host[host][1], per_host[host][0])
+        time.sleep(0.02)
+        with lock:
+            running["total"] -= 1
+            per_host[host][0] -= 1
+        return "", "text/html"
+
+    items = [(i, f"https://host{i % 3}.com/{i}") for i in range(30)]
+    engine = FulltextEngine(fetch, concurrency=4, per_host_concurrency=2, timeout=5)
+    assert len(list(engine.run(items))) == 30
+    assert running["max_total"] <= 4
+    assert max(v[1] for v in per_host.values()) <= 2
+    assert running["max_total"] > 1, "should run fetches concurrently"
+
+
+def test_run_timeout():
+    def fetch(link):
+        time.sleep(0.5)
+        return "", "text/html"
+
+    engine = FulltextEngine(fetch, concurrency=2, per_host_concurrency=2, timeout=0.05)
+    [result] = engine.run([(1, "https://a.com/1")])
+    assert result.status == FullTextState.TIMED_OUT
+    assert "timed out" in result.error_str
+
+
+def test_run_cancelled():
+    fetch = MagicMock(return_value=("", "text/html"))
+    engine = FulltextEngine(fetch, concurrency=2, per_host_concurrency=2, timeout=5)
+    engine.cancel()
+    results = list(engine.run([(1, "https://a.com/1"), (2, "https://a.com/2")]))
+    assert {r.status for r in results} == {FullTextState.CANCELLED}
+    assert results[0].error_str == "job cancelled while retrieving fulltext"
+    fetch.assert_not_called()
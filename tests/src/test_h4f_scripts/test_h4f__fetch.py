@@ -1,18 +1,41 @@
+import gzip
+import json
+import tracemalloc
+import requests
+import zlib
+import brotli
 import pytest
+import zstandard
 from unittest.mock import patch, MagicMock
+from requests.structures import CaseInsensitiveDict
 from requests import Response
 from history4feed.app.settings import History4FeedServerSettings
 from history4feed.h4fscripts.h4f import (
+    CacheValidators,
     fetch_page_with_retries,
     fetch_page,
     fetch_with_scapfly,
     FatalError,
+    get_retry_after,
+    MAX_RETRY_AFTER_SECONDS,
     parse_feed_from_url,
+    STREAM_CHUNK_SIZE,
 )
+from history4feed.h4fscripts.decoding import DecodedSizeExceeded, StreamDecoder, UnsupportedEncoding, new_decoder
+from history4feed.h4fscripts.routing import HostRouter
+from history4feed.h4fscripts.circuit_breaker import HostCircuitBreaker
+from history4feed.h4fscripts.deadline import Deadline
 from history4feed.h4fscripts.exceptions import (
     history4feedException,
     ScrapflyError,
     FetchRedirect,
+    NotModified,
+    Blocked,
+    RateLimited,
+    HostCircuitOpen,
+    DeadlineExceeded,
+    DownloadSizeExceeded,
+    UnsupportedContentType,
 )
 from types import SimpleNamespace
 from history4feed.h4fscripts.h4f import get_full_text
@@ -25,13 +48,39 @@ def dummy_url():
     return "https://example.com/test"
 
 
+@pytest.fixture(autouse=True)
+def no_rate_limit():
+    with patch("history4feed.h4fscripts.h4f.rate_limiter.wait") as mock_wait:
+        yield mock_wait
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit_hold():
+    with patch("history4feed.h4fscripts.h4f.rate_limiter.hold") as mock_hold:
+        yield mock_hold
+
+
+@pytest.fixture(autouse=True)
+def local_breaker():
+    breaker = HostCircuitBreaker()
+    with patch("history4feed.h4fscripts.h4f.circuit_breaker.get_breaker", return_value=breaker):
+        yield breaker
+
+
+@pytest.fixture(autouse=True)
+def local_router():
+    router = HostRouter()
+    with patch("history4feed.h4fscripts.h4f.routing.get_router", return_value=router):
+        yield router
+
+
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_success(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.return_value = (b"html", "text/html", dummy_url)
 
     result = fetch_page_with_retries(dummy_url)
@@ -42,11 +91,11 @@ def test_fetch_page_with_retries_success(
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_with_retry(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.side_effect = [Exception("fail"), (b"ok", "text/html", dummy_url)]
 
     result = fetch_page_with_retries(dummy_url, retry_count=1)
@@ -57,11 +106,11 @@ def test_fetch_page_with_retries_with_retry(
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_fatal_error(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.side_effect = FatalError("fatal")
 
     with pytest.raises(FatalError):
@@ -71,11 +120,11 @@ def test_fetch_page_with_retries_fatal_error(
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_exhausts(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.side_effect = Exception("failed due to arbitrary test reason")
 
     with pytest.raises(ConnectionError) as e:
@@ -93,19 +142,28 @@ def test_fetch_page_with_retries_exhausts(
 # -------------------
 
 
+def make_response(chunks, headers=None, status_code=200, url="https://example.com/test"):
+    response = MagicMock()
+    response.ok = status_code < 400
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers or {})
+    response.url = url
+    response.raw.stream.return_value = iter(chunks)
+    response.__enter__.return_value = response
+    return response
+
+
 @patch("history4feed.h4fscripts.h4f.logger")
 def test_fetch_page_success(mock_logger, dummy_url):
     session = MagicMock()
-    response = MagicMock(spec=Response)
-    response.ok = True
-    response.content = b"html-content"
-    response.headers = {"content-type": "text/html"}
-    response.url = dummy_url
+    response = make_response([b"html-", b"content"], {"content-type": "text/html"})
     session.get.return_value = response
 
     content, content_type, final_url = fetch_page(session, dummy_url)
 
-    session.get.assert_called_once_with(dummy_url, headers={})
+    session.get.assert_called_once_with(dummy_url, headers={}, stream=True, timeout=(10, 30))
+    response.raw.stream.assert_called_once_with(STREAM_CHUNK_SIZE, decode_content=False)
+    response.__exit__.assert_called_once()
     assert content == b"html-content"
     assert content_type == "text/html"
     assert final_url == dummy_url
@@ -115,13 +173,13 @@ def test_fetch_page_success(mock_logger, dummy_url):
 def test_fetch_page_uses_scrapfly(mock_fetch, settings, dummy_url, content):
     api_key = "some value"
     session = MagicMock()
-    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": api_key}
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": api_key, "SCRAPFLY_ROUTING": "always"}
     use_asp = MagicMock()
     mocked_resp = MagicMock()
     mocked_resp.content = content
     mock_fetch.return_value = [None, mocked_resp]
     result = fetch_page(session, dummy_url, use_scrapfly_asp=use_asp)
-    mock_fetch.assert_called_once_with(session, dummy_url, {}, api_key, use_asp)
+    mock_fetch.assert_called_once_with(session, dummy_url, {}, api_key, use_asp, deadline=None)
     assert result == (
         b"<html>content</html>",
         mocked_resp.content_type,
@@ -129,6 +187,292 @@ def test_fetch_page_uses_scrapfly(mock_fetch, settings, dummy_url, content):
     )
 
 
+def scrapfly_result(content="<html>proxied</html>", url="https://example.com/test"):
+    return SimpleNamespace(content=content, content_type="text/html", url=url)
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_prefers_direct(mock_scrapfly, settings, dummy_url, local_router):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key"}
+    session = MagicMock()
+    session.get.return_value = make_response([b"<html>direct</html>"], {"content-type": "text/html"})
+    assert fetch_page(session, dummy_url)[0] == b"<html>direct</html>"
+    mock_scrapfly.assert_not_called()
+    assert local_router.get("example.com") == "direct"
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        make_response([], status_code=403),
+        make_response([], {"cf-mitigated": "challenge"}, status_code=503),
+        make_response(
+            [b"<html><head><title>Just a moment...</title></head></html>"],
+            {"content-type": "text/html; charset=UTF-8"},
+        ),
+    ],
+)
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_falls_back_to_scrapfly(
+    mock_scrapfly, settings, dummy_url, local_router, response
+):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key"}
+    session = MagicMock()
+    session.get.return_value = response
+    mock_scrapfly.return_value = (None, scrapfly_result())
+    assert fetch_page(session, dummy_url)[0] == b"<html>proxied</html>"
+    mock_scrapfly.assert_called_once_with(session, dummy_url, {}, "key", False, deadline=None)
+    assert local_router.get("example.com") == "scrapfly"
+
+    # host is remembered as blocking direct fetches
+    session.get.reset_mock()
+    fetch_page(session, dummy_url)
+    session.get.assert_not_called()
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_rate_limited_is_not_rerouted(
+    mock_scrapfly, settings, dummy_url, local_router, no_rate_limit_hold
+):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key"}
+    session = MagicMock()
+    session.get.return_value = make_response([], {"retry-after": "5"}, status_code=429)
+    with pytest.raises(RateLimited) as exc_info:
+        fetch_page(session, dummy_url)
+    assert exc_info.value.retry_after == 5
+    no_rate_limit_hold.assert_called_once_with(dummy_url, 5)
+    mock_scrapfly.assert_not_called()
+    assert local_router.get("example.com") is None
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_never_reroutes_wayback(mock_scrapfly, settings, local_router):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key", "WAYBACK_URL": "https://web.archive.org"}
+    session = MagicMock()
+    session.get.return_value = make_response([], status_code=403)
+    with pytest.raises(Blocked):
+        fetch_page(session, "https://web.archive.org/web/2024id_/https://example.com/feed")
+    mock_scrapfly.assert_not_called()
+    assert local_router.get("web.archive.org") is None
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [
+        (None, None),
+        ("", None),
+        ("120", 120),
+        ("-3", 0),
+        ("99999", MAX_RETRY_AFTER_SECONDS),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0),
+        ("not a date", None),
+    ],
+)
+def test_get_retry_after(value, expected):
+    headers = {} if value is None else {"Retry-After": value}
+    assert get_retry_after(headers) == expected
+
+
+def test_get_retry_after_date():
+    with patch("history4feed.h4fscripts.h4f.time.time", return_value=1445412460):
+        assert get_retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 20
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_honours_retry_after(mock_ua, mock_sleep, dummy_url):
+    with patch("history4feed.h4fscripts.h4f.http_client.get_session") as mock_session:
+        mock_session.return_value.get.side_effect = [
+            make_response([], {"retry-after": "60"}, status_code=429),
+            make_response([], status_code=429),
+            make_response([b"<rss/>"]),
+        ]
+        content, _, _ = fetch_page_with_retries(dummy_url, retry_count=2, sleep_seconds=20)
+    assert content == b"<rss/>"
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [60, 30]
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_retry_after_past_deadline(mock_ua, mock_sleep, dummy_url):
+    with (
+        patch("history4feed.h4fscripts.h4f.fetch_page", side_effect=RateLimited("slow down", 120)),
+        patch.object(Deadline, "remaining", return_value=60),
+    ):
+        with pytest.raises(DeadlineExceeded, match="not enough time left"):
+            fetch_page_with_retries(dummy_url, retry_count=3, sleep_seconds=1, deadline=Deadline(300))
+    mock_sleep.assert_not_called()
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_escalates_to_asp(mock_scrapfly, settings, dummy_url, local_router):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key"}
+    local_router.remember("example.com", "scrapfly")
+    session = MagicMock()
+    mock_scrapfly.side_effect = [Blocked("blocked"), (None, scrapfly_result())]
+    assert fetch_page(session, dummy_url)[0] == b"<html>proxied</html>"
+    assert [c.args[4] for c in mock_scrapfly.call_args_list] == [False, True]
+    session.get.assert_not_called()
+    assert local_router.get("example.com") == "scrapfly_asp"
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_with_scapfly")
+def test_fetch_page_adaptive_no_auto_asp(mock_scrapfly, settings, dummy_url, local_router):
+    settings.HISTORY4FEED_SETTINGS = {"SCRAPFLY_APIKEY": "key", "SCRAPFLY_AUTO_ASP": False}
+    local_router.remember("example.com", "scrapfly")
+    mock_scrapfly.side_effect = Blocked("blocked")
+    with pytest.raises(Blocked):
+        fetch_page(MagicMock(), dummy_url)
+    mock_scrapfly.assert_called_once()
+
+
+def test_fetch_page_opens_circuit_breaker(settings, dummy_url):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    session = MagicMock()
+    session.get.side_effect = [
+        make_response([], status_code=502),
+        requests.ConnectionError("refused"),
+    ]
+    with pytest.raises(history4feedException):
+        fetch_page(session, dummy_url)
+    with pytest.raises(requests.ConnectionError):
+        fetch_page(session, dummy_url)
+    with pytest.raises(HostCircuitOpen):
+        fetch_page(session, dummy_url)
+    assert session.get.call_count == 2
+
+
+def test_fetch_page_success_resets_circuit_breaker(settings, dummy_url, local_breaker):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    session = MagicMock()
+    session.get.side_effect = [
+        make_response([], status_code=500),
+        make_response([b"<rss/>"]),
+        make_response([], status_code=500),
+        make_response([b"<rss/>"]),
+    ]
+    for _ in range(2):
+        with pytest.raises(history4feedException):
+            fetch_page(session, dummy_url)
+        fetch_page(session, dummy_url)
+    local_breaker.check("example.com")
+
+
+def test_fetch_page_4xx_does_not_count_as_host_failure(settings, dummy_url):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=1)
+    session = MagicMock()
+    session.get.side_effect = lambda *args, **kwargs: make_response([], status_code=404)
+    for _ in range(3):
+        with pytest.raises(history4feedException):
+            fetch_page(session, dummy_url)
+    assert session.get.call_count == 3
+
+
+def half_open(breaker, host="example.com"):
+    for _ in range(2):
+        breaker.record_failure(host)
+    breaker.local_store.delete(breaker.keys(host)[1])
+
+
+def test_half_open_probe_not_found_closes_circuit(settings, dummy_url, local_breaker):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    half_open(local_breaker)
+    session = MagicMock()
+    session.get.side_effect = lambda *args, **kwargs: make_response([], status_code=404)
+    with pytest.raises(history4feedException):
+        fetch_page(session, dummy_url)
+    # the host answered, other workers are not held back by the probe
+    local_breaker.check("example.com")
+    local_breaker.check("example.com")
+
+
+def test_half_open_probe_deadline_releases_probe(settings, dummy_url, local_breaker):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    half_open(local_breaker)
+    with pytest.raises(DeadlineExceeded):
+        fetch_page(MagicMock(), dummy_url, deadline=Deadline(0))
+    local_breaker.check("example.com")
+    with pytest.raises(HostCircuitOpen, match="probe"):
+        local_breaker.check("example.com")
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_half_open_probe(mock_ua, mock_sleep, settings, dummy_url, local_breaker):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    half_open(local_breaker)
+    with patch("history4feed.h4fscripts.h4f.http_client.get_session") as mock_session:
+        mock_session.return_value.get.side_effect = [
+            make_response([], status_code=429),
+            make_response([b"<rss/>"]),
+        ]
+        content, _, _ = fetch_page_with_retries(dummy_url, retry_count=1)
+    assert content == b"<rss/>", "the retry is not rejected by its own probe"
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_stops_when_circuit_opens(mock_ua, mock_sleep, settings, dummy_url):
+    settings.HISTORY4FEED_SETTINGS = dict(CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    with patch("history4feed.h4fscripts.h4f.http_client.get_session") as mock_session:
+        mock_session.return_value.get.side_effect = requests.ConnectionError("refused")
+        with pytest.raises(HostCircuitOpen):
+            fetch_page_with_retries(dummy_url, retry_count=5)
+    assert mock_session.return_value.get.call_count == 2
+    assert mock_sleep.call_count == 1
+
+
+def test_fetch_page_timeout_follows_deadline(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response([b"<rss/>"])
+    with patch.object(Deadline, "remaining", return_value=12):
+        fetch_page(session, dummy_url, deadline=Deadline(60))
+    assert session.get.call_args[1]["timeout"] == (10, 12)
+
+
+def test_fetch_page_deadline_expired(dummy_url):
+    session = MagicMock()
+    with pytest.raises(DeadlineExceeded):
+        fetch_page(session, dummy_url, deadline=Deadline(0))
+    session.get.assert_not_called()
+
+
+def test_fetch_page_deadline_expires_while_downloading(dummy_url):
+    deadline = Deadline(60)
+    stream = iter([b"a" * 10, b"a" * 10, b"a" * 10])
+    session = MagicMock()
+    session.get.return_value = make_response(stream)
+    # 3 calls while setting the request timeouts, then one per chunk
+    with patch.object(Deadline, "remaining", side_effect=[60, 60, 60, 1, 0]):
+        with pytest.raises(DeadlineExceeded):
+            fetch_page(session, dummy_url, deadline=deadline)
+    assert len(list(stream)) == 1
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_skips_retry_past_deadline(mock_ua, mock_sleep, dummy_url):
+    with (
+        patch("history4feed.h4fscripts.h4f.fetch_page", side_effect=requests.ConnectionError("refused")) as mock_fetch_page,
+        patch.object(Deadline, "remaining", return_value=30),
+    ):
+        with pytest.raises(DeadlineExceeded, match="not enough time left"):
+            fetch_page_with_retries(dummy_url, retry_count=3, sleep_seconds=20, deadline=Deadline(60))
+    # 20s backoff fits in the 30s left, 30s backoff does not
+    assert mock_fetch_page.call_count == 2
+    mock_sleep.assert_called_once_with(20)
+
+
+def test_fetch_page_challenge_page_without_scrapfly(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response(
+        [b"<script src='/cdn-cgi/challenge-platform/h/b/orchestrate'></script>"],
+        {"content-type": "text/html"},
+    )
+    with pytest.raises(Blocked):
+        fetch_page(session, dummy_url)
+
+
 @patch("history4feed.h4fscripts.h4f.logger")
 def test_fetch_page_not_ok_raises(mock_logger, dummy_url):
     session = MagicMock()
@@ -138,38 +482,269 @@ def test_fetch_page_not_ok_raises(mock_logger, dummy_url):
     response.reason = "Malicious IP blocked"
     session.get.return_value = response
 
-    with pytest.raises(history4feedException) as exp:
+    with pytest.raises(RateLimited) as exp:
         fetch_page(session, dummy_url)
 
-    session.get.assert_called_once_with(dummy_url, headers={})
+    session.get.assert_called_once_with(dummy_url, headers={}, stream=True, timeout=(10, 30))
     assert (
         "GET Request failed for `https://example.com/test`, status: 429, reason: Malicious IP blocked"
         in str(exp.value)
     )
 
 
-@patch("history4feed.h4fscripts.h4f.logger")
-@patch(
-    "history4feed.h4fscripts.h4f.brotli.decompress",
-    side_effect=Exception("decompress failed"),
+def compress(encoding, data):
+    match encoding:
+        case "gzip":
+            return gzip.compress(data)
+        case "deflate":
+            return zlib.compress(data)
+        case "br":
+            return brotli.compress(data)
+        case "zstd":
+            return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "deflate", "br", "zstd"])
+@pytest.mark.parametrize("header", ["content-encoding", "x-archive-orig-content-encoding"])
+def test_fetch_page_decodes_from_headers(dummy_url, encoding, header):
+    body = b"<rss>" + b"<item/>" * 10000 + b"</rss>"
+    compressed = compress(encoding, body)
+    chunks = [compressed[i : i + 100] for i in range(0, len(compressed), 100)]
+    session = MagicMock()
+    session.get.return_value = make_response(chunks, {header: encoding})
+    content, _, _ = fetch_page(session, dummy_url)
+    assert content == body
+
+
+def test_fetch_page_does_not_guess_encoding(dummy_url):
+    body = brotli.compress(b"<rss/>")
+    session = MagicMock()
+    session.get.return_value = make_response([body], {"content-type": "text/xml"})
+    content, _, _ = fetch_page(session, dummy_url)
+    assert content == body, "no content-encoding, body returned as-is"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_fetch_page_archived_encoding_already_decoded(dummy_url, encoding):
+    # wayback sometimes serves the decoded body along with the original content-encoding
+    body = b"<rss>" + b"<item/>" * 10000 + b"</rss>"
+    session = MagicMock()
+    session.get.return_value = make_response(
+        [body[i : i + 1000] for i in range(0, len(body), 1000)], {"x-archive-orig-content-encoding": encoding}
+    )
+    content, _, _ = fetch_page(session, dummy_url)
+    assert content == body
+
+
+@pytest.mark.parametrize(
+    ["encoding", "brotli_module"],
+    [("br", None), ("compress", brotli), ("gzip, x-unknown", brotli)],
 )
-def test_fetch_page_brotli_fails(mock_brotli, mock_logger, dummy_url):
+def test_fetch_page_unsupported_archived_encoding(dummy_url, encoding, brotli_module):
+    session = MagicMock()
+    session.get.return_value = make_response([b"<rss/>"], {"x-archive-orig-content-encoding": encoding})
+    with patch("history4feed.h4fscripts.decoding.brotli", brotli_module):
+        content, _, _ = fetch_page(session, dummy_url)
+    assert content == b"<rss/>"
+
+
+def test_fetch_page_unsupported_content_encoding_raises(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response([b"<rss/>"], {"content-encoding": "compress"})
+    with pytest.raises(UnsupportedEncoding):
+        fetch_page(session, dummy_url)
+
+
+def test_fetch_page_bad_content_encoding_raises(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response([b"<rss/>"], {"content-encoding": "gzip"})
+    with pytest.raises(zlib.error):
+        fetch_page(session, dummy_url)
+
+
+class UnboundedDecompressor:
+    """
+    `brotli.Decompressor` of brotlipy and brotlicffi, without `process`
+    """
+
+    Decompressor = brotli.Decompressor
+
+    def __init__(self):
+        self.decompressor = self.Decompressor()
+
+    def decompress(self, data):
+        return self.decompressor.process(data)
+
+    def finish(self):
+        return b""
+
+
+def test_brotli_decoder_without_output_limit():
+    body = b"<rss>" + b"<item/>" * 10000 + b"</rss>"
+    compressed = brotli.compress(body)
+    with patch("history4feed.h4fscripts.decoding.brotli.Decompressor", UnboundedDecompressor):
+        decoder = StreamDecoder(["br"], 10 * len(body))
+        for i in range(0, len(compressed), 100):
+            decoder.write(compressed[i : i + 100])
+        assert decoder.close() == body
+
+
+def test_fetch_page_content_encoding_takes_precedence(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response(
+        [gzip.compress(b"<rss/>")],
+        {"content-encoding": "gzip", "x-archive-orig-content-encoding": "br"},
+    )
+    content, _, _ = fetch_page(session, dummy_url)
+    assert content == b"<rss/>"
+
+
+def test_fetch_page_aborts_on_decompression_bomb(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DECODED_BODY_BYTES=1000)
+    bomb = gzip.compress(b"\0" * 10_000_000)
+    session = MagicMock()
+    session.get.return_value = make_response([bomb[:100], bomb[100:]], {"content-encoding": "gzip"})
+    with pytest.raises(DecodedSizeExceeded):
+        fetch_page(session, dummy_url)
+
+
+@pytest.fixture(scope="module")
+def bombs():
+    # 256MB of zeros
+    size = 256 * 1024 * 1024
+    return dict(
+        br=brotli.compress(b"\0" * size, quality=1),
+        zstd=zstandard.ZstdCompressor(level=1).compress(b"\0" * size),
+    )
+
+
+@pytest.mark.parametrize("encoding", ["br", "zstd"])
+def test_decoder_output_is_bounded(bombs, encoding):
+    decoder = new_decoder(encoding)
+    out = decoder.decompress(bombs[encoding], 1024 * 1024)
+    assert 1024 * 1024 <= len(out) <= 1024 * 1024 + 128 * 1024
+    assert decoder.has_unconsumed_tail, "the rest of the bomb is left undecoded"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_fetch_page_decompression_bomb_memory(dummy_url, settings, bombs, encoding):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DECODED_BODY_BYTES=1024 * 1024)
+    bomb = bombs.get(encoding) or gzip.compress(b"\0" * 100_000_000)
+    session = MagicMock()
+    session.get.return_value = make_response([bomb[i : i + 4096] for i in range(0, len(bomb), 4096)], {"content-encoding": encoding})
+    tracemalloc.start()
+    try:
+        with pytest.raises(DecodedSizeExceeded):
+            fetch_page(session, dummy_url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * 1024 * 1024
+
+
+def test_fetch_page_aborts_on_large_body(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DECODED_BODY_BYTES=1000)
+    stream = iter([b"a" * 600, b"a" * 600, b"a" * 600])
+    session = MagicMock()
+    session.get.return_value = make_response(stream)
+    with pytest.raises(DecodedSizeExceeded):
+        fetch_page(session, dummy_url)
+    assert len(list(stream)) == 1, "should stop reading once the limit is reached"
+
+
+def test_fetch_page_aborts_on_download_budget(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DOWNLOAD_BYTES=1000)
+    stream = iter([b"a" * 600, b"a" * 600, b"a" * 600])
+    session = MagicMock()
+    session.get.return_value = make_response(stream)
+    with pytest.raises(DownloadSizeExceeded):
+        fetch_page(session, dummy_url)
+    assert len(list(stream)) == 1, "should stop downloading once the budget is spent"
+
+
+def test_fetch_page_aborts_on_content_length(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DOWNLOAD_BYTES=1000)
+    response = make_response([b"a" * 600], {"content-length": "5000"})
+    session = MagicMock()
+    session.get.return_value = response
+    with pytest.raises(DownloadSizeExceeded):
+        fetch_page(session, dummy_url)
+    response.raw.stream.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "content_type", ["application/pdf", "image/png", "video/mp4; codecs=avc1", "application/zip"]
+)
+def test_fetch_page_aborts_on_unsupported_content_type(dummy_url, content_type):
+    response = make_response([b"%PDF-"], {"content-type": content_type})
     session = MagicMock()
-    response = MagicMock()
-    response.ok = True
-    response.content = b"compressed"
-    response.headers = {"content-type": "text/html"}
-    response.url = dummy_url
     session.get.return_value = response
+    with pytest.raises(UnsupportedContentType):
+        fetch_page(session, dummy_url)
+    response.raw.stream.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "exception", [DownloadSizeExceeded("too big"), UnsupportedContentType("pdf")]
+)
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_does_not_retry_oversized_or_unsupported(
+    mock_ua, mock_sleep, dummy_url, exception
+):
+    with patch("history4feed.h4fscripts.h4f.fetch_page", side_effect=exception) as mock_fetch_page:
+        with pytest.raises(type(exception)):
+            fetch_page_with_retries(dummy_url, retry_count=3)
+    assert mock_fetch_page.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_fetch_page_sends_and_updates_validators(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_response(
+        [b"<rss/>"],
+        {"content-type": "text/xml", "ETag": '"v2"', "Last-Modified": "Tue, 01 Oct 2024 00:00:00 GMT"},
+    )
+
+    validators = CacheValidators(etag='"v1"', last_modified="Mon, 30 Sep 2024 00:00:00 GMT")
+    fetch_page(session, dummy_url, validators=validators)
+    session.get.assert_called_once_with(
+        dummy_url,
+        headers={"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 30 Sep 2024 00:00:00 GMT"},
+        stream=True,
+        timeout=(10, 30),
+    )
+    assert validators == CacheValidators(etag='"v2"', last_modified="Tue, 01 Oct 2024 00:00:00 GMT")
+
 
-    content, ctype, url = fetch_page(session, dummy_url)
-    mock_brotli.assert_called_once_with(b"compressed")
-    assert content == b"compressed"  # returned as-is due to decompress failure
+def test_fetch_page_not_modified(dummy_url):
+    session = MagicMock()
+    session.get.return_value.status_code = 304
+    validators = CacheValidators(etag='"v1"')
+    with pytest.raises(NotModified):
+        fetch_page(session, dummy_url, validators=validators)
+    assert validators.etag == '"v1"'
+
+
+@patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
+@patch("history4feed.h4fscripts.h4f.fetch_page", side_effect=NotModified("not modified"))
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
+def test_fetch_page_with_retries_does_not_retry_not_modified(
+    mock_ua, mock_fetch_page, mock_sleep, dummy_url
+):
+    with pytest.raises(NotModified):
+        fetch_page_with_retries(dummy_url, retry_count=3)
+    assert mock_fetch_page.call_count == 1
+    mock_sleep.assert_not_called()
 
 
 # ------------------------
 # fetch_with_scapfly
 # ------------------------
+def make_scrapfly_response(data, status_code=200):
+    return make_response([json.dumps(data).encode()], {"content-type": "application/json"}, status_code)
+
+
 @pytest.mark.parametrize("use_scrapfly_asp", [True, False])
 def test_fetch_with_scapfly_success(dummy_url, use_scrapfly_asp):
     session = MagicMock()
@@ -182,10 +757,10 @@ def test_fetch_with_scapfly_success(dummy_url, use_scrapfly_asp):
             "status": "OK",
         }
     }
-    response = MagicMock()
-    response.status_code = 200
-    response.json.return_value = result_data
-    session.get.return_value = response
+    session.get.return_value = make_scrapfly_response(
+        result_data,
+        status_code=200,
+    )
 
     headers = {"User-Agent": "curl"}
     proxy_apikey = "abc123"
@@ -207,16 +782,16 @@ def test_fetch_with_scapfly_success(dummy_url, use_scrapfly_asp):
     if use_scrapfly_asp:
         expected_params["asp"] = "true"
     session.get.assert_called_once_with(
-        "https://api.scrapfly.io/scrape", params=expected_params
+        "https://api.scrapfly.io/scrape", params=expected_params, stream=True, timeout=(10, 160)
     )
 
 
 def test_fetch_with_scapfly_fail_error(dummy_url):
     session = MagicMock()
-    response = MagicMock()
-    response.status_code = 500
-    response.json.return_value = {"result": {}, "message": "Server error"}
-    session.get.return_value = response
+    session.get.return_value = make_scrapfly_response(
+        {"result": {}, "message": "Server error"},
+        status_code=500,
+    )
 
     with pytest.raises(ScrapflyError) as exp:
         fetch_with_scapfly(session, dummy_url, {"User-Agent": "UA"}, "apikey")
@@ -226,15 +801,15 @@ def test_fetch_with_scapfly_fail_error(dummy_url):
 
 def test_fetch_with_scapfly_500_error(dummy_url):
     session = MagicMock()
-    response = MagicMock()
-    response.status_code = 200
-    response.json.return_value = {
-        "result": {
-            "status_code": 500,
+    session.get.return_value = make_scrapfly_response(
+        {
+            "result": {
+                "status_code": 500,
+            },
+            "message": "Server error",
         },
-        "message": "Server error",
-    }
-    session.get.return_value = response
+        status_code=200,
+    )
 
     with pytest.raises(FatalError) as exp:
         fetch_with_scapfly(
@@ -249,30 +824,77 @@ def test_fetch_with_scapfly_500_error(dummy_url):
 
 def test_fetch_with_scapfly_redirect(dummy_url):
     session = MagicMock()
-    response = MagicMock()
-    response.status_code = 200
-    response.json.return_value = {
-        "result": {
-            "status_code": 302,
-            "status": "Redirected",
-            "content": "",
-            "url": dummy_url,
-            "content_type": "text/html",
-        }
-    }
-    session.get.return_value = response
+    session.get.return_value = make_scrapfly_response(
+        {
+            "result": {
+                "status_code": 302,
+                "status": "Redirected",
+                "content": "",
+                "url": dummy_url,
+                "content_type": "text/html",
+            }
+        },
+        status_code=200,
+    )
 
     with pytest.raises(FetchRedirect):
         fetch_with_scapfly(session, dummy_url, {"User-Agent": "UA"}, "apikey")
 
 
+def test_fetch_with_scapfly_not_modified(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_scrapfly_response(
+        {"result": {"status_code": 304, "status": "Not Modified"}},
+        status_code=200,
+    )
+
+    with pytest.raises(NotModified):
+        fetch_with_scapfly(session, dummy_url, {"If-None-Match": '"v1"'}, "apikey")
+    assert session.get.call_args[1]["params"]["headers[If-None-Match]"] == '"v1"'
+
+
+def test_fetch_with_scapfly_download_budget(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DOWNLOAD_BYTES=1000)
+    session = MagicMock()
+    session.get.return_value = make_scrapfly_response(
+        {"result": {"content": "x" * 2000, "content_type": "text/html", "status_code": 200}}
+    )
+    with pytest.raises(DownloadSizeExceeded):
+        fetch_with_scapfly(session, dummy_url, {}, "apikey")
+
+
+def test_fetch_with_scapfly_blob_is_streamed(dummy_url, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(MAX_DOWNLOAD_BYTES=1000)
+    session = MagicMock()
+    blob = make_response([b"x" * 600, b"x" * 600], {"content-type": "text/html"})
+    session.get.side_effect = [
+        make_scrapfly_response(
+            {"result": {"content": "https://blob", "format": "blob", "content_type": "text/html", "status_code": 200}}
+        ),
+        blob,
+    ]
+    with pytest.raises(DownloadSizeExceeded):
+        fetch_with_scapfly(session, dummy_url, {}, "apikey")
+    assert session.get.call_args[1]["stream"] is True
+
+
+def test_fetch_with_scapfly_blob_content_type(dummy_url):
+    session = MagicMock()
+    session.get.return_value = make_scrapfly_response(
+        {"result": {"content": "https://blob", "format": "blob", "content_type": "application/pdf", "status_code": 200}}
+    )
+    with pytest.raises(UnsupportedContentType):
+        fetch_with_scapfly(session, dummy_url, {}, "apikey")
+    assert session.get.call_count == 1, "the blob is not downloaded"
+
+
 # ---------------------
 # get_full_text
 # ---------------------
 
 
 @patch(
-    "history4feed.h4fscripts.h4f.ReadabilityDocument", side_effect=ReadabilityDocument
+    "history4feed.h4fscripts.extraction.ReadabilityDocument", side_effect=ReadabilityDocument
 )
 @patch("history4feed.h4fscripts.h4f.fetch_page_with_retries")
 @patch.object(
@@ -294,6 +916,32 @@ def test_get_full_text_success(mock_summary, mock_fetch, mock_readability, dummy
     mock_summary.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    "content_type,page,expected",
+    [
+        ("text/html; charset=iso-8859-1", "<p>café</p>".encode("latin-1"), "<p>café</p>"),
+        ("text/html", b"<p>caf\xe9</p>", "<p>caf\ufffd</p>"),
+        ("text/html; charset=bad-charset", b"<p>cafe</p>", "<p>cafe</p>"),
+    ],
+)
+@patch("history4feed.h4fscripts.extraction.ReadabilityDocument")
+@patch("history4feed.h4fscripts.h4f.fetch_page_with_retries")
+def test_get_full_text_decodes_with_charset(
+    mock_fetch, mock_readability, dummy_url, content_type, page, expected
+):
+    mock_fetch.return_value = (page, content_type, dummy_url)
+    get_full_text(dummy_url, use_scrapfly_asp=False)
+    mock_readability.assert_called_once_with(expected, url=dummy_url)
+
+
+@patch("history4feed.h4fscripts.h4f.fetch_page_with_retries", side_effect=DeadlineExceeded("too late"))
+def test_get_full_text_deadline_exceeded_not_wrapped(mock_fetch, dummy_url):
+    deadline = Deadline(10)
+    with pytest.raises(DeadlineExceeded, match="too late"):
+        get_full_text(dummy_url, use_scrapfly_asp=False, deadline=deadline)
+    mock_fetch.assert_called_once_with(dummy_url, use_scrapfly_asp=False, deadline=deadline)
+
+
 @patch(
     "history4feed.h4fscripts.h4f.fetch_page_with_retries",
     side_effect=Exception("failure"),
@@ -305,11 +953,11 @@ def test_get_full_text_raises(mock_fetch, dummy_url):
 
 
 @patch("history4feed.h4fscripts.h4f.fetch_page_with_retries")
-@patch("history4feed.h4fscripts.h4f.parse_feed_from_content")
+@patch("history4feed.h4fscripts.h4f.parse_feed")
 def test_parse_feed_from_url(mock_parse: MagicMock, mock_fetch: MagicMock):
     mock_fetch.return_value = [1, 2, 3]
     url = "https://soem.url/"
-    parse_feed_from_url(url)
+    assert parse_feed_from_url(url) == mock_parse.return_value.metadata
     mock_fetch.assert_called_once_with(url, retry_count=0)
     mock_parse.assert_called_once_with(1, 3)
 
@@ -321,14 +969,14 @@ def test_parse_feed_from_url(mock_parse: MagicMock, mock_fetch: MagicMock):
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_propagates_soft_timeout(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
     """Test that SoftTimeLimitExceeded is propagated immediately without retries"""
     from celery.exceptions import SoftTimeLimitExceeded
 
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.side_effect = SoftTimeLimitExceeded()
 
     # Should raise immediately, not retry
@@ -343,14 +991,14 @@ def test_fetch_page_with_retries_propagates_soft_timeout(
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_propagates_soft_timeout_after_first_retry(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
     """Test that SoftTimeLimitExceeded is propagated even if it occurs after a failed retry"""
     from celery.exceptions import SoftTimeLimitExceeded
 
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     # First call fails with normal exception, second call gets timeout
     mock_fetch_page.side_effect = [
         Exception("temporary error"),
@@ -368,12 +1016,12 @@ def test_fetch_page_with_retries_propagates_soft_timeout_after_first_retry(
 
 @patch("history4feed.h4fscripts.h4f.time.sleep", return_value=None)
 @patch("history4feed.h4fscripts.h4f.fetch_page")
-@patch("history4feed.h4fscripts.h4f.fake_useragent.UserAgent")
+@patch("history4feed.h4fscripts.h4f.http_client.random_user_agent")
 def test_fetch_page_with_retries_propagates_fatal_error(
     mock_ua, mock_fetch_page, mock_sleep, dummy_url
 ):
     """Test that FatalError is also propagated immediately without retries"""
-    mock_ua().random = "test-agent"
+    mock_ua.return_value = "test-agent"
     mock_fetch_page.side_effect = FatalError("Server error 500+")
 
     with pytest.raises(FatalError):
@@ -1,9 +1,17 @@
+from unittest.mock import patch
+from xml.dom.minidom import parseString
 import pytest
+from lxml import etree
+from history4feed.h4fscripts import h4f
 from history4feed.h4fscripts.h4f import (
     parse_feed_from_content,
     parse_posts_from_atom_feed,
     parse_posts_from_rss_feed,
+    parse_feed,
+    parse_feed_minidom,
+    FeedReader,
 )
+from history4feed.h4fscripts.xml_utils import ItemView, LxmlItemView, MinidomItemView
 from .rss_data import rss_example, atom_example
 from datetime import datetime, UTC
 
@@ -107,3 +115,275 @@ def test_parse_posts_from_atom_feed():
     ]
     links_and_dates = [(k.link, k.pubdate) for k in posts.values()]
     assert links_and_dates == expected_links
+
+
+@pytest.mark.parametrize(
+    ["parse_posts", "data"],
+    [(parse_posts_from_rss_feed, atom_example), (parse_posts_from_atom_feed, rss_example)],
+)
+def test_parse_posts_from_feed_of_other_type(parse_posts, data):
+    with pytest.raises(h4f.UnknownFeedtypeException):
+        parse_posts("https://example.blog/rss/", data.encode())
+
+
+@pytest.mark.parametrize("data", [rss_example, atom_example])
+def test_lxml_engine_matches_minidom(data):
+    reader = FeedReader(data.encode(), "https://example.blog/rss/")
+    minidom_feed = parse_feed_minidom(data.encode(), "https://example.blog/rss/")
+    assert reader.read_metadata() == minidom_feed.metadata
+    lxml_posts = list(reader)
+    assert lxml_posts
+    assert lxml_posts == list(minidom_feed.posts)
+
+
+@pytest.mark.parametrize("engine", ["lxml", "minidom"])
+def test_parse_feed_uses_engine(settings, engine):
+    settings.HISTORY4FEED_SETTINGS = dict(FEED_PARSER_ENGINE=engine)
+    with (
+        patch.object(h4f, "FeedReader", wraps=FeedReader) as mock_reader,
+        patch.object(h4f, "parse_feed_minidom", wraps=parse_feed_minidom) as mock_minidom,
+    ):
+        parsed = parse_feed(rss_example.encode(), "https://example.blog/rss/")
+        assert parsed.metadata["feed_type"] == "rss"
+        assert len(list(parsed.posts)) == 6
+    assert mock_reader.called == (engine == "lxml")
+    assert mock_minidom.called == (engine == "minidom")
+
+
+def test_feed_reader_reads_metadata_only():
+    reader = FeedReader(atom_example.encode(), "https://example.blog/rss/")
+    assert reader.read_metadata()["title"] == "Your awesome title"
+    # the title and subtitle come before the first entry, which is left unparsed
+    assert not reader.pending
+    assert not reader.done
+
+
+def test_feed_reader_metadata_stops_at_first_item():
+    # no description, the rest of the document is not read looking for one
+    data = rss_example.replace("<description>", "<summary>").replace("</description>", "</summary>")
+    reader = FeedReader(data.encode(), "https://example.blog/rss/")
+    metadata = reader.read_metadata()
+    assert metadata["title"] == "Your awesome title"
+    assert metadata["description"] == ""
+    assert len(reader.pending) == 1
+    assert not reader.done
+    assert len(list(reader)) == 6
+
+
+def test_parse_feed_unknown_type():
+    with pytest.raises(h4f.UnknownFeedtypeException):
+        parse_feed(b"<html><body/></html>", "https://example.blog/")
+
+
+def test_lxml_engine_falls_back_to_minidom():
+    with patch.object(h4f, "iterparseFeed", side_effect=h4f.etree.XMLSyntaxError("bad", None, 1, 1, "feed.xml")):
+        parsed = parse_feed(rss_example.encode(), "https://example.blog/rss/")
+        assert parsed.metadata["title"] == "Your awesome title"
+        assert len(list(parsed.posts)) == 6
+
+
+def test_lxml_engine_does_not_fall_back_after_yielding():
+    data = rss_example.replace("</channel>", "<item><broken></item></channel>").encode()
+    posts = parse_feed(data, "https://example.blog/rss/").posts
+    assert next(posts).title == "Obstracts AI relationship generation test 2"
+    with pytest.raises(h4f.etree.XMLSyntaxError):
+        list(posts)
+
+
+def test_lxml_engine_only_reads_first_channel():
+    data = rss_example.replace("</rss>", "<channel><item><link>https://example.com/x</link><pubDate>2024-01-01</pubDate></item></channel></rss>")
+    posts = list(parse_feed(data.encode(), "https://example.blog/rss/").posts)
+    assert len(posts) == 6
+    assert "https://example.com/x" not in [post.link for post in posts]
+
+
+def test_iterparse_metadata_from_channel_only():
+    data = b"""<rss><channel>
+        <item><title>Item title</title><description>item</description><link>https://x.com/1</link><pubDate>2024-01-01</pubDate></item>
+        <description>Feed description</description>
+    </channel></rss>"""
+    metadata = dict((key, text) for kind, *event in h4f.iterparseFeed(h4f.BytesIO(data)) if kind == "metadata" for key, text in [event])
+    assert metadata == {"description": "Feed description"}, "the title of an item is not the feed title"
+
+
+def test_iterparse_does_not_expand_entities():
+    data = b"""<?xml version="1.0"?>
+    <!DOCTYPE rss [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;">]>
+    <rss><channel><title>Title &b;</title></channel></rss>"""
+    metadata = [event for kind, *event in h4f.iterparseFeed(h4f.BytesIO(data)) if kind == "metadata"]
+    assert metadata == [["title", "Title "]]
+
+
+def test_iterparse_frees_items():
+    items = (el for kind, *el in h4f.iterparseFeed(h4f.BytesIO(rss_example.encode())) if kind == "item")
+    first, = next(items)
+    channel = first.getparent()
+    second, = next(items)
+    # the first item is emptied and everything before it is dropped
+    assert len(first) == 0
+    assert channel.index(second) == 1
+
+
+@pytest.mark.parametrize(
+    "view_class, root",
+    [
+        pytest.param(MinidomItemView, lambda data: parseString(data).documentElement, id="minidom"),
+        pytest.param(LxmlItemView, lambda data: etree.fromstring(data), id="lxml"),
+    ],
+)
+def test_item_view(view_class, root):
+    item = view_class(root(
+        b"""<item xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:x="http://purl.org/dc/terms/">
+            <title>Post <!-- comment -->title</title>
+            <description><![CDATA[<p>html</p>]]></description>
+            <creator xmlns="http://purl.org/dc/elements/1.1/">Jane</creator>
+            <x:issued>2024-09-01T00:00:00Z</x:issued>
+            <category term="a"/>
+            <category>b</category>
+            <content><title>nested</title><category>nested</category></content>
+        </item>"""
+    ))
+    assert item.text("title") == "Post title"
+    assert item.text("description") == "<p>html</p>"
+    assert item.text("dc:creator") == "Jane"
+    assert item.text("dcterms:issued") == "2024-09-01T00:00:00Z"
+    assert item.text("x:issued") == "2024-09-01T00:00:00Z"
+    assert "pubDate" not in item
+    assert item.text("pubDate") == ""
+    assert [item.attribute(c, "term") or item.element_text(c) for c in item.all("category")] == ["a", "b"]
+
+
+def test_item_view_engine_must_implement_hooks():
+    class PartialItemView(ItemView):
+        @staticmethod
+        def iter_children(element):
+            return iter(element)
+
+    with pytest.raises(TypeError, match="abstract"):
+        PartialItemView(etree.fromstring(b"<item/>"))
+
+
+def test_parse_items_reads_direct_children_only():
+    item = LxmlItemView(etree.fromstring(
+        b"""<entry xmlns="http://www.w3.org/2005/Atom">
+            <content type="xhtml"><div><title>nested</title><updated>2020-01-01</updated></div></content>
+            <title>Entry</title>
+            <author><name>Jane</name><email>jane@example.com</email></author>
+            <updated>2024-09-01T08:00:00Z</updated>
+            <link rel="alternate" href="/post"/>
+        </entry>"""
+    ))
+    post = h4f.parse_atom_item("https://example.blog/", item)
+    assert post.title == "Entry"
+    assert post.author == "Jane"
+    assert post.pubdate == datetime(2024, 9, 1, 8, tzinfo=UTC)
+    assert post.link == "https://example.blog/post"
+
+
+@pytest.mark.parametrize(
+    ["children", "expected"],
+    [
+        pytest.param(
+            "<description>excerpt</description>",
+            ("excerpt", None, False),
+            id="description_only",
+        ),
+        pytest.param(
+            "<description>excerpt</description><content:encoded><![CDATA[<p>full post</p>]]></content:encoded>",
+            ("<p>full post</p>", "text/html", True),
+            id="content_encoded",
+        ),
+    ],
+)
+def test_parse_rss_description(children, expected):
+    item = LxmlItemView(etree.fromstring(
+        f'<item xmlns:content="http://purl.org/rss/1.0/modules/content/">{children}</item>'.encode()
+    ))
+    assert h4f.parse_rss_description(item) == expected
+
+
+@pytest.mark.parametrize(
+    ["children", "expected"],
+    [
+        pytest.param(
+            "<summary>excerpt</summary>",
+            ("excerpt", None, False),
+            id="summary_only",
+        ),
+        pytest.param(
+            '<summary>excerpt</summary><content type="html">&lt;p&gt;full post&lt;/p&gt;</content>',
+            ("<p>full post</p>", "text/html", True),
+            id="html_content",
+        ),
+        pytest.param(
+            "<content>full post</content>",
+            ("full post", None, True),
+            id="text_content",
+        ),
+        pytest.param(
+            '<summary>excerpt</summary><content src="https://example.blog/post"/>',
+            ("excerpt", None, False),
+            id="out_of_line_content",
+        ),
+    ],
+)
+def test_parse_atom_description(children, expected):
+    item = LxmlItemView(etree.fromstring(
+        f'<entry xmlns="http://www.w3.org/2005/Atom">{children}</entry>'.encode()
+    ))
+    assert h4f.parse_atom_description(item) == expected
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        pytest.param(
+            '<content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">'
+            '<p>full <a href="/post">post</a> &amp; more</p><img src="/a.png"/></div></content>',
+            id="default_namespace",
+        ),
+        pytest.param(
+            '<content type="xhtml" xmlns:xhtml="http://www.w3.org/1999/xhtml"><xhtml:div>'
+            '<xhtml:p>full <xhtml:a href="/post">post</xhtml:a> &amp; more</xhtml:p><xhtml:img src="/a.png"/></xhtml:div></content>',
+            id="prefixed",
+        ),
+    ],
+)
+def test_parse_atom_description_xhtml(content):
+    item = LxmlItemView(etree.fromstring(
+        f'<entry xmlns="http://www.w3.org/2005/Atom"><summary>excerpt</summary>{content}</entry>'.encode()
+    ))
+    assert h4f.parse_atom_description(item) == (
+        '<p>full <a href="/post">post</a> &amp; more</p><img src="/a.png"/>',
+        "application/xhtml+xml",
+        True,
+    )
+
+
+def test_parse_atom_description_xhtml_minidom():
+    document = parseString(
+        b'<entry xmlns="http://www.w3.org/2005/Atom"><content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">'
+        b'<p>full <a href="/post">post</a></p></div></content></entry>'
+    )
+    item = MinidomItemView(document.documentElement)
+    assert h4f.parse_atom_description(item) == (
+        '<p>full <a href="/post">post</a></p>',
+        "application/xhtml+xml",
+        True,
+    )
+
+
+@pytest.mark.parametrize(
+    ["description", "expected"],
+    [
+        pytest.param("", False, id="empty"),
+        pytest.param("<p>" + "word " * 10 + "</p>", False, id="short"),
+        pytest.param("<p>" + "word " * 100 + "</p>", True, id="long"),
+        pytest.param("<p>" + "word " * 100 + "[&#8230;]</p>", False, id="ellipsis"),
+        pytest.param("<p>" + "word " * 100 + '<a href="/post">Continue reading &rarr;</a></p>', False, id="continue_reading"),
+        pytest.param("word " * 100, True, id="plain_text"),
+    ],
+)
+def test_looks_complete(settings, description, expected):
+    settings.HISTORY4FEED_SETTINGS = dict(FEED_CONTENT_MIN_LENGTH=300)
+    assert h4f.looks_complete(description) == expected
@@ -0,0 +1,79 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+from history4feed.h4fscripts import http_client
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    http_client.close_sessions()
+    yield
+    http_client.close_sessions()
+
+
+def test_get_session_is_reused():
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+    assert session.max_redirects == http_client.MAX_REDIRECTS
+    assert http_client.get_session("other") is not session
+
+
+def test_get_session_pool_settings(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(HTTP_POOL_CONNECTIONS=7, HTTP_POOL_MAXSIZE=3)
+    adapter = http_client.get_session().get_adapter("https://example.com/")
+    assert adapter._pool_connections == 7
+    assert adapter._pool_maxsize == 3
+
+
+def test_get_session_recreated_when_idle(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(HTTP_POOL_IDLE_TIMEOUT_SECONDS=10)
+    with patch("history4feed.h4fscripts.http_client.time.monotonic", side_effect=[100, 105, 120]):
+        session = http_client.get_session()
+        assert http_client.get_session() is session, "not idle yet"
+        assert http_client.get_session() is not session, "idle for 15 seconds"
+
+
+def test_get_session_not_shared_across_processes():
+    session = http_client.get_session()
+    with patch("history4feed.h4fscripts.http_client.os.getpid", return_value=-1):
+        child_session = http_client.get_session()
+        assert child_session is not session
+        assert http_client.get_session() is child_session
+
+
+def test_get_session_per_thread():
+    threads = 4
+    barrier = threading.Barrier(threads)
+
+    def get_sessions(_):
+        # every thread of the pool is running at the same time
+        barrier.wait(timeout=10)
+        session = http_client.get_session()
+        assert http_client.get_session() is session
+        return session
+
+    with ThreadPoolExecutor(threads) as pool:
+        sessions = list(pool.map(get_sessions, range(threads)))
+    assert len({id(session) for session in sessions}) == threads
+    assert http_client.get_session() not in sessions
+
+
+def test_close_sessions_closes_every_thread():
+    with ThreadPoolExecutor(1) as pool:
+        session = pool.submit(http_client.get_session).result()
+        with patch.object(session, "close", wraps=session.close) as mock_close:
+            http_client.close_sessions()
+        mock_close.assert_called_once()
+        assert pool.submit(http_client.get_session).result() is not session
+
+
+def test_user_agent_loaded_once():
+    http_client._user_agents.clear()
+    with patch("history4feed.h4fscripts.http_client.fake_useragent.UserAgent") as mock_ua:
+        mock_ua.return_value.random = "test-agent"
+        assert http_client.random_user_agent() == "test-agent"
+        assert http_client.random_user_agent() == "test-agent"
+        mock_ua.assert_called_once()
+    http_client._user_agents.clear()
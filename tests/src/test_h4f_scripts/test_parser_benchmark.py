@@ -0,0 +1,36 @@
+import pytest
+
+from history4feed.h4fscripts import h4f
+from tests.benchmarks.parser_benchmark import (
+    BASE_URL,
+    Result,
+    compare,
+    generate_atom,
+    generate_rss,
+    parse,
+)
+
+
+@pytest.mark.parametrize("generate", [generate_rss, generate_atom])
+def test_generated_feeds_parse_the_same_with_both_engines(generate):
+    data = generate(10)
+    assert parse("lxml", data) == parse("minidom", data) == 10
+    assert list(h4f.FeedReader(data, BASE_URL)) == list(h4f.parse_feed_minidom(data, BASE_URL).posts)
+
+
+def test_compare():
+    baseline = {
+        "rss-10/lxml": dict(items_per_second=1000, peak_mib=10),
+        "rss-10/minidom": dict(items_per_second=1000, peak_mib=0.5),
+    }
+    results = [
+        Result("rss-10", "lxml", 10, 0.01, 850, 11),
+        Result("rss-10", "minidom", 10, 0.01, 700, 3),
+        # not in the baseline
+        Result("rss-1000", "lxml", 1000, 1, 1, 100),
+    ]
+    assert compare(results, baseline) == [
+        "rss-10/minidom: 700 items/s, baseline 1,000 items/s",
+        "rss-10/minidom: 3.0 MiB peak, baseline 0.5 MiB",
+    ]
+    assert len(compare(results, baseline, threshold=0.05)) == 3
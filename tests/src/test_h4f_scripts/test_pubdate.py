@@ -0,0 +1,93 @@
+from datetime import UTC, datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from dateutil.parser import ParserError, parse as parse_date
+
+from history4feed.h4fscripts import pubdate
+from history4feed.h4fscripts.pubdate import (
+    PublishDateResolver,
+    parse_iso8601,
+    parse_rfc822,
+    to_utc,
+)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Sun, 01 Sep 2024 08:00:00 +0000",
+        "Sun, 01 Sep 2024 08:00:00 GMT",
+        "Sun,01 Sep 2024 08:00:00 -0530",
+        "1 Sep 2024 08:00 +0100",
+        "01 sep 2024 08:00:00",
+        "Tue, 10 Jun 2003 04:00:00 UT",
+    ],
+)
+def test_parse_rfc822_matches_dateutil(text):
+    assert to_utc(parse_rfc822(text)) == to_utc(parse_date(text))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "2024-09-01",
+        "2024-09-01T08:00:00Z",
+        "2024-09-01T08:00:00+05:30",
+        "2024-09-01T08:00:00.123456-0200",
+        "2024-09-01 08:00",
+        "2024-09-01T08:00:00,5+01",
+    ],
+)
+def test_parse_iso8601_matches_dateutil(text):
+    assert to_utc(parse_iso8601(text)) == to_utc(parse_date(text))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Sun, 01 Sep 24 08:00:00 +0000",
+        "Sun, 01 Sept 2024 08:00:00 +0000",
+        "Sun, 01 Sep 2024 08:00:00 EST",
+        "31 Feb 2024 08:00:00 GMT",
+        "September 1, 2024",
+        "",
+    ],
+)
+def test_parse_rfc822_leaves_others_to_dateutil(text):
+    assert parse_rfc822(text) is None
+
+
+@pytest.mark.parametrize("text", ["2024-09-01 08:00 EST", "20240901", "2024-13-01", "1 Sep 2024"])
+def test_parse_iso8601_leaves_others_to_dateutil(text):
+    assert parse_iso8601(text) is None
+
+
+def test_resolver_picks_highest_priority_tag():
+    resolver = PublishDateResolver()
+    date = resolver.resolve({"updated": "2024-09-02T00:00:00Z", "published": "2024-09-01T00:00:00Z"})
+    assert date == datetime(2024, 9, 1, tzinfo=UTC)
+
+
+def test_resolver_learns_format_per_tag():
+    resolver = PublishDateResolver()
+    resolver.resolve({"updated": " 2024-09-01T00:00:00Z\n"})
+    assert resolver.formats == {"updated": "iso8601"}
+    mock_rfc822 = MagicMock()
+    with patch.dict(pubdate.FAST_PARSERS, rfc822=mock_rfc822):
+        assert resolver.resolve({"updated": "2024-09-02T00:00:00Z"}) == datetime(2024, 9, 2, tzinfo=UTC)
+    mock_rfc822.assert_not_called()
+
+
+def test_resolver_only_uses_dateutil_as_fallback():
+    resolver = PublishDateResolver()
+    with patch.object(pubdate, "parse_date", wraps=parse_date) as mock_parse_date:
+        assert resolver.resolve({"pubDate": "Sun, 01 Sep 2024 08:00:00 +0000"}) == datetime(2024, 9, 1, 8, tzinfo=UTC)
+        mock_parse_date.assert_not_called()
+        assert resolver.resolve({"pubDate": "September 1, 2024 8am"}) == datetime(2024, 9, 1, 8, tzinfo=UTC)
+        mock_parse_date.assert_called_once_with("September 1, 2024 8am")
+
+
+def test_resolver_without_date():
+    with pytest.raises(ParserError):
+        PublishDateResolver().resolve({})
@@ -0,0 +1,147 @@
+from unittest.mock import MagicMock, call, patch
+
+import pytest
+import redis
+from history4feed.h4fscripts import rate_limiter
+from history4feed.h4fscripts.deadline import MIN_REQUEST_SECONDS, Deadline
+from history4feed.h4fscripts.exceptions import DeadlineExceeded
+from history4feed.h4fscripts.rate_limiter import HostRateLimiter, LocalTokenBucket
+
+
+@pytest.fixture(autouse=True)
+def rate_limits(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(
+        HOST_RATE_LIMITS={
+            "web.archive.org": dict(rate=1, burst=2),
+            "default": dict(rate=10, burst=1),
+        }
+    )
+
+
+def test_local_token_bucket():
+    with patch("history4feed.h4fscripts.rate_limiter.time.monotonic", side_effect=[0, 0, 0, 0, 1.5]):
+        bucket = LocalTokenBucket(rate=2, burst=2)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0.5, "bucket is empty, next token in 0.5s"
+        assert bucket.reserve() == 0, "3 tokens refilled after 1.5s, minus the one already reserved"
+
+
+def test_local_token_bucket_hold():
+    with patch("history4feed.h4fscripts.rate_limiter.time.monotonic", side_effect=[0, 0, 0, 3, 10]):
+        bucket = LocalTokenBucket(rate=2, burst=2)
+        bucket.hold(5)
+        assert bucket.reserve() == 5, "nothing until the host is ready again"
+        assert bucket.reserve() == 2.5, "queued behind the first request"
+        assert bucket.reserve() == 0
+
+
+def test_limiter_hold_uses_redis_script():
+    client = MagicMock()
+    hold_script = MagicMock()
+    client.register_script.side_effect = lambda script: hold_script if script == rate_limiter.HOLD_SCRIPT else MagicMock()
+    limiter = HostRateLimiter(client)
+    limiter.hold("web.archive.org", 30)
+    hold_script.assert_called_once_with(keys=["h4f-ratelimit:web.archive.org"], args=[1, 2, 30])
+    assert limiter.local_buckets == {}
+
+
+def test_limiter_hold_falls_back_to_local_bucket():
+    client = MagicMock()
+    client.register_script.return_value.side_effect = redis.ConnectionError("down")
+    limiter = HostRateLimiter(client)
+    limiter.hold("example.com", 1)
+    assert limiter.local_buckets["example.com"].tokens == pytest.approx(-9)
+
+
+def test_limiter_uses_host_limits():
+    limiter = HostRateLimiter()
+    assert limiter.get_limit("web.archive.org") == (1, 2)
+    assert limiter.get_limit("example.com") == (10, 1)
+    limiter.reserve("web.archive.org")
+    limiter.reserve("example.com")
+    assert limiter.local_buckets["web.archive.org"].rate == 1
+    assert limiter.local_buckets["example.com"].rate == 10
+
+
+def test_limiter_uses_redis_script():
+    client = MagicMock()
+    client.register_script.return_value.return_value = b"0.25"
+    limiter = HostRateLimiter(client)
+    assert client.register_script.call_args_list == [
+        call(rate_limiter.TOKEN_BUCKET_SCRIPT),
+        call(rate_limiter.HOLD_SCRIPT),
+    ]
+    assert limiter.reserve("web.archive.org") == 0.25
+    client.register_script.return_value.assert_called_once_with(
+        keys=["h4f-ratelimit:web.archive.org"], args=[1, 2]
+    )
+    assert limiter.local_buckets == {}
+
+
+def test_limiter_falls_back_to_local_bucket():
+    client = MagicMock()
+    client.register_script.return_value.side_effect = redis.ConnectionError("down")
+    limiter = HostRateLimiter(client)
+    assert limiter.reserve("web.archive.org") == 0
+    assert "web.archive.org" in limiter.local_buckets
+
+
+def test_wait_sleeps_for_reserved_time():
+    limiter = HostRateLimiter()
+    with (
+        patch.object(limiter, "reserve", side_effect=[0, 0.3]) as mock_reserve,
+        patch("history4feed.h4fscripts.rate_limiter.time.sleep") as mock_sleep,
+    ):
+        limiter.wait("https://web.archive.org/web/2024/https://example.com/")
+        mock_sleep.assert_not_called()
+        limiter.wait("https://web.archive.org/cdx/search/cdx")
+        mock_sleep.assert_called_once_with(0.3)
+        mock_reserve.assert_called_with("web.archive.org", None)
+
+
+def test_local_token_bucket_max_wait():
+    with patch("history4feed.h4fscripts.rate_limiter.time.monotonic", return_value=0):
+        bucket = LocalTokenBucket(rate=1, burst=1)
+        assert bucket.reserve(max_wait=0) == 0
+        assert bucket.reserve(max_wait=0.5) is None, "next token is in 1s"
+        assert bucket.reserve(max_wait=0.5) is None
+        assert bucket.reserve() == 1, "refused reservations did not take a token"
+
+
+def test_limiter_redis_script_max_wait():
+    client = MagicMock()
+    client.register_script.return_value.return_value = b"skip"
+    limiter = HostRateLimiter(client)
+    assert limiter.reserve("web.archive.org", max_wait=2.5) is None
+    client.register_script.return_value.assert_called_once_with(
+        keys=["h4f-ratelimit:web.archive.org"], args=[1, 2, 2.5]
+    )
+
+
+def test_wait_past_deadline():
+    limiter = HostRateLimiter()
+    deadline = Deadline(10)
+    with (
+        patch.object(limiter, "reserve", return_value=None) as mock_reserve,
+        patch("history4feed.h4fscripts.rate_limiter.time.sleep") as mock_sleep,
+    ):
+        with pytest.raises(DeadlineExceeded, match="rate limit of web.archive.org"):
+            limiter.wait("https://web.archive.org/cdx/search/cdx", deadline)
+    mock_sleep.assert_not_called()
+    host, max_wait = mock_reserve.call_args[0]
+    assert max_wait == pytest.approx(10 - MIN_REQUEST_SECONDS, abs=1)
+
+
+@pytest.mark.parametrize(
+    ["rate_limit_url", "broker_url", "expected"],
+    [
+        (None, "memory://", None),
+        (None, "redis://redis:6379/0", "redis://redis:6379/0"),
+        ("redis://other:6379/3", "redis://redis:6379/0", "redis://other:6379/3"),
+    ],
+)
+def test_get_redis_url(settings, rate_limit_url, broker_url, expected):
+    settings.HISTORY4FEED_SETTINGS = dict(RATE_LIMIT_REDIS_URL=rate_limit_url)
+    settings.CELERY_BROKER_URL = broker_url
+    assert rate_limiter.get_redis_url() == expected
@@ -0,0 +1,54 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import redis
+from history4feed.h4fscripts import routing
+from history4feed.h4fscripts.routing import HostRouter
+
+
+@pytest.fixture(autouse=True)
+def route_ttl(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(SCRAPFLY_ROUTE_TTL_SECONDS=60)
+
+
+def test_local_router_expires():
+    router = HostRouter()
+    with patch("history4feed.h4fscripts.routing.time.monotonic", side_effect=[0, 30, 61]):
+        router.remember("example.com", routing.SCRAPFLY)
+        assert router.get("example.com") == routing.SCRAPFLY
+        assert router.get("example.com") is None
+    assert router.get("other.com") is None
+
+
+def test_router_uses_redis():
+    client = MagicMock()
+    client.get.return_value = b"scrapfly_asp"
+    router = HostRouter(client)
+    router.remember("example.com", routing.SCRAPFLY_ASP)
+    client.set.assert_called_once_with("h4f-route:example.com", "scrapfly_asp", ex=60)
+    assert router.get("example.com") == routing.SCRAPFLY_ASP
+    client.get.assert_called_once_with("h4f-route:example.com")
+    assert router.local_routes == {}
+
+
+def test_router_ignores_unknown_route():
+    client = MagicMock()
+    client.get.return_value = b"something-else"
+    assert HostRouter(client).get("example.com") is None
+
+
+def test_router_falls_back_to_local_memory():
+    client = MagicMock()
+    client.set.side_effect = redis.ConnectionError("down")
+    client.get.side_effect = redis.ConnectionError("down")
+    router = HostRouter(client)
+    router.remember("example.com", routing.DIRECT)
+    assert router.get("example.com") == routing.DIRECT
+
+
+def test_always_routing_uses_scrapfly(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(SCRAPFLY_ROUTING="always")
+    with patch("history4feed.h4fscripts.routing.get_router") as mock_get_router:
+        assert routing.get_route("example.com") == routing.SCRAPFLY
+        routing.remember("example.com", routing.DIRECT)
+    mock_get_router.assert_not_called()
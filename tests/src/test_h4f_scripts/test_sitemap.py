@@ -1,12 +1,23 @@
 import pytest
 from unittest.mock import patch, MagicMock
 from datetime import datetime, timedelta, timezone
+from history4feed.h4fscripts.exceptions import DeadlineExceeded
 from history4feed.h4fscripts.sitemap_helpers import (
+    SERPER_PAGE_SIZE,
+    SearchWindow,
+    SerperCredits,
     fetch_posts_links_with_serper,
     SearchIndexError,
+    covered_days,
+    split_window,
 )
 
 
+@pytest.fixture(autouse=True)
+def serper_settings(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(HOST_RATE_LIMITS={"default": dict(rate=1000, burst=1000)})
+
+
 @pytest.fixture
 def mock_response():
     def _make_response(organic_items, credits=1):
@@ -66,7 +77,8 @@ def test_fetch_posts_links_multiple_pages(mock_get, mock_response):
     result = fetch_posts_links_with_serper("x.com", from_time, to_time, delta_days=3)
 
     assert len(result) == 2
-    assert ["https://x1.com/1", "https://x2.com/2"] == list(result)
+    # both windows are searched at once, either one can get either response
+    assert ["https://x1.com/1", "https://x2.com/2"] == sorted(result)
 
 
 @patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get")
@@ -98,3 +110,156 @@ def test_fetch_posts_raises_on_error_status(mock_get):
         fetch_posts_links_with_serper("fail.com", from_time)
 
     assert "403" in str(exc.value)
+
+
+def fake_serper(posts_per_day: dict):
+    """
+    serper answering from `posts_per_day` (date -> number of posts), `after:` and `before:` both exclude their day
+    """
+    queries = []
+
+    def get(url, params, **kwargs):
+        queries.append(params)
+        _, after, before = params["q"].split()
+        after, before = (datetime.fromisoformat(part.split(":")[1]).date() for part in (after, before))
+        organic = [
+            {"title": f"{day} {i}", "link": f"https://busy.com/{day}/{i}", "date": day.strftime("%b %d, %Y")}
+            for day, count in sorted(posts_per_day.items())
+            if after < day < before
+            for i in range(count)
+        ]
+        start = (params["page"] - 1) * params["num"]
+        response = MagicMock(ok=True)
+        response.json.return_value = {"organic": organic[start:start + params["num"]], "credits": 1}
+        return response
+
+    return get, queries
+
+
+def window_days(window):
+    return {window.after + timedelta(days=i) for i in range(1, covered_days(window) + 1)}
+
+
+@pytest.mark.parametrize("days", [3, 4, 5, 10, 101])
+def test_split_window(days):
+    window = SearchWindow(datetime(2024, 1, 1).date(), datetime(2024, 1, 1).date() + timedelta(days=days), 1)
+    left, right = split_window(window)
+    assert window_days(left) | window_days(right) == window_days(window)
+    assert not window_days(left) & window_days(right), "no day is searched twice"
+    assert 0 < covered_days(left) < covered_days(window) and 0 < covered_days(right) < covered_days(window)
+
+
+def test_split_window_ends():
+    window = SearchWindow(datetime(2024, 1, 1).date(), datetime(2024, 1, 1).date() + timedelta(days=4), 1)
+    windows, single_days = [window], []
+    for _ in range(10):
+        if not windows:
+            break
+        window = windows.pop()
+        if halves := split_window(window):
+            windows.extend(halves)
+        else:
+            single_days.append(window)
+    assert not windows, "bisection stops"
+    assert all(covered_days(window) == 1 for window in single_days)
+    assert sorted(single_days) == [
+        SearchWindow(datetime(2024, 1, i).date(), datetime(2024, 1, i + 2).date(), 1) for i in (1, 2, 3)
+    ]
+
+
+def test_busy_windows_are_split():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    posts_per_day = {(start + timedelta(days=i)).date(): 30 for i in range(20)}
+    # a single day with more posts than a page
+    posts_per_day[(start + timedelta(days=25)).date()] = SERPER_PAGE_SIZE + 10
+    get, queries = fake_serper(posts_per_day)
+    with patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get):
+        result = fetch_posts_links_with_serper("busy.com", start, start + timedelta(days=40))
+    assert len(result) == sum(posts_per_day.values())
+    assert any(params["page"] == 2 for params in queries), "a full day is paged"
+
+
+def test_quiet_windows_are_merged():
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    posts_per_day = {(start + timedelta(days=i * 50)).date(): 1 for i in range(40)}
+    get, queries = fake_serper(posts_per_day)
+    with patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get):
+        result = fetch_posts_links_with_serper("quiet.com", start, start + timedelta(days=2000), delta_days=10)
+    assert len(result) == 40
+    assert len(queries) < 200 / 4, "windows grow past `delta_days` on quiet ranges"
+
+
+def test_credit_budget():
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    posts_per_day = {(start + timedelta(days=i)).date(): 1 for i in range(2000)}
+    get, queries = fake_serper(posts_per_day)
+    credits = SerperCredits(budget=5)
+    with patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get):
+        result = fetch_posts_links_with_serper("x.com", start, start + timedelta(days=2000), credits=credits)
+    assert len(queries) == credits.used == 5
+    assert credits.exhausted
+    assert 0 < len(result) < 2000
+    assert credits.to_json() == dict(budget=5, used=5, exhausted=True)
+    # every day up to `searched_until` was searched, none of the posts after it were all found
+    assert start.date() <= credits.searched_until < (start + timedelta(days=2000)).date()
+    found_days = {post.pubdate.date() for post in result.values()}
+    assert {(start + timedelta(days=i)).date() for i in range((credits.searched_until - start.date()).days + 1)} <= found_days
+
+
+def test_credit_budget__queued_windows():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    # the first window is full and split, the budget runs out before its halves are searched
+    posts_per_day = {(start + timedelta(days=i)).date(): 30 for i in range(10)}
+    get, queries = fake_serper(posts_per_day)
+    credits = SerperCredits(budget=1)
+    with patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get):
+        fetch_posts_links_with_serper("busy.com", start, start + timedelta(days=40), credits=credits)
+    assert len(queries) == 1
+    assert credits.searched_until == (start - timedelta(days=1)).date()
+
+
+def test_credits_reserve():
+    credits = SerperCredits(budget=5)
+    assert credits.reserve() == 1
+    credits.spend(1, 3)
+    assert credits.reserve() is None
+    assert credits.exhausted
+    assert credits.reserved == 0
+
+
+def test_search_stops_at_deadline():
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    get, queries = fake_serper({start.date(): 1})
+    credits = SerperCredits(budget=None)
+    with (
+        patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get),
+        patch("history4feed.h4fscripts.sitemap_helpers.rate_limiter.wait", side_effect=DeadlineExceeded("deadline")),
+    ):
+        result = fetch_posts_links_with_serper("x.com", start, start + timedelta(days=100), credits=credits, deadline=MagicMock())
+    assert result == {}
+    assert queries == []
+    assert credits.searched_until == (start - timedelta(days=1)).date()
+    assert credits.used == credits.reserved == 0
+
+
+def test_search_stops_at_failed_window():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    posts_per_day = {(start + timedelta(days=i)).date(): 1 for i in range(40)}
+    serper_get, queries = fake_serper(posts_per_day)
+    failed_after = (start + timedelta(days=10)).date()
+
+    def get(url, params, **kwargs):
+        _, after, _ = params["q"].split()
+        if datetime.fromisoformat(after.split(":")[1]).date() >= failed_after:
+            raise KeyError("organic")
+        return serper_get(url, params, **kwargs)
+
+    credits = SerperCredits(budget=None)
+    with patch("history4feed.h4fscripts.sitemap_helpers.requests.Session.get", side_effect=get):
+        result = fetch_posts_links_with_serper("x.com", start, start + timedelta(days=40), delta_days=5, credits=credits)
+    assert result, "posts of the windows searched before the failure are kept"
+    assert credits.searched_until is not None
+    assert credits.searched_until < (start + timedelta(days=40)).date()
+    found_days = {post.pubdate.date() for post in result.values()}
+    assert {(start + timedelta(days=i)).date() for i in range((credits.searched_until - start.date()).days + 1)} <= found_days
+    assert credits.used == len(queries) and credits.reserved == 0
@@ -0,0 +1,108 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from history4feed.h4fscripts.snapshot_planner import Coverage, SnapshotPlanner
+
+
+START = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+def simulate(captures, pubdates, items_per_capture=10, fail=()):
+    """
+    reads captures of a feed that shows its last `items_per_capture` posts, as the planner picks them
+    """
+    planner = SnapshotPlanner(captures)
+    seen = set()
+    for index in planner:
+        if index in fail:
+            planner.record(index, None)
+            continue
+        items = [p for p in pubdates if p <= captures[index]][-items_per_capture:]
+        seen.update(items)
+        planner.record(index, Coverage.from_pubdates(items))
+    return planner, seen
+
+
+def read_all(captures, pubdates, items_per_capture=10, fail=()):
+    seen = set()
+    for index, capture in enumerate(captures):
+        if index not in fail:
+            seen.update([p for p in pubdates if p <= capture][-items_per_capture:])
+    return seen
+
+
+def test_coverage_from_pubdates():
+    assert Coverage.from_pubdates([None]) is None
+    assert Coverage.from_pubdates([START + timedelta(days=1), START, None]) == Coverage(2, START, START + timedelta(days=1))
+
+
+def test_planner_skips_overlapping_captures():
+    # a post a day, a capture every 6 hours
+    pubdates = [START + timedelta(days=i) for i in range(120)]
+    captures = [START + timedelta(days=15, hours=6 * i) for i in range(300)]
+    planner, seen = simulate(captures, pubdates)
+    assert seen == read_all(captures, pubdates)
+    assert len(planner.read) < len(captures) / 10
+    # the first and last captures are always read
+    assert planner.read[0] == 0 and planner.read[-1] == len(captures) - 1
+    assert sorted(planner.read + planner.skipped()) == list(range(len(captures)))
+
+
+def test_planner_fills_gaps():
+    # quiet for a month, then 30 posts in three days
+    pubdates = [START + timedelta(days=i) for i in range(40)]
+    pubdates += [START + timedelta(days=40, hours=2.4 * i) for i in range(30)]
+    pubdates += [START + timedelta(days=43 + i) for i in range(30)]
+    captures = [START + timedelta(days=12, hours=6 * i) for i in range(230)]
+    planner, seen = simulate(captures, pubdates)
+    assert seen == read_all(captures, pubdates)
+    assert len(planner.read) < len(captures) / 3
+
+
+@pytest.mark.parametrize("fail", [{1}, {0, 5, 6}])
+def test_planner_reads_around_failed_captures(fail):
+    pubdates = [START + timedelta(days=i) for i in range(60)]
+    captures = [START + timedelta(days=15, hours=6 * i) for i in range(120)]
+    planner, seen = simulate(captures, pubdates, fail=fail)
+    assert seen == read_all(captures, pubdates, fail=fail)
+
+
+@pytest.mark.parametrize("size", [2, 10])
+def test_planner_batches(size):
+    pubdates = [START + timedelta(days=i) for i in range(40)]
+    pubdates += [START + timedelta(days=40, hours=2.4 * i) for i in range(30)]
+    pubdates += [START + timedelta(days=43 + i) for i in range(30)]
+    captures = [START + timedelta(days=12, hours=6 * i) for i in range(230)]
+    planner = SnapshotPlanner(captures)
+    seen = set()
+    rounds = 0
+    while batch := planner.next_batch(size):
+        assert len(batch) <= size
+        rounds += 1
+        for index in batch:
+            items = [p for p in pubdates if p <= captures[index]][-10:]
+            seen.update(items)
+            planner.record(index, Coverage.from_pubdates(items))
+    assert seen == read_all(captures, pubdates)
+    assert planner.read[-1] == len(captures) - 1
+    assert rounds < len(planner.read)
+
+
+def test_coverage_json():
+    coverage = Coverage(2, START, START + timedelta(days=1))
+    assert Coverage.from_json(coverage.to_json()) == coverage
+    assert Coverage.from_json(None) is None
+
+
+def test_planner_without_coverage_reads_everything():
+    captures = [START + timedelta(hours=i) for i in range(20)]
+    planner = SnapshotPlanner(captures)
+    for index in planner:
+        planner.record(index, None)
+    assert planner.read == list(range(20))
+    assert planner.skipped() == []
+
+
+def test_planner_empty():
+    assert list(SnapshotPlanner([])) == []
@@ -0,0 +1,107 @@
+import os
+import zstandard
+import pytest
+from history4feed.h4fscripts import snapshot_store
+from history4feed.h4fscripts.snapshot_store import SnapshotStore, content_digest
+
+SNAPSHOT_URL = "https://web.archive.org/web/20240901000000id_/https://example.com/feed.xml"
+
+
+def make_feed(n):
+    items = "".join(
+        f"<item><title>Post {i}</title><link>https://example.com/{i}</link><description>some description of post {i}</description></item>"
+        for i in range(n, n + 20)
+    )
+    return f"<rss><channel><title>Example</title>{items}</channel></rss>".encode()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(tmp_path, max_bytes=10 * 1024 * 1024, dict_samples=8, dict_size=4096)
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        (SNAPSHOT_URL, True),
+        ("https://web.archive.org/web/20240901000000/https://example.com/feed.xml", False),
+        ("https://example.com/feed.xml", False),
+    ],
+)
+def test_is_wayback_snapshot(url, expected):
+    assert snapshot_store.is_wayback_snapshot(url) == expected
+
+
+def test_put_and_get(store):
+    assert store.get(SNAPSHOT_URL) is None
+    store.put(SNAPSHOT_URL, b"<rss/>")
+    assert store.get(SNAPSHOT_URL) == b"<rss/>"
+    assert store.object_path(content_digest(b"<rss/>")).exists()
+
+
+def test_link_shares_object_between_captures(store):
+    other_url = SNAPSHOT_URL.replace("20240901000000", "20240905000000")
+    store.link(SNAPSHOT_URL, "DIGEST1")
+    store.link(other_url, "DIGEST1")
+    assert store.get(other_url) is None
+    store.put(SNAPSHOT_URL, b"<rss/>")
+    assert store.object_path("DIGEST1").exists()
+    assert store.get(other_url) == b"<rss/>", "same digest, so no need to download again"
+
+
+def test_trains_dictionary_per_feed(store):
+    due = [store.put(SNAPSHOT_URL.replace("20240901", f"202409{i+10}"), make_feed(i)) for i in range(8)]
+    assert due == [False] * 7 + [True]
+    assert not store.feed_path(SNAPSHOT_URL, "id").exists(), "put never trains"
+    store.train_dict(SNAPSHOT_URL)
+    dict_id = int(store.feed_path(SNAPSHOT_URL, "id").read_text())
+    url = SNAPSHOT_URL.replace("20240901", "20241001")
+    store.put(url, make_feed(9))
+    blob = store.object_path(content_digest(make_feed(9))).read_bytes()
+    assert zstandard.get_frame_parameters(blob).dict_id == dict_id
+    assert store.get(url) == make_feed(9)
+    store.dicts.clear()
+    assert store.get(url) == make_feed(9), "dictionary is loaded back from disk"
+    assert store.get(SNAPSHOT_URL.replace("20240901", "20240910")) == make_feed(0), "objects written before training still readable"
+
+
+def test_evicts_least_recently_used(store):
+    urls = [SNAPSHOT_URL.replace("20240901", f"202409{i+10}") for i in range(3)]
+    for i, url in enumerate(urls):
+        store.put(url, os.urandom(1000))
+        os.utime(store.object_path(store.ref_path(url).read_text()), (i, i))
+    store.get(urls[0])
+    store.max_bytes = 2500
+    store.put(SNAPSHOT_URL, os.urandom(1000))
+    assert store.get(urls[0]) is not None
+    assert store.get(urls[1]) is None
+    assert store.size <= 2500
+
+
+def test_get_store(settings, tmp_path):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_STORE_DIR=None)
+    assert snapshot_store.get_store() is None
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_STORE_DIR=str(tmp_path))
+    assert snapshot_store.get_store() is snapshot_store.get_store()
+    assert snapshot_store.get_store().root == tmp_path
+
+
+@pytest.mark.parametrize("damage", ["truncate", "garbage", "dictionary"])
+def test_get_drops_unreadable_object(store, damage):
+    for i in range(8):
+        store.put(SNAPSHOT_URL.replace("20240901", f"202409{i+10}"), make_feed(i))
+    store.train_dict(SNAPSHOT_URL)
+    store.put(SNAPSHOT_URL, make_feed(9))
+    path = store.object_path(content_digest(make_feed(9)))
+    match damage:
+        case "truncate":
+            path.write_bytes(path.read_bytes()[:20])
+        case "garbage":
+            path.write_bytes(b"not zstd")
+        case "dictionary":
+            store.dicts.clear()
+            for dict_path in (store.root / "dicts").glob("*.dict"):
+                dict_path.unlink()
+    assert store.get(SNAPSHOT_URL) is None
+    assert not path.exists()
+    assert not store.ref_path(SNAPSHOT_URL).exists()
@@ -1,27 +1,39 @@
-from unittest.mock import MagicMock, patch, call
+from unittest.mock import ANY, MagicMock, patch, call
 
 import celery
 import celery.canvas
 import pytest
 from history4feed.app import models
 from history4feed.app.models import Feed, FeedType, FullTextState, FulltextJob, Job, Post
-from history4feed.h4fscripts import exceptions
+from history4feed.h4fscripts import exceptions, h4f, snapshot_store
 from history4feed.h4fscripts.h4f import PostDict
+from history4feed.h4fscripts.snapshot_planner import Coverage
+from history4feed.h4fscripts.wayback_helpers import CDXPage, CDXSearchResult
 from history4feed.h4fscripts.task_helper import (
     JobCancelled,
     add_post_to_db,
+    collect_and_schedule_removal,
     create_fulltexts_task_chain,
+    merge_snapshot_results,
     new_job,
     new_patch_posts_job,
     retrieve_full_text,
+    retrieve_full_texts,
     retrieve_posts_from_links,
     retrieve_posts_from_serper,
+    retrieve_posts_from_snapshot,
     retrieve_posts_from_url,
+    fetch_feed_page,
+    save_fulltext_jobs,
     start_job,
     start_post_job,
+    update_cdx_watermark,
 )
+from celery.exceptions import Retry, SoftTimeLimitExceeded
 from rest_framework.exceptions import APIException, Throttled
-from datetime import UTC, datetime as dt
+from django.db import DataError
+import re
+from datetime import UTC, datetime as dt, timedelta
 from .rss_data import atom_example
 
 
@@ -189,8 +201,8 @@ def test_new_patch_posts_job(feed_posts):
 
     with (
         patch(
-            "history4feed.h4fscripts.task_helper.retrieve_full_text.run"
-        ) as mock_retrieve_full_text,
+            "history4feed.h4fscripts.task_helper.retrieve_full_texts.run"
+        ) as mock_retrieve_full_texts,
         # patch("history4feed.h4fscripts.task_helper.start_post_job.run") as mock_start_post_job,
         patch(
             "history4feed.h4fscripts.task_helper.collect_and_schedule_removal.run"
@@ -207,9 +219,10 @@ def test_new_patch_posts_job(feed_posts):
         mock_queue_lock.assert_called_once_with(feed, job)
         # assert job.state == models.JobState.RUNNING
 
-        [
-            models.FulltextJob.objects.get(pk=call[0][0]).post.id
-            for call in mock_retrieve_full_text.call_args_list
+        mock_retrieve_full_texts.assert_called_once()
+        assert [
+            models.FulltextJob.objects.get(pk=pk).post.id
+            for pk in mock_retrieve_full_texts.call_args[0][1]
         ] == [post.id for post in posts]
 
         mock_collect_and_schedule_removal.assert_called_once_with(job.id)
@@ -279,13 +292,91 @@ def test_start_job__atom_or_rss():
         state=models.JobState.PENDING,
         extra_data={"use_feed_url_only": False},
     )
+    job_obj.feed.cdx_watermark = "20240101000000"
+    job_obj.feed.cdx_digests = {"AAA": "20240101000000"}
+    job_obj.feed.save()
+    snapshots = [
+        CDXSearchResult("com,example)/rss.xml", "20240102000000", "https://example.com/rss.xml", digest="BBB"),
+        CDXSearchResult("com,example)/rss.xml", "20240103000000", "https://example.com/rss.xml", digest="CCC"),
+    ]
     with patch(
-        "history4feed.h4fscripts.wayback_helpers.get_wayback_urls"
-    ) as mock_get_wayback_urls:
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        return_value=iter([CDXPage(snapshots)]),
+    ) as mock_iter_wayback_snapshots:
         result = start_job(job_obj.id)
-        assert result == mock_get_wayback_urls.return_value
+        assert result == [
+            "https://web.archive.org/web/20240102000000id_/https://example.com/rss.xml",
+            "https://web.archive.org/web/20240103000000id_/https://example.com/rss.xml",
+            "https://example.com/rss.xml",
+        ]
+        mock_iter_wayback_snapshots.assert_called_once_with(
+            job_obj.feed.url,
+            job_obj.earliest_item_requested,
+            job_obj.latest_item_requested,
+            deadline=ANY,
+            seen_digests={"AAA"},
+            resume_key=None,
+            since="20240101000000",
+        )
         job_obj.refresh_from_db()
         assert job_obj.state == models.JobState.RUNNING
+        assert job_obj.extra_data["cdx_digests"] == dict(zip(result, ["BBB", "CCC"]))
+        assert job_obj.extra_data["cdx_listing"] == dict(resume_key=None, pages=1, segments=1, segments_done=0)
+
+
+@pytest.mark.django_db
+def test_start_job__cdx_pages():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.PENDING,
+        extra_data={"use_feed_url_only": False},
+    )
+    snapshot = CDXSearchResult("com,example)/rss.xml", "20240102000000", "https://example.com/rss.xml", digest="BBB")
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        return_value=iter([CDXPage([], "key-1"), CDXPage([snapshot], "key-2"), CDXPage([], None)]),
+    ) as mock_iter_wayback_snapshots:
+        # pages without new captures are skipped, the listing stops at the first page with some
+        assert start_job(job_obj.id) == [
+            "https://web.archive.org/web/20240102000000id_/https://example.com/rss.xml",
+        ]
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["cdx_listing"] == dict(resume_key="key-2", pages=2, segments=1, segments_done=0)
+
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        return_value=iter([CDXPage([], None)]),
+    ) as mock_iter_wayback_snapshots:
+        assert start_job(job_obj.id) == [job_obj.feed.url]
+    assert mock_iter_wayback_snapshots.call_args[1]["resume_key"] == "key-2"
+    assert mock_iter_wayback_snapshots.call_args[1]["seen_digests"] == {"BBB"}
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["cdx_listing"] == dict(resume_key=None, pages=3, segments=1, segments_done=0)
+
+
+@pytest.mark.django_db
+def test_start_job__force_full_fetch_ignores_watermark():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+            cdx_watermark="20240101000000",
+            cdx_digests={"AAA": "20240101000000"},
+        ),
+        state=models.JobState.PENDING,
+        extra_data={"use_feed_url_only": False, "force_full_fetch": True},
+    )
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        return_value=iter([CDXPage([])]),
+    ) as mock_iter_wayback_snapshots:
+        assert start_job(job_obj.id) == [job_obj.feed.url]
+    assert mock_iter_wayback_snapshots.call_args[1] == dict(deadline=ANY, seen_digests=set(), resume_key=None)
 
 
 @pytest.mark.django_db
@@ -300,15 +391,62 @@ def test_start_job__atom_or_rss__use_feed_url_only():
         extra_data={"use_feed_url_only": True},
     )
     with patch(
-        "history4feed.h4fscripts.wayback_helpers.get_wayback_urls"
-    ) as mock_get_wayback_urls:
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots"
+    ) as mock_iter_wayback_snapshots:
         result = start_job(job_obj.id)
         assert result == [job_obj.feed.url]
-        mock_get_wayback_urls.assert_not_called()
+        mock_iter_wayback_snapshots.assert_not_called()
         job_obj.refresh_from_db()
         assert job_obj.state == models.JobState.RUNNING
 
 
+@pytest.mark.django_db
+def test_start_job__countdown_retry(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown", REQUEST_RETRY_COUNT=3)
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.PENDING,
+        extra_data={"use_feed_url_only": False},
+    )
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        side_effect=[ConnectionError("timeout"), iter([CDXPage([])])],
+    ) as mock_iter_wayback_snapshots:
+        result = start_job.delay(job_obj.id)
+        assert result.get() == ["https://example.com/rss.xml"]
+    assert mock_iter_wayback_snapshots.call_count == 2
+    assert mock_iter_wayback_snapshots.call_args[1] == dict(retry_count=0, deadline=ANY, since=None, seen_digests=set(), resume_key=None)
+    job_obj.refresh_from_db()
+    assert job_obj.state == models.JobState.RUNNING
+
+
+@pytest.mark.django_db
+def test_start_job__countdown_retry_exhausted(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown", REQUEST_RETRY_COUNT=2)
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.PENDING,
+        extra_data={"use_feed_url_only": False},
+    )
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        side_effect=ConnectionError("timeout"),
+    ) as mock_iter_wayback_snapshots:
+        assert start_job.delay(job_obj.id).get() == []
+    assert mock_iter_wayback_snapshots.call_count == 3
+    job_obj.refresh_from_db()
+    assert job_obj.state == models.JobState.FAILED
+    assert job_obj.info == "timeout"
+
+
 @pytest.mark.django_db
 def test_start_job__atom_or_rss__fails():
     job_obj = models.Job.objects.create(
@@ -320,15 +458,34 @@ def test_start_job__atom_or_rss__fails():
         state=models.JobState.PENDING,
     )
     with patch(
-        "history4feed.h4fscripts.wayback_helpers.get_wayback_urls",
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
         side_effect=Exception,
-    ) as mock_get_wayback_urls:
+    ) as mock_iter_wayback_snapshots:
         result = start_job(job_obj.id)
         assert result == []
         job_obj.refresh_from_db()
         assert job_obj.state == models.JobState.FAILED
 
 
+def run_snapshot_groups(urls, job_id):
+    """
+    runs `retrieve_posts_from_links` and the groups of snapshot tasks it fans out to,
+    returns the urls of each group and the task the last merge replaces itself with
+    """
+    groups = []
+    with patch.object(retrieve_posts_from_links, "replace") as mock_replace:
+        retrieve_posts_from_links.run(urls, job_id)
+    task = mock_replace.call_args[0][0]
+    while isinstance(task, celery.canvas._chord) and task.body.task == merge_snapshot_results.name:
+        assert len(task.body.args) == 2, "only the job id and offset go through the broker"
+        groups.append([header.args[0] for header in task.tasks])
+        results = [retrieve_posts_from_snapshot.run(*header.args) for header in task.tasks]
+        with patch.object(merge_snapshot_results, "replace") as mock_replace:
+            merge_snapshot_results.run(results, *task.body.args)
+        task = mock_replace.call_args[0][0]
+    return groups, task
+
+
 @pytest.mark.parametrize(
     "feed_type",
     [
@@ -338,72 +495,521 @@ def test_start_job__atom_or_rss__fails():
     ],
 )
 @pytest.mark.django_db
-def test_retrieve_posts_from_links(feed_type):
-    job_obj = models.Job.objects.create(
-        feed=Feed.objects.create(
-            url="https://example.com/rss.xml",
-            title="Test Feed",
-            feed_type=feed_type,
-        ),
-        state=models.JobState.PENDING,
-    )
+def test_retrieve_posts_from_links(feed_posts, feed_type):
+    feed, (p1, p2) = feed_posts
+    feed.feed_type = feed_type
+    feed.save()
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.PENDING)
+    urls = ["https://goo.gl", "http://example.com"]
     chains = [MagicMock(), MagicMock()]
     with (
         patch(
             "history4feed.h4fscripts.task_helper.retrieve_posts_from_serper",
-            return_value=MagicMock(),
+            side_effect=[([p1], None), ([p2], None)],
         ) as mock_retrieve_serp,
         patch(
             "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
-            return_value=[{}, MagicMock(), None],
+            side_effect=[[{}, [p1], None], [{}, [p2], None]],
         ) as mock_retrieve_rss,
         patch(
             "history4feed.h4fscripts.task_helper.create_fulltexts_task_chain",
             side_effect=chains,
         ) as mock_ft_chain,
-        patch("history4feed.h4fscripts.task_helper.celery.chord") as mock_chord,
-        patch.object(retrieve_posts_from_links, 'replace') as mock_replace,
+        patch("history4feed.h4fscripts.task_helper.celery.chord", wraps=celery.chord) as mock_chord,
     ):
-        retrieve_posts_from_links.run(
-            ["https://goo.gl", "http://example.com"], job_obj.id
+        groups, task = run_snapshot_groups(urls, job_obj.id)
+    assert groups == [urls]
+    job_obj.refresh_from_db()
+    assert job_obj.feed.freshness == job_obj.run_datetime
+    assert [d["state"] for d in job_obj.extra_data["feed_urls"]] == ["completed", "completed"]
+    if feed_type == models.FeedType.SEARCH_INDEX:
+        mock_retrieve_serp.assert_has_calls(
+            [call(ANY, ANY, "https://goo.gl"), call(ANY, ANY, "http://example.com")]
         )
-        job_obj.refresh_from_db()
-        assert job_obj.feed.freshness == job_obj.run_datetime
-        if job_obj.feed.feed_type == models.FeedType.SEARCH_INDEX:
-            mock_retrieve_serp.assert_has_calls(
-                [
-                    call(job_obj.feed, job_obj, "https://goo.gl"),
-                    call(job_obj.feed, job_obj, "http://example.com"),
-                ]
-            )
-            mock_ft_chain.call_count == 2
-            mock_ft_chain.assert_called_with(
-                job_obj.id, mock_retrieve_serp.return_value
-            )
-        else:
-            mock_retrieve_rss.assert_has_calls(
-                [
-                    call(
-                        "https://goo.gl",
-                        job_obj.feed,
-                        job_obj,
-                    ),
-                    call("http://example.com", job_obj.feed, job_obj),
-                ]
-            )
-            mock_ft_chain.call_count == 2
-            mock_ft_chain.assert_called_with(
-                job_obj.id, mock_retrieve_rss.return_value[1]
-            )
-        
-        mock_chord.assert_called_once()
-        args = mock_chord.call_args[0]
-        assert args[0] == chains
-        mock_replace.assert_called_once_with(mock_chord.return_value)
+    else:
+        mock_retrieve_rss.assert_has_calls(
+            [call("https://goo.gl", ANY, ANY), call("http://example.com", ANY, ANY)]
+        )
+    assert mock_ft_chain.call_args_list == [call(job_obj.id, [p1]), call(job_obj.id, [p2])]
+    assert mock_chord.call_args[0] == (chains, ANY)
+    assert task.body.task == collect_and_schedule_removal.name
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__partial_search(feed_posts):
+    feed, (p1, p2) = feed_posts
+    feed.feed_type = models.FeedType.SEARCH_INDEX
+    feed.save()
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.PENDING)
+    urls = [feed.url]
+    with (
+        patch(
+            "history4feed.h4fscripts.task_helper.retrieve_posts_from_serper",
+            return_value=([p1], dt(2021, 3, 4).date()),
+        ),
+        patch("history4feed.h4fscripts.task_helper.create_fulltexts_task_chain"),
+    ):
+        run_snapshot_groups(urls, job_obj.id)
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["feed_urls"][0]["state"] == "partial"
+    assert job_obj.extra_data["feed_urls"][0]["searched_until"] == "2021-03-04"
+    feed.refresh_from_db()
+    # the next job resumes the search from the first day not searched
+    assert feed.freshness == dt(2021, 3, 5, tzinfo=UTC)
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__groups(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_GROUP_SIZE=2)
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+    )
+    urls = [f"https://example.com/{i}" for i in range(5)]
+
+    def retrieve(url, *args):
+        return {"title": f"title of {url}", "description": ""}, [], None
+
+    with patch(
+        "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+        side_effect=retrieve,
+    ):
+        groups, task = run_snapshot_groups(urls, job_obj.id)
+    assert groups == [urls[:2], urls[2:4], urls[4:]]
+    assert task.task == collect_and_schedule_removal.name
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["snapshot_groups"] == {}, "state is removed once every url is read"
+    # the merge step keeps the title of the last url
+    assert job_obj.feed.title == "Test Feed"
+    job_obj.feed.title = ""
+    job_obj.feed.save()
+    with patch(
+        "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+        side_effect=retrieve,
+    ):
+        run_snapshot_groups(urls, job_obj.id)
+    job_obj.refresh_from_db()
+    assert job_obj.feed.title.startswith("title of https://example.com/4")
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__host_down():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+    )
+    urls = [
+        "https://web.archive.org/web/20240101id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240201id_/https://example.com/rss.xml",
+    ]
+    with patch(
+        "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+        return_value=[{}, [], exceptions.HostCircuitOpen("`web.archive.org` is down")],
+    ):
+        run_snapshot_groups(urls, job_obj.id)
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["hosts_down"] == {"web.archive.org": 2}
+    assert [d["host_down"] for d in job_obj.extra_data["feed_urls"]] == [True, True]
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_snapshot__countdown_retry(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown", REQUEST_RETRY_COUNT=3, WAYBACK_SLEEP_SECONDS=10)
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+        extra_data=dict(feed_urls=[dict(link="https://example.com/1", state="queued", posts_added=0)]),
+    )
+    with (
+        patch(
+            "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+            return_value=[{}, [], ConnectionError("timeout")],
+        ) as mock_retrieve,
+        patch.object(retrieve_posts_from_snapshot, "retry", side_effect=Retry) as mock_retry,
+        pytest.raises(Retry),
+    ):
+        retrieve_posts_from_snapshot.run("https://example.com/1", job_obj.id, 0)
+    mock_retrieve.assert_called_once_with("https://example.com/1", job_obj.feed, job_obj, retry=False)
+    mock_retry.assert_called_once_with(countdown=10, max_retries=3)
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["feed_urls"][0]["state"] == "retrying"
+
+    with patch(
+        "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+        side_effect=[[{}, [], ConnectionError("timeout")], [{}, [], None]],
+    ) as mock_retrieve:
+        result = retrieve_posts_from_snapshot.delay("https://example.com/1", job_obj.id, 0)
+    assert result.get() == dict(index=0, read=True, coverage=None)
+    assert mock_retrieve.call_count == 2
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["feed_urls"][0]["state"] == "completed"
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__full_text_from_feed(feed_posts):
+    feed, (p1, p2) = feed_posts
+    p1.is_full_text = True
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.RUNNING)
+    with (
+        patch(
+            "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+            return_value=[{}, [p1, p2], None],
+        ),
+        patch(
+            "history4feed.h4fscripts.task_helper.create_fulltexts_task_chain",
+        ) as mock_ft_chain,
+        patch("history4feed.h4fscripts.task_helper.celery.chord", wraps=celery.chord),
+    ):
+        run_snapshot_groups(["https://example.com/1"], job_obj.id)
+    mock_ft_chain.assert_called_once_with(job_obj.id, [p2])
+    ft_job = models.FulltextJob.objects.get(job_id=job_obj.id)
+    assert ft_job.post_id == p1.id
+    assert ft_job.status == FullTextState.RETRIEVED
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["feed_urls"][0]["posts_added"] == 2
+    assert job_obj.extra_data["feed_urls"][0]["full_text_from_feed"] == 1
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_snapshot__countdown_retry_cancelled(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown")
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.CANCELLED,
+        extra_data=dict(feed_urls=[dict(link="https://example.com/1", state="retrying", posts_added=0)]),
+    )
+    with patch("history4feed.h4fscripts.task_helper.retrieve_posts_from_url") as mock_retrieve:
+        result = retrieve_posts_from_snapshot.run("https://example.com/1", job_obj.id, 0)
+    assert result == dict(index=0)
+    mock_retrieve.assert_not_called()
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["feed_urls"][0]["state"] == "failed"
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__cancelled():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.CANCELLED,
+    )
+    with patch("history4feed.h4fscripts.task_helper.retrieve_posts_from_url") as mock_retrieve:
+        groups, task = run_snapshot_groups(["https://example.com/1"], job_obj.id)
+    assert groups == []
+    mock_retrieve.assert_not_called()
+    assert task.task == collect_and_schedule_removal.name
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__next_cdx_page():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+        extra_data=dict(
+            feed_urls=[dict(link="https://example.com/1", state="completed", posts_added=0)],
+            cdx_listing=dict(resume_key="key", pages=2, segments=1, segments_done=0),
+        ),
+    )
+    with (
+        patch(
+            "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+            return_value=[{}, [], None],
+        ) as mock_retrieve,
+        patch("history4feed.h4fscripts.task_helper.apply_job_chain") as mock_apply_job_chain,
+    ):
+        groups, task = run_snapshot_groups(["https://example.com/2"], job_obj.id)
+    mock_retrieve.assert_called_once_with("https://example.com/2", job_obj.feed, job_obj)
+    mock_apply_job_chain.assert_called_once_with(job_obj.id)
+    assert task.task == collect_and_schedule_removal.name
+    job_obj.refresh_from_db()
+    assert [d["link"] for d in job_obj.extra_data["feed_urls"]] == ["https://example.com/1", "https://example.com/2"]
+    assert [d["state"] for d in job_obj.extra_data["feed_urls"]] == ["completed", "completed"]
+    assert job_obj.extra_data["cdx_listing"]["segments"] == 2
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_links__planned_snapshots(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_GROUP_SIZE=2)
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+    )
+    urls = [
+        f"https://web.archive.org/web/202401{day:02}000000id_/https://example.com/rss.xml"
+        for day in range(1, 11)
+    ] + ["https://example.com/rss.xml"]
+
+    def retrieve(url, *args):
+        # every capture shows the posts of the 5 days before it
+        if match := re.search(r"/web/(\d+)id_/", url):
+            captured = dt.strptime(match.group(1), "%Y%m%d%H%M%S").replace(tzinfo=UTC)
+            coverage = Coverage(5, captured - timedelta(days=5), captured)
+            return {"title": "", "description": "", "coverage": coverage}, [], None
+        return {}, [], None
+
+    with patch(
+        "history4feed.h4fscripts.task_helper.retrieve_posts_from_url",
+        side_effect=retrieve,
+    ) as mock_retrieve:
+        groups, _ = run_snapshot_groups(urls, job_obj.id)
+    assert groups == [urls[0:2], urls[2:3], urls[5:6] + urls[8:9], urls[9:10], urls[10:]]
+    read = [c[0][0] for c in mock_retrieve.call_args_list]
+    job_obj.refresh_from_db()
+    states = [d["state"] for d in job_obj.extra_data["feed_urls"]]
+    assert states == [
+        "completed" if url in read else "skipped" for url in urls
+    ]
+
+
+@pytest.mark.parametrize(
+    ["listing", "expected_state"],
+    [
+        (None, models.JobState.SUCCESS),
+        (dict(resume_key=None, pages=2, segments=2, segments_done=1), models.JobState.SUCCESS),
+        (dict(resume_key=None, pages=2, segments=2, segments_done=0), models.JobState.RUNNING),
+        (dict(resume_key="key", pages=2, segments=2, segments_done=1), models.JobState.RUNNING),
+    ],
+)
+@pytest.mark.django_db
+def test_collect_and_schedule_removal__cdx_segments(listing, expected_state):
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+        extra_data=dict(cdx_listing=listing) if listing else {},
+    )
+    with patch("history4feed.h4fscripts.task_helper.remove_lock") as mock_remove_lock:
+        collect_and_schedule_removal.run(job_obj.id)
+    job_obj.refresh_from_db()
+    assert job_obj.state == expected_state
+    assert mock_remove_lock.called == (expected_state == models.JobState.SUCCESS)
+
+
+@pytest.mark.django_db
+def test_start_job__cdx_page_fails():
+    job_obj = models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.RUNNING,
+        extra_data=dict(
+            use_feed_url_only=False,
+            cdx_listing=dict(resume_key="key", pages=2, segments=2, segments_done=1),
+        ),
+    )
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+        side_effect=Exception("failed"),
+    ):
+        assert start_job(job_obj.id) == []
+    job_obj.refresh_from_db()
+    assert job_obj.state == models.JobState.FAILED
+    # the other pages can still finish the job
+    assert job_obj.extra_data["cdx_listing"]["resume_key"] is None
+
+
+def listing_job(**extra_data):
+    return models.Job.objects.create(
+        feed=Feed.objects.create(
+            url="https://example.com/rss.xml",
+            title="Test Feed",
+            feed_type=models.FeedType.RSS,
+        ),
+        state=models.JobState.PENDING,
+        extra_data=dict(use_feed_url_only=False, **extra_data),
+    )
+
+
+@pytest.mark.django_db
+def test_start_job__deadline_mid_listing_resumes():
+    job_obj = listing_job()
+    snapshot = CDXSearchResult("com,example)/rss.xml", "20240102000000", "https://example.com/rss.xml", digest="BBB")
+
+    def timed_out_listing(*args, **kwargs):
+        yield CDXPage([], "key-1")
+        raise exceptions.DeadlineExceeded("deadline of 590s reached")
+
+    with (
+        patch(
+            "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+            side_effect=[timed_out_listing(), iter([CDXPage([snapshot], None)])],
+        ) as mock_iter_wayback_snapshots,
+        patch("history4feed.h4fscripts.task_helper.retry_countdown", return_value=0),
+    ):
+        assert start_job.delay(job_obj.id).get() == [
+            "https://web.archive.org/web/20240102000000id_/https://example.com/rss.xml",
+            job_obj.feed.url,
+        ]
+    # the second run asks the CDX server for the page after the last one listed
+    assert [c.kwargs["resume_key"] for c in mock_iter_wayback_snapshots.call_args_list] == [None, "key-1"]
+    job_obj.refresh_from_db()
+    assert job_obj.state == models.JobState.RUNNING
+    assert job_obj.extra_data["cdx_listing"] == dict(resume_key=None, pages=2, segments=1, segments_done=0)
+
+
+@pytest.mark.django_db
+def test_start_job__soft_time_limit_exhausted(settings):
+    settings.HISTORY4FEED_SETTINGS = dict(REQUEST_RETRY_COUNT=1)
+    job_obj = listing_job(cdx_listing=dict(resume_key="key-1", pages=1, segments=1, segments_done=0))
+    with (
+        patch(
+            "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+            side_effect=SoftTimeLimitExceeded(),
+        ) as mock_iter_wayback_snapshots,
+        patch("history4feed.h4fscripts.task_helper.retry_countdown", return_value=0),
+    ):
+        assert start_job.delay(job_obj.id).get() == []
+    assert [c.kwargs["resume_key"] for c in mock_iter_wayback_snapshots.call_args_list] == ["key-1", "key-1"]
+    job_obj.refresh_from_db()
+    assert job_obj.state == models.JobState.FAILED
 
 
 @pytest.mark.django_db
-def test_create_fulltexts_task_chain(feed_posts):
+def test_start_job__pages_per_task():
+    job_obj = listing_job()
+    pages = [CDXPage([], f"key-{i}") for i in range(1, 4)] + [CDXPage([], None)]
+    with (
+        patch(
+            "history4feed.h4fscripts.wayback_helpers.iter_wayback_snapshots",
+            side_effect=lambda *args, resume_key=None, **kwargs: iter(pages[int((resume_key or "key-0")[4:]):]),
+        ) as mock_iter_wayback_snapshots,
+        patch("history4feed.h4fscripts.task_helper.CDX_PAGES_PER_TASK", 2),
+    ):
+        with patch.object(start_job, "replace") as mock_replace:
+            assert start_job(job_obj.id) == mock_replace.return_value
+        # the listing continues in a new task after 2 pages without new captures
+        mock_replace.assert_called_once_with(start_job.si(job_obj.id))
+        assert start_job(job_obj.id) == [job_obj.feed.url]
+    assert [c.kwargs["resume_key"] for c in mock_iter_wayback_snapshots.call_args_list] == [None, "key-2"]
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["cdx_listing"]["pages"] == 4
+
+
+@pytest.mark.parametrize(
+    ["states", "expected_watermark", "expected_digests"],
+    [
+        (["completed", "completed", "completed"], "20240103000000", ["AAA", "BBB", "CCC", "OLD"]),
+        (["completed", "failed", "completed"], "20240101000000", ["AAA", "CCC", "OLD"]),
+        (["retrying", "completed", "completed"], "20231231000000", ["BBB", "CCC", "OLD"]),
+        (["queued", "queued", "queued"], "20231231000000", ["OLD"]),
+    ],
+)
+@pytest.mark.django_db
+def test_update_cdx_watermark(states, expected_watermark, expected_digests):
+    feed = Feed.objects.create(
+        url="https://example.com/rss.xml",
+        title="Test Feed",
+        feed_type=models.FeedType.RSS,
+        cdx_watermark="20231231000000",
+        cdx_digests={"OLD": "20231231000000"},
+    )
+    urls = [
+        "https://web.archive.org/web/20240101000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240102000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240103000000id_/https://example.com/rss.xml",
+    ]
+    job = models.Job.objects.create(
+        feed=feed,
+        extra_data=dict(
+            cdx_digests=dict(zip(urls, ["AAA", "BBB", "CCC"])),
+            feed_urls=[dict(link=url, state=state) for url, state in zip(urls, states)]
+            + [dict(link=feed.url, state="failed")],
+        ),
+    )
+    update_cdx_watermark(feed, job)
+    assert feed.cdx_watermark == expected_watermark
+    assert list(feed.cdx_digests) == expected_digests
+    assert feed.cdx_digests["OLD"] == "20231231000000"
+
+
+@pytest.mark.django_db
+def test_update_cdx_watermark__feed_url_only():
+    feed = Feed.objects.create(
+        url="https://example.com/rss.xml",
+        title="Test Feed",
+        feed_type=models.FeedType.RSS,
+    )
+    job = models.Job.objects.create(
+        feed=feed,
+        extra_data=dict(feed_urls=[dict(link=feed.url, state="completed")]),
+    )
+    update_cdx_watermark(feed, job)
+    assert feed.cdx_watermark is None
+    assert feed.cdx_digests == {}
+
+
+@pytest.mark.django_db
+def test_update_cdx_watermark__prunes_old_digests():
+    feed = Feed.objects.create(
+        url="https://example.com/rss.xml",
+        title="Test Feed",
+        feed_type=models.FeedType.RSS,
+        cdx_watermark="20240101000000",
+        cdx_digests={"OLD": "20230601000000", "AAA": "20231228000000"},
+    )
+    urls = [
+        "https://web.archive.org/web/20240102id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240201000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240202000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240301000000id_/https://example.com/rss.xml",
+    ]
+    job = models.Job.objects.create(
+        feed=feed,
+        extra_data=dict(
+            cdx_digests=dict(zip(urls, ["AAA", "BBB", "CCC", "DDD"])),
+            feed_urls=[dict(link=url, state=state) for url, state in zip(urls, ["completed", "failed", "completed", "completed"])],
+        ),
+    )
+    update_cdx_watermark(feed, job)
+    assert feed.cdx_watermark == "20240102000000"
+    # the failed capture holds the watermark back, digests from a week before it on are kept
+    assert feed.cdx_digests == {"AAA": "20240102000000", "CCC": "20240202000000", "DDD": "20240301000000"}
+    assert job.extra_data["cdx_digests"] == dict(zip(urls, ["AAA", "BBB", "CCC", "DDD"]))
+
+    job.extra_data["feed_urls"][1]["state"] = "completed"
+    job.save()
+    update_cdx_watermark(feed, job)
+    assert feed.cdx_watermark == "20240301000000"
+    assert feed.cdx_digests == {"DDD": "20240301000000"}
+    job.refresh_from_db()
+    assert job.extra_data["cdx_digests"] == {urls[3]: "DDD"}
+
+
+@pytest.mark.django_db
+def test_create_fulltexts_task_chain(feed_posts, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(FULLTEXT_ENGINE="chain")
     feed, posts = feed_posts
     job_obj = models.Job.objects.create(
         feed=feed,
@@ -422,6 +1028,252 @@ def test_create_fulltexts_task_chain(feed_posts):
         mock_retrieve_ft.assert_has_calls([call(ft.pk) for ft in fts], any_order=True)
 
 
+@pytest.mark.django_db
+def test_create_fulltexts_task_chain__asyncio(feed_posts, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(
+        FULLTEXT_ENGINE="asyncio",
+        FULLTEXT_CONCURRENCY=8,
+        FULLTEXT_PER_HOST_CONCURRENCY=1,
+        FULLTEXT_FETCH_TIMEOUT_SECONDS=100,
+    )
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.PENDING,
+    )
+
+    with (
+        patch(
+            "history4feed.h4fscripts.task_helper.retrieve_full_texts.run"
+        ) as mock_retrieve_fts,
+    ):
+        chain = create_fulltexts_task_chain(job_obj.id, posts)
+        [task] = chain.tasks
+        assert task.options["soft_time_limit"] == 300
+        chain.apply_async()
+        fts = models.FulltextJob.objects.filter(job_id=job_obj.id)
+        mock_retrieve_fts.assert_called_once_with(job_obj.id, [ft.pk for ft in fts])
+
+
+@pytest.mark.parametrize("engine", ["asyncio", "chain"])
+@pytest.mark.django_db
+def test_create_fulltexts_task_chain__queue(feed_posts, settings, engine):
+    settings.HISTORY4FEED_SETTINGS = dict(FULLTEXT_ENGINE=engine, FULLTEXT_QUEUE="fulltext")
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.PENDING)
+    chain = create_fulltexts_task_chain(job_obj.id, posts)
+    assert chain.tasks and all(task.options["queue"] == "fulltext" for task in chain.tasks)
+    settings.HISTORY4FEED_SETTINGS = dict(FULLTEXT_ENGINE=engine)
+    chain = create_fulltexts_task_chain(job_obj.id, posts)
+    assert not any("queue" in task.options for task in chain.tasks), "default queue"
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts(feed_posts, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(FULLTEXT_BATCH_SIZE=1)
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.RUNNING,
+        extra_data=dict(use_scrapfly_asp=True),
+    )
+    ft1, ft2 = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+
+    def get_full_text(link, use_scrapfly_asp, deadline):
+        assert use_scrapfly_asp == True
+        assert deadline.seconds == 95, "FULLTEXT_FETCH_TIMEOUT_SECONDS minus the task margin"
+        if link == posts[1].link:
+            raise Exception("boom")
+        return "<p>full text</p>", "text/html"
+
+    with patch("history4feed.h4fscripts.task_helper.h4f.get_full_text", side_effect=get_full_text):
+        retrieve_full_texts(job_obj.id, [ft1.pk, ft2.pk])
+    ft1.refresh_from_db()
+    ft2.refresh_from_db()
+    assert (ft1.status, ft1.error_str) == (FullTextState.RETRIEVED, "")
+    assert (ft2.status, ft2.error_str) == (FullTextState.FAILED, "boom")
+    assert ft1.post.is_full_text == True
+    assert ft1.post.description == "<p>full text</p>"
+    assert ft1.post.content_type == "text/html"
+    assert ft2.post.is_full_text == False
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts__long_error(feed_posts):
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.RUNNING, extra_data=dict(use_scrapfly_asp=False))
+    ft1, ft2 = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+
+    def get_full_text(link, use_scrapfly_asp, deadline):
+        if link == posts[1].link:
+            raise Exception("boom " * 1000)
+        return "<p>full text</p>", "text/html"
+
+    with patch("history4feed.h4fscripts.task_helper.h4f.get_full_text", side_effect=get_full_text):
+        retrieve_full_texts(job_obj.id, [ft1.pk, ft2.pk])
+    ft1.refresh_from_db()
+    ft2.refresh_from_db()
+    assert ft1.status == FullTextState.RETRIEVED
+    assert ft2.status == FullTextState.FAILED
+    assert len(ft2.error_str) == 1500
+    assert ft2.error_str.startswith("boom boom")
+
+
+@pytest.mark.django_db
+def test_save_fulltext_jobs__bad_row_only_fails_itself(feed_posts):
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(feed=feed, state=models.JobState.RUNNING)
+    ft1, ft2 = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link, status=FullTextState.RETRIEVING)
+        for post in posts
+    ]
+    ft1.status, ft1.error_str = FullTextState.RETRIEVED, ""
+    ft1.post.description, ft1.post.is_full_text = "<p>full text</p>", True
+    ft2.status, ft2.error_str = FullTextState.FAILED, "bad row"
+    bulk_update = models.FulltextJob.objects.bulk_update
+
+    def failing_bulk_update(objs, fields):
+        if any(ft.error_str == "bad row" for ft in objs):
+            raise DataError("value rejected")
+        return bulk_update(objs, fields)
+
+    with patch.object(models.FulltextJob.objects, "bulk_update", side_effect=failing_bulk_update) as mock_bulk_update:
+        save_fulltext_jobs([ft1, ft2])
+    # the batch, then each row on its own
+    assert mock_bulk_update.call_count == 3
+    ft1.refresh_from_db()
+    ft2.refresh_from_db()
+    assert ft1.status == FullTextState.RETRIEVED
+    assert ft1.post.description == "<p>full text</p>"
+    assert ft2.status == FullTextState.FAILED
+    assert ft2.error_str.startswith("could not save result:")
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts__host_down(feed_posts):
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.RUNNING,
+        extra_data=dict(use_scrapfly_asp=False, hosts_down={"example.com": 1}),
+    )
+    fts = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+    with patch(
+        "history4feed.h4fscripts.task_helper.h4f.get_full_text",
+        side_effect=exceptions.HostCircuitOpen("`example.com` is down"),
+    ):
+        retrieve_full_texts(job_obj.id, [ft.pk for ft in fts])
+    for ft in fts:
+        ft.refresh_from_db()
+        assert (ft.status, ft.error_str) == (FullTextState.FAILED, "`example.com` is down")
+    job_obj.refresh_from_db()
+    assert job_obj.extra_data["hosts_down"] == {"example.com": 1, "example.net": 2}
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts__countdown_retry(feed_posts, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown", REQUEST_RETRY_COUNT=2)
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.RUNNING,
+        extra_data=dict(use_scrapfly_asp=False),
+    )
+    ft1, ft2 = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+    calls = []
+
+    def get_full_text(link, use_scrapfly_asp, retry_count, deadline):
+        assert retry_count == 0
+        calls.append(link)
+        if link == posts[0].link and calls.count(link) < 2:
+            raise exceptions.history4feedException("fulltext failed") from ConnectionError("timeout")
+        if link == posts[1].link:
+            raise exceptions.history4feedException("fulltext failed") from ConnectionError("timeout")
+        return "<p>full text</p>", "text/html"
+
+    with patch("history4feed.h4fscripts.task_helper.h4f.get_full_text", side_effect=get_full_text):
+        retrieve_full_texts.delay(job_obj.id, [ft1.pk, ft2.pk])
+    ft1.refresh_from_db()
+    ft2.refresh_from_db()
+    assert ft1.status == FullTextState.RETRIEVED
+    assert (ft2.status, ft2.error_str) == (FullTextState.FAILED, "fulltext failed")
+    assert calls.count(posts[0].link) == 2
+    assert calls.count(posts[1].link) == 3, "first attempt + 2 retries"
+
+
+@pytest.mark.django_db
+def test_retrieve_full_text__countdown_retry(feed_posts, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(RETRY_MODE="countdown", REQUEST_RETRY_COUNT=2)
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.RUNNING,
+        extra_data=dict(use_scrapfly_asp=False),
+    )
+    ftjob = models.FulltextJob.objects.create(job=job_obj, post=posts[0], link=posts[0].link)
+    with patch(
+        "history4feed.h4fscripts.task_helper.h4f.get_full_text",
+        side_effect=[ConnectionError("timeout"), ("<p>full text</p>", "text/html")],
+    ) as mock_get_full_text:
+        retrieve_full_text.delay(ftjob.pk)
+    mock_get_full_text.assert_called_with(posts[0].link, use_scrapfly_asp=False, deadline=ANY, retry_count=0)
+    ftjob.refresh_from_db()
+    assert (ftjob.status, ftjob.error_str) == (FullTextState.RETRIEVED, "")
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts__cancelled(feed_posts):
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.CANCELLED,
+        extra_data=dict(use_scrapfly_asp=False),
+    )
+    fts = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+    with patch("history4feed.h4fscripts.task_helper.h4f.get_full_text") as mock_get_full_text:
+        retrieve_full_texts(job_obj.id, [ft.pk for ft in fts])
+        mock_get_full_text.assert_not_called()
+    for ft in fts:
+        ft.refresh_from_db()
+        assert ft.status == FullTextState.CANCELLED
+
+
+@pytest.mark.django_db
+def test_retrieve_full_texts__soft_timeout(feed_posts):
+    from celery.exceptions import SoftTimeLimitExceeded
+    feed, posts = feed_posts
+    job_obj = models.Job.objects.create(
+        feed=feed,
+        state=models.JobState.RUNNING,
+        extra_data=dict(use_scrapfly_asp=False),
+    )
+    fts = [
+        models.FulltextJob.objects.create(job=job_obj, post=post, link=post.link)
+        for post in posts
+    ]
+    with patch("history4feed.h4fscripts.task_helper.fulltext_engine.FulltextEngine.run", side_effect=SoftTimeLimitExceeded()):
+        retrieve_full_texts(job_obj.id, [ft.pk for ft in fts])
+    for ft in fts:
+        ft.refresh_from_db()
+        assert ft.status == FullTextState.TIMED_OUT
+        assert "SoftTimeLimitExceeded" in ft.error_str
+
+
 @pytest.mark.django_db
 def test_retrieve_posts_from_serper():
     job_obj = models.Job.objects.create(
@@ -469,11 +1321,14 @@ def test_retrieve_posts_from_serper():
         ) as mock_add_post_to_db,
     ):
         url = "https://example.net"
-        results = retrieve_posts_from_serper(job_obj.feed, job_obj, url)
+        results, searched_until = retrieve_posts_from_serper(job_obj.feed, job_obj, url)
         mock_fetch.assert_called_once_with(
-            url, from_time=dt(2023, 1, 2, tzinfo=UTC), to_time=job_obj.run_datetime
+            url, from_time=dt(2023, 1, 2, tzinfo=UTC), to_time=job_obj.run_datetime, credits=ANY, deadline=ANY
         )
         assert len(results) == 4
+        assert searched_until is None
+        job_obj.refresh_from_db()
+        assert job_obj.extra_data["serper_credits"] == dict(budget=1000, used=0, exhausted=False)
         mock_add_post_to_db.call_count == 4
 
 def test_retrieve_posts_from_url():
@@ -493,16 +1348,14 @@ def dummy_job():
 
 
 @patch("history4feed.h4fscripts.task_helper.add_post_to_db")
-@patch("history4feed.h4fscripts.task_helper.h4f.parse_posts_from_rss_feed")
-@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed_from_content")
+@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed")
 @patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
 @patch("history4feed.h4fscripts.task_helper.time.sleep")
-def test_retrieve_posts_rss_success(mock_sleep, mock_fetch, mock_parse_feed, mock_parse_rss, mock_add_post, dummy_feed, dummy_job):
+def test_retrieve_posts_rss_success(mock_sleep, mock_fetch, mock_parse_feed, mock_add_post, dummy_feed, dummy_job):
     url = "https://example.com/rss"
 
     mock_fetch.return_value = (b"<xml>RSS</xml>", "text/xml", url)
-    mock_parse_feed.return_value = {"feed_type": FeedType.RSS}
-    mock_parse_rss.return_value = {"1": {"title": "Post 1"}, "2": {"title": "Post 2"}}
+    mock_parse_feed.return_value = h4f.ParsedFeed({"feed_type": FeedType.RSS}, iter([PostDict("https://example.com/1", "Post 1", dt(2024, 1, 1, tzinfo=UTC)), PostDict("https://example.com/2", "Post 2", dt(2024, 1, 2, tzinfo=UTC))]))
     post1 = MagicMock(spec=Post)
     post2 = MagicMock(spec=Post)
     mock_add_post.side_effect = [post1, post2]
@@ -510,22 +1363,22 @@ def test_retrieve_posts_rss_success(mock_sleep, mock_fetch, mock_parse_feed, moc
     parsed_feed, all_posts, error = retrieve_posts_from_url(url, dummy_feed, dummy_job)
 
     assert parsed_feed['feed_type'] == FeedType.RSS
+    assert parsed_feed['coverage'] == Coverage(2, dt(2024, 1, 1, tzinfo=UTC), dt(2024, 1, 2, tzinfo=UTC))
     assert all_posts == [post1, post2]
     assert error is None
     mock_fetch.assert_called_once_with(url)
-    dummy_feed.save.assert_called_once()
+    mock_parse_feed.assert_called_once_with(b"<xml>RSS</xml>", url)
+    dummy_feed.save.assert_not_called()
 
 
 @patch("history4feed.h4fscripts.task_helper.add_post_to_db")
-@patch("history4feed.h4fscripts.task_helper.h4f.parse_posts_from_atom_feed")
-@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed_from_content")
+@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed")
 @patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
 @patch("time.sleep")
-def test_retrieve_posts_atom_success(mock_sleep, mock_fetch, mock_parse_feed, mock_parse_atom, mock_add_post, dummy_feed, dummy_job):
+def test_retrieve_posts_atom_success(mock_sleep, mock_fetch, mock_parse_feed, mock_add_post, dummy_feed, dummy_job):
     url = "https://example.com/atom"
     mock_fetch.return_value = (b"<xml>ATOM</xml>", "text/xml", url)
-    mock_parse_feed.return_value = {"feed_type": FeedType.ATOM}
-    mock_parse_atom.return_value = {"1": {"title": "A1"}}
+    mock_parse_feed.return_value = h4f.ParsedFeed({"feed_type": FeedType.ATOM}, iter([PostDict("https://example.com/1", "A1", dt(2024, 1, 1, tzinfo=UTC))]))
     post = MagicMock(spec=Post)
     mock_add_post.return_value = post
 
@@ -537,12 +1390,12 @@ def test_retrieve_posts_atom_success(mock_sleep, mock_fetch, mock_parse_feed, mo
 
 
 @patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
-@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed_from_content")
+@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed")
 @patch("time.sleep")
 def test_retrieve_posts_unknown_feedtype(mock_sleep, mock_parse_feed, mock_fetch, dummy_feed, dummy_job):
     url = "https://unknown.feed"
     mock_fetch.return_value = (b"<xml>???</xml>", "text/xml", url)
-    mock_parse_feed.return_value = {"feed_type": "UNKNOWN"}
+    mock_parse_feed.return_value = h4f.ParsedFeed({"feed_type": "UNKNOWN"}, iter([]))
 
     _, _, err = retrieve_posts_from_url(url, dummy_feed, dummy_job)
     assert isinstance(err,  exceptions.UnknownFeedtypeException)
@@ -574,6 +1427,15 @@ def test_retrieve_posts_connection_error_retries(mock_sleep, mock_fetch, dummy_f
     assert mock_sleep.call_count == 2  # called only after the first attempt fails
 
 
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries", side_effect=ConnectionError("Timeout"))
+@patch("time.sleep")
+def test_retrieve_posts_connection_error_no_retry(mock_sleep, mock_fetch, dummy_feed, dummy_job):
+    parsed_feed, all_posts, error = retrieve_posts_from_url("https://retry.fail", dummy_feed, dummy_job, retry=False)
+    assert isinstance(error, ConnectionError)
+    mock_fetch.assert_called_once_with("https://retry.fail", retry_count=0)
+    mock_sleep.assert_not_called()
+
+
 @patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
 @patch("history4feed.h4fscripts.task_helper.add_post_to_db")
 @patch("time.sleep")
@@ -594,6 +1456,7 @@ def test_retrieve_posts_connection_error_successful_after_retry(mock_sleep, mock
         "title": "Your awesome title",
         "feed_type": "atom",
         "url": "https://retry.fail",
+        "coverage": Coverage(7, dt(2024, 8, 1, 8, tzinfo=UTC), dt(2024, 9, 1, 8, tzinfo=UTC)),
     }
     mock_add_post.assert_called()
     assert mock_add_post.call_count == 7
@@ -602,6 +1465,111 @@ def test_retrieve_posts_connection_error_successful_after_retry(mock_sleep, mock
     assert mock_sleep.call_count == 2  # called only after the first attempt fails
 
 
+@pytest.fixture
+def live_feed_job(dummy_feed, dummy_job):
+    dummy_feed.url = "https://example.com/feed.xml"
+    dummy_feed.etag = '"v1"'
+    dummy_feed.last_modified = "Mon, 30 Sep 2024 00:00:00 GMT"
+    dummy_feed.content_hash = None
+    dummy_job.extra_data = dict(use_feed_url_only=True, force_full_fetch=False)
+    return dummy_feed, dummy_job
+
+
+@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed")
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries", side_effect=exceptions.NotModified("not modified"))
+def test_retrieve_posts_not_modified(mock_fetch, mock_parse_feed, live_feed_job):
+    feed, job = live_feed_job
+    parsed_feed, all_posts, error = retrieve_posts_from_url(feed.url, feed, job)
+    assert (parsed_feed, all_posts, error) == ({}, [], None)
+    validators = mock_fetch.call_args[1]["validators"]
+    assert validators.as_headers() == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 30 Sep 2024 00:00:00 GMT"}
+    mock_parse_feed.assert_not_called()
+    feed.save.assert_not_called()
+
+
+@patch("history4feed.h4fscripts.task_helper.h4f.parse_feed")
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
+def test_retrieve_posts_unchanged_hash(mock_fetch, mock_parse_feed, live_feed_job):
+    import hashlib
+    feed, job = live_feed_job
+    mock_fetch.return_value = (b"<rss/>", "text/xml", feed.url)
+    feed.content_hash = hashlib.sha256(b"<rss/>").hexdigest()
+    parsed_feed, all_posts, error = retrieve_posts_from_url(feed.url, feed, job)
+    assert (parsed_feed, all_posts, error) == ({}, [], None)
+    mock_parse_feed.assert_not_called()
+    feed.save.assert_not_called()
+
+
+@pytest.mark.parametrize("force_full_fetch", [True, False])
+@patch("history4feed.h4fscripts.task_helper.add_post_to_db")
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
+def test_retrieve_posts_stores_validators(mock_fetch, mock_add_post, live_feed_job, force_full_fetch):
+    import hashlib
+    feed, job = live_feed_job
+    job.extra_data["force_full_fetch"] = force_full_fetch
+    feed.content_hash = "stale"
+    sent_headers = []
+
+    def fetch(url, validators):
+        sent_headers.append(validators.as_headers())
+        validators.etag = '"v2"'
+        validators.last_modified = None
+        return atom_example.encode(), "text/xml", url
+
+    mock_fetch.side_effect = fetch
+    parsed_feed, all_posts, error = retrieve_posts_from_url(feed.url, feed, job)
+    assert error is None
+    assert parsed_feed["feed_type"] == "atom"
+    assert mock_add_post.call_count == 7
+    if force_full_fetch:
+        assert sent_headers == [{}]
+    else:
+        assert sent_headers == [{"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 30 Sep 2024 00:00:00 GMT"}]
+    assert feed.etag == '"v2"'
+    assert feed.last_modified is None
+    assert feed.content_hash == hashlib.sha256(atom_example.encode()).hexdigest()
+    feed.save.assert_called_once_with(update_fields=["etag", "last_modified", "content_hash"])
+
+
+@patch("history4feed.h4fscripts.task_helper.add_post_to_db")
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
+def test_retrieve_posts_uses_snapshot_store(mock_fetch, mock_add_post, dummy_feed, dummy_job, settings, tmp_path):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_STORE_DIR=str(tmp_path))
+    url = "https://web.archive.org/web/20240901000000id_/https://example.com/feed.xml"
+    mock_fetch.return_value = (atom_example.encode(), "text/xml", url)
+
+    for _ in range(2):
+        parsed_feed, all_posts, error = retrieve_posts_from_url(url, dummy_feed, dummy_job)
+        assert error is None
+        assert parsed_feed["feed_type"] == "atom"
+    mock_fetch.assert_called_once_with(url)
+    assert mock_add_post.call_count == 14
+
+
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
+def test_fetch_feed_page__unreadable_archive(mock_fetch, settings, tmp_path):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_STORE_DIR=str(tmp_path))
+    url = "https://web.archive.org/web/20240901000000id_/https://example.com/feed.xml"
+    store = snapshot_store.get_store()
+    store.put(url, b"<rss/>")
+    store.object_path(store.ref_path(url).read_text()).write_bytes(b"corrupt")
+    mock_fetch.return_value = (b"<rss/>", "text/xml", url)
+    assert fetch_feed_page(url) == (b"<rss/>", "text/xml", url)
+    mock_fetch.assert_called_once_with(url)
+    assert store.get(url) == b"<rss/>", "archived again from the network copy"
+
+
+@patch("history4feed.h4fscripts.task_helper.train_snapshot_dict.delay")
+@patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries")
+def test_fetch_feed_page__trains_dictionary_in_background(mock_fetch, mock_train, settings, tmp_path):
+    settings.HISTORY4FEED_SETTINGS = dict(SNAPSHOT_STORE_DIR=str(tmp_path), SNAPSHOT_STORE_DICT_SAMPLES=2)
+    urls = [f"https://web.archive.org/web/2024090{i}000000id_/https://example.com/feed.xml" for i in range(1, 4)]
+    for i, url in enumerate(urls):
+        mock_fetch.return_value = (f"<rss>{i}</rss>".encode(), "text/xml", url)
+        fetch_feed_page(url)
+    mock_train.assert_called_once_with(urls[1])
+
+
 @patch("history4feed.h4fscripts.task_helper.h4f.fetch_page_with_retries", side_effect=ValueError("boom"))
 @patch("time.sleep")
 def test_retrieve_posts_general_exception(mock_sleep, mock_fetch, dummy_feed, dummy_job):
@@ -640,7 +1608,7 @@ def test_retrieve_full_text_success(mock_get_job, mock_get_full_text, mock_logge
 
     retrieve_full_text(dummy_ftjob.pk)
 
-    mock_get_full_text.assert_called_once_with(dummy_ftjob.post.link, use_scrapfly_asp=use_scrapfly_asp)
+    mock_get_full_text.assert_called_once_with(dummy_ftjob.post.link, use_scrapfly_asp=use_scrapfly_asp, deadline=ANY)
     assert dummy_ftjob.status == FullTextState.RETRIEVED
     assert dummy_ftjob.error_str == ""
     assert dummy_ftjob.post.description == "<p>Content</p>"
@@ -650,6 +1618,19 @@ def test_retrieve_full_text_success(mock_get_job, mock_get_full_text, mock_logge
     dummy_ftjob.post.save.assert_called_once()
 
 
+@patch("history4feed.h4fscripts.task_helper.h4f.get_full_text", side_effect=exceptions.DeadlineExceeded("not enough time left"))
+@patch("history4feed.h4fscripts.task_helper.models.FulltextJob.objects.get")
+def test_retrieve_full_text_deadline_exceeded(mock_get_job, mock_get_text, dummy_ftjob):
+    mock_get_job.return_value = dummy_ftjob
+    dummy_ftjob.is_cancelled.return_value = False
+    dummy_ftjob.job.extra_data = {"use_scrapfly_asp": False}
+
+    retrieve_full_text(dummy_ftjob.pk)
+
+    assert dummy_ftjob.status == FullTextState.TIMED_OUT
+    assert dummy_ftjob.error_str == "task timed out: not enough time left"
+
+
 @patch("history4feed.h4fscripts.task_helper.models.FulltextJob.objects.get")
 def test_retrieve_full_text_cancelled(mock_get_job, dummy_ftjob):
     mock_get_job.return_value = dummy_ftjob
@@ -744,4 +1725,35 @@ def test_add_post_to_db__truncates_title(jobs):
     post = add_post_to_db(feed, job, mdict)
     assert post.title <= orig_title
     assert orig_title.startswith(post.title)
-    assert len(post.title) <= 300
\ No newline at end of file
+    assert len(post.title) <= 300
+
+
+@pytest.mark.parametrize(
+    ["policy", "description", "is_full_text", "expected"],
+    [
+        (models.FeedContentPolicy.NEVER, "word " * 300, True, False),
+        (models.FeedContentPolicy.AUTO, "word " * 300, True, True),
+        (models.FeedContentPolicy.AUTO, "word " * 300 + "[...]", True, False),
+        (models.FeedContentPolicy.AUTO, "word", True, False),
+        (models.FeedContentPolicy.ALWAYS, "word", True, True),
+        (models.FeedContentPolicy.ALWAYS, "  ", True, False),
+        (models.FeedContentPolicy.ALWAYS, "word " * 300, False, False),
+    ],
+)
+@pytest.mark.django_db
+def test_add_post_to_db__feed_content_policy(jobs, policy, description, is_full_text, expected):
+    job = jobs[0]
+    job.include_remote_blogs = True
+    feed = job.feed
+    feed.feed_content_policy = policy
+    mdict = PostDict('http://example.com/post', 'title', dt.now(UTC), '', [], description=description, is_full_text=is_full_text)
+    post = add_post_to_db(feed, job, mdict)
+    assert post.is_full_text == expected
+    post.refresh_from_db()
+    assert post.is_full_text == expected
+
+
+def test_http_sessions_closed_on_worker_process_shutdown():
+    with patch("history4feed.h4fscripts.task_helper.http_client.close_sessions") as mock_close:
+        celery.signals.worker_process_shutdown.send(sender=None, pid=1, exitcode=0)
+    mock_close.assert_called_once_with()
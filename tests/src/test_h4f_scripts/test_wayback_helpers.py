@@ -0,0 +1,114 @@
+from datetime import UTC, datetime as dt
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from history4feed.h4fscripts import wayback_helpers
+from history4feed.h4fscripts.wayback_helpers import CDXPage, CDXSearchResult
+
+
+FEED_URL = "https://example.com/rss.xml"
+PAGE_1 = b"""[["urlkey","timestamp","original","digest"],
+["com,example)/rss.xml","20240102000000","https://example.com/rss.xml","BBB"],
+["com,example)/rss.xml","20240101000000","https://example.com/rss.xml","AAA"],
+[],
+["com%2Cexample%29%2Frss.xml+20240102000000"]]"""
+PAGE_2 = b"""[["urlkey","timestamp","original","digest"],
+["com,example)/rss.xml","20240103000000","https://example.com/rss.xml","CCC"],
+["com,example)/rss.xml","20240104000000","https://example.com/rss.xml","AAA"]]"""
+
+
+def snapshot(timestamp, digest):
+    return CDXSearchResult("com,example)/rss.xml", timestamp, FEED_URL, digest=digest)
+
+
+@pytest.fixture
+def mock_fetch():
+    with patch(
+        "history4feed.h4fscripts.wayback_helpers.fetch_page_with_retries",
+        side_effect=[
+            (PAGE_1, "application/json", "http://web.archive.org/cdx/search/cdx"),
+            (PAGE_2, "application/json", "http://web.archive.org/cdx/search/cdx"),
+        ],
+    ) as mock_fetch:
+        yield mock_fetch
+
+
+def cdx_query(mock_fetch, index=-1):
+    return parse_qs(urlparse(mock_fetch.call_args_list[index][0][0]).query)
+
+
+@pytest.mark.parametrize(
+    ["since", "expected_from"],
+    [
+        (None, "20240101"),
+        ("20231201000000", "20240101"),
+        ("20240101000000", "20240101"),
+        ("20240101120000", "20240101120000"),
+    ],
+)
+def test_cdx_search_page__since(mock_fetch, since, expected_from):
+    wayback_helpers.cdx_search_page(FEED_URL, dt(2024, 1, 1, tzinfo=UTC), dt(2024, 2, 1, tzinfo=UTC), since=since)
+    query = cdx_query(mock_fetch)
+    assert query["from"] == [expected_from]
+    assert query["to"] == ["20240201"]
+
+
+def test_cdx_search_page(mock_fetch, settings):
+    settings.HISTORY4FEED_SETTINGS = dict(CDX_PAGE_SIZE=2)
+    page = wayback_helpers.cdx_search_page(FEED_URL, dt(2024, 1, 1, tzinfo=UTC))
+    assert page == CDXPage(
+        [snapshot("20240102000000", "BBB"), snapshot("20240101000000", "AAA")],
+        "com%2Cexample%29%2Frss.xml+20240102000000",
+    )
+    query = cdx_query(mock_fetch)
+    assert query["fl"] == ["urlkey,timestamp,original,digest"]
+    assert query["limit"] == ["2"]
+    assert query["showResumeKey"] == ["true"]
+    assert "resumeKey" not in query
+
+    page = wayback_helpers.cdx_search_page(FEED_URL, dt(2024, 1, 1, tzinfo=UTC), resume_key=page.resume_key)
+    assert page.resume_key is None
+    assert cdx_query(mock_fetch)["resumeKey"] == ["com%2Cexample%29%2Frss.xml+20240102000000"]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"[]", b"", b'[["urlkey","timestamp","original","digest"]]'],
+)
+def test_parse_cdx_page__empty(body):
+    assert wayback_helpers.parse_cdx_page(body) == CDXPage([])
+
+
+def test_cdx_search(mock_fetch):
+    assert wayback_helpers.cdx_search(FEED_URL, dt(2024, 1, 1, tzinfo=UTC)) == [
+        snapshot("20240102000000", "BBB"),
+        snapshot("20240101000000", "AAA"),
+        snapshot("20240103000000", "CCC"),
+    ]
+    assert mock_fetch.call_count == 2
+
+
+def test_iter_wayback_snapshots(mock_fetch):
+    pages = wayback_helpers.iter_wayback_snapshots(FEED_URL, dt(2024, 1, 1, tzinfo=UTC), seen_digests=["BBB"])
+    assert next(pages) == CDXPage([snapshot("20240101000000", "AAA")], "com%2Cexample%29%2Frss.xml+20240102000000")
+    # the second page is only requested once the first one is used
+    assert mock_fetch.call_count == 1
+    assert next(pages) == CDXPage([snapshot("20240103000000", "CCC")], None)
+    assert next(pages, None) is None
+
+
+def test_iter_wayback_snapshots__resume(mock_fetch):
+    pages = wayback_helpers.iter_wayback_snapshots(FEED_URL, dt(2024, 1, 1, tzinfo=UTC), resume_key="key")
+    next(pages)
+    assert cdx_query(mock_fetch)["resumeKey"] == ["key"]
+
+
+def test_get_wayback_urls(mock_fetch):
+    assert wayback_helpers.get_wayback_urls(FEED_URL, dt(2024, 1, 1, tzinfo=UTC)) == [
+        "https://web.archive.org/web/20240101000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240102000000id_/https://example.com/rss.xml",
+        "https://web.archive.org/web/20240103000000id_/https://example.com/rss.xml",
+        FEED_URL,
+    ]
@@ -0,0 +1,94 @@
+from datetime import UTC, datetime
+
+import pytest
+
+from history4feed.app import models
+from history4feed.h4fscripts import exceptions, h4f, wayback_helpers
+from history4feed.h4fscripts.task_helper import retrieve_posts_from_url
+from tests.benchmarks.wayback_standin import Faults, SyntheticCorpus, serve
+
+
+def corpus(base_url):
+    # 2 captures a day of a feed with a post a day, so every other capture is new
+    return SyntheticCorpus(base_url, captures=40, days=20, posts_per_day=1, items=5)
+
+
+def standin_settings(server, **kwargs):
+    return dict(
+        WAYBACK_URL=server.url,
+        SCRAPFLY_URL=f"{server.url}/scrape",
+        SCRAPFLY_APIKEY="",
+        WAYBACK_SLEEP_SECONDS=0,
+        EXTRACTION_PROCESSES=0,
+        CIRCUIT_BREAKER_FAILURE_THRESHOLD=0,
+        HOST_RATE_LIMITS=dict(default=dict(rate=1000, burst=1000)),
+    ) | kwargs
+
+
+@pytest.fixture
+def standin(settings):
+    with serve(corpus) as server:
+        settings.HISTORY4FEED_SETTINGS = standin_settings(server, CDX_PAGE_SIZE=7)
+        yield server
+
+
+def test_cdx_listing(standin):
+    feed_url = standin.corpus.feed_url(0)
+    pages = list(
+        wayback_helpers.iter_wayback_snapshots(
+            feed_url, datetime(2024, 1, 1, tzinfo=UTC), datetime(2024, 2, 1, tzinfo=UTC), retry_count=0
+        )
+    )
+    snapshots = [snapshot for page in pages for snapshot in page.results]
+    assert len(pages) == 3
+    assert len(snapshots) == len({c.digest for c in standin.corpus.captures(feed_url)}) == 20
+    assert wayback_helpers.get_snapshot_url(snapshots[0]).startswith(f"{standin.url}/web/")
+    assert standin.stats["cdx 200"] == 3
+
+
+def test_snapshot_and_full_text(standin):
+    feed_url = standin.corpus.feed_url(0)
+    url = f"{standin.url}/web/20240105000000id_/{feed_url}"
+    data, content_type, _ = h4f.fetch_page_with_retries(url, retry_count=0)
+    posts = list(h4f.parse_feed(data, url).posts)
+    assert [post.title for post in posts] == ["Post 4", "Post 3", "Post 2", "Post 1", "Post 0"]
+    html, content_type = h4f.get_full_text(posts[0].link, use_scrapfly_asp=False, retry_count=0)
+    assert "Post 4" in html
+    assert content_type == "text/html; charset=utf-8"
+
+
+def test_scrapfly(standin, settings):
+    settings.HISTORY4FEED_SETTINGS = standin_settings(standin, SCRAPFLY_APIKEY="key", SCRAPFLY_ROUTING="always")
+    html, _ = h4f.get_full_text(standin.corpus.post_url(0, 3), use_scrapfly_asp=True, retry_count=0)
+    assert "Post 3" in html
+    assert standin.stats["scrape 200"] == 1
+
+
+@pytest.mark.django_db
+def test_retrieve_posts_from_url(standin):
+    feed = models.Feed.objects.create(url=standin.corpus.feed_url(0), feed_type=models.FeedType.RSS)
+    job = models.Job.objects.create(feed=feed, state=models.JobState.RUNNING, extra_data={})
+    url = f"{standin.url}/web/20240110120000id_/{feed.url}"
+    parsed_feed, posts, error = retrieve_posts_from_url(url, feed, job, retry=False)
+    assert error is None
+    assert parsed_feed["title"] == "Stand-in feed 0"
+    assert len(posts) == 5
+    assert parsed_feed["coverage"].newest == datetime(2024, 1, 10, tzinfo=UTC)
+
+
+@pytest.mark.parametrize(
+    ["faults", "expected"],
+    [
+        (Faults(error_rate=1), exceptions.ServerError),
+        (Faults(rate=0.001, burst=1), exceptions.RateLimited),
+    ],
+)
+def test_faults(settings, faults, expected):
+    with serve(corpus, faults) as server:
+        settings.HISTORY4FEED_SETTINGS = standin_settings(server)
+        url = server.corpus.feed_url(0)
+        if faults.rate:
+            h4f.fetch_page_with_retries(url, retry_count=0)
+        with pytest.raises(ConnectionError) as exc_info:
+            h4f.fetch_page_with_retries(url, retry_count=0)
+        assert isinstance(exc_info.value.__cause__, expected)
@@ -101,3 +101,5 @@ def test_job__has_failures(jobs):
     assert job.has_failures is False
     job.extra_data['feed_urls'][0]['state'] = "failed"
     assert job.has_failures is True
+    job.extra_data['feed_urls'][0]['state'] = "partial"
+    assert job.has_failures is True